@@ -1,5 +1,9 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from datetime import datetime, timedelta, UTC
-from typing import Optional
+from typing import Any, Callable, Dict, Optional, TypeVar
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
@@ -23,6 +27,88 @@ def get_hashed_password(plain_password):
     return pwd_context.hash(plain_password)
 
 
+# ── Off-loop hashing ──────────────────────────────────────────────────────────
+# One bcrypt call takes 100-300+ ms of CPU.  Run inline in a handler it
+# freezes the event loop — and every device request on it — for that long,
+# so the async handlers go through a small dedicated thread pool instead
+# (bcrypt releases the GIL).  The pool's threads run at a lower CPU priority
+# (PASSWORD_HASH_NICE, Linux) so on a small box the event loop still wins
+# the core.  At most PASSWORD_HASH_QUEUE calls may wait for a thread; beyond
+# that PasswordHasherBusy is raised (the API answers 429) rather than letting
+# a login storm queue without bound.
+
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS") or max(1, (os.cpu_count() or 2) // 2)
+)
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE") or 16)
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE") or 10)
+
+T = TypeVar("T")
+
+
+class PasswordHasherBusy(Exception):
+    """Every hashing thread is busy and the wait queue is full."""
+
+
+def _lower_priority() -> None:
+    # On Linux the nice value is per thread, so only the pool threads drop.
+    with suppress(AttributeError, OSError):
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PASSWORD_HASH_NICE)
+
+
+class _HashPool:
+    def __init__(self, workers: int, max_queue: int) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0  # running + waiting
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="bcrypt",
+                initializer=_lower_priority,
+            )
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(self.pending, self.workers),
+            "waiting": max(self.pending - self.workers, 0),
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hash_pool = _HashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_hashed_password_async(plain_password) -> str:
+    return await hash_pool.run(get_hashed_password, plain_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
 
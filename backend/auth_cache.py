@@ -0,0 +1,174 @@
+"""
+auth_cache.py
+─────────────
+In-process caches behind ``get_current_user``.
+
+Every dashboard / plant request carries the same bearer token, and each one
+used to verify its HMAC signature and then look the user up by email.  Both
+results are cached here:
+
+  • verified tokens — keyed by the SHA-256 of the token string, holding the
+    subject, until the token's own ``exp``.  Only a byte-identical token can
+    hit, so a tampered one is always verified (and rejected) in full.
+  • user identities — email → ``UserRef`` (id + email), for
+    ``AUTH_USER_CACHE_TTL`` seconds.  Handlers only need the id, so this
+    never loads a full ``User`` row, let alone its relationships.
+
+A token hit still resolves the user through the identity cache, so a deleted
+user stops authenticating as soon as their identity entry goes.  Deleting a
+user through the ORM does that automatically (``after_delete`` listener);
+code that removes users any other way must call ``invalidate_user(email)``.
+With several backend processes the TTL bounds how long the others keep
+accepting a deleted user.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from jose import JWTError, jwt
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from auth import ALGORITHM, SECRET_KEY
+from models import User
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+_USER_CACHE_SIZE: int = int(os.getenv("AUTH_USER_CACHE_SIZE", "4096"))
+_USER_CACHE_TTL: float = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+
+@dataclass(frozen=True, slots=True)
+class UserRef:
+    """The authenticated user, as handlers see it."""
+
+    id: int
+    email: str
+
+
+# ── Caches ────────────────────────────────────────────────────────────────────
+
+
+class _ExpiringLRU:
+    """Bounded LRU whose entries carry their own expiry time."""
+
+    def __init__(self, max_size: int, clock) -> None:
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Any) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Any, value: Any, expires_at: float) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Any) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Token expiry is wall-clock (``exp``); identity TTLs are monotonic.
+token_cache = _ExpiringLRU(_TOKEN_CACHE_SIZE, time.time)
+user_cache = _ExpiringLRU(_USER_CACHE_SIZE, time.monotonic)
+
+
+def invalidate_user(email: str) -> None:
+    """Forget a user's identity (call when a user is deleted or disabled)."""
+    user_cache.invalidate(email)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target: User) -> None:
+    invalidate_user(target.email)
+
+
+# ── Resolution ────────────────────────────────────────────────────────────────
+
+
+def token_subject(token: str) -> Optional[str]:
+    """The ``sub`` of a valid token (verified once, then cached), else None."""
+    digest = hashlib.sha256(token.encode()).digest()
+    subject = token_cache.get(digest)
+    if subject is not None:
+        return subject
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    subject = payload.get("sub")
+    if not isinstance(subject, str):
+        return None
+    expires_at = payload.get("exp")
+    if isinstance(expires_at, (int, float)):
+        token_cache.put(digest, subject, float(expires_at))
+    return subject
+
+
+async def resolve_user(session: AsyncSession, email: str) -> Optional[UserRef]:
+    """The ``UserRef`` for ``email``, or None if no such user exists."""
+    ref = user_cache.get(email)
+    if ref is not None:
+        return ref
+
+    result = await session.execute(
+        select(User.id, User.email).where(User.email == email)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    ref = UserRef(id=row.id, email=row.email)
+    user_cache.put(email, ref, time.monotonic() + _USER_CACHE_TTL)
+    return ref
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "tokens": token_cache.stats(),
+        "users": {**user_cache.stats(), "ttl_seconds": _USER_CACHE_TTL},
+    }
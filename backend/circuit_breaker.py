@@ -0,0 +1,111 @@
+"""
+circuit_breaker.py
+──────────────────
+Minimal circuit breaker for calls to an upstream service.
+
+  • closed    — calls go through; ``failure_threshold`` consecutive failures
+                trip the breaker.
+  • open      — calls fail fast without touching the network until
+                ``reset_timeout`` seconds have passed.
+  • half-open — one probe call is let through; success closes the breaker,
+                failure opens it again for another ``reset_timeout``.  A
+                probe that never reports back (cancelled) is given up on
+                after ``probe_timeout`` and another call may probe.
+
+The breaker only keeps state — callers ask ``allow()`` before a call and
+report the outcome with ``record_success()`` / ``record_failure()``.  State is
+per process.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("plantvita.backend.circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        probe_timeout: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout or reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """May a call go out now?  In half-open state only the probe may."""
+        if self.state == OPEN:
+            assert self.opened_at is not None
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.half_open()
+
+        if self.state == HALF_OPEN:
+            now = time.monotonic()
+            if (
+                self._probe_started is not None
+                and now - self._probe_started < self.probe_timeout
+            ):
+                self.rejected += 1
+                return False
+            self._probe_started = now
+        return True
+
+    def half_open(self) -> None:
+        """Let the next call through as a probe (e.g. a health check passed)."""
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            self._probe_started = None
+            logger.info("Circuit %s half-open — probing", self.name)
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Circuit %s closed — upstream recovered", self.name)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED
+            and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+            self.trips += 1
+            logger.warning(
+                "Circuit %s open after %d consecutive failures — failing fast "
+                "for %.0fs",
+                self.name,
+                self.consecutive_failures,
+                self.reset_timeout,
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,120 @@
+"""
+command_notify.py
+─────────────────
+Wakes parked command long-polls when a command is queued for their plant.
+
+``CommandNotifier`` keeps one ``asyncio.Event`` per waiting request, grouped
+by plant.  Pollers ``subscribe`` *before* checking the queue, so a command
+created between the check and the wait is never missed; ``notify`` sets every
+event registered for the plant.
+
+That alone only reaches requests parked on the same process.  With
+``COMMAND_PG_NOTIFY=1`` the backend also sends ``pg_notify`` in the
+transaction that inserts the command, and ``listen_loop`` — one per process —
+LISTENs on the channel and forwards each notification to the local notifier,
+so any worker can wake a device parked on any other.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+logger = logging.getLogger("plantvita.backend.command_notify")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+COMMAND_PG_NOTIFY: bool = os.getenv("COMMAND_PG_NOTIFY", "0") == "1"
+CHANNEL = "plantvita_commands"
+_RECONNECT_SECONDS = 5.0
+
+
+class CommandNotifier:
+    """In-process registry of requests waiting for a plant's next command."""
+
+    def __init__(self) -> None:
+        self._waiters: Dict[int, Set[asyncio.Event]] = {}
+        self.notifications = 0
+        self.wakeups = 0
+
+    @contextmanager
+    def subscribe(self, plant_id: int) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        self._waiters.setdefault(plant_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            waiters = self._waiters.get(plant_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[plant_id]
+
+    def notify(self, plant_id: int) -> None:
+        self.notifications += 1
+        for event in self._waiters.get(plant_id, ()):
+            if not event.is_set():
+                event.set()
+                self.wakeups += 1
+
+    def stats(self) -> dict:
+        return {
+            "waiting_plants": len(self._waiters),
+            "waiters": sum(len(w) for w in self._waiters.values()),
+            "notifications": self.notifications,
+            "wakeups": self.wakeups,
+            "pg_notify": COMMAND_PG_NOTIFY,
+        }
+
+
+command_notifier = CommandNotifier()
+
+
+async def publish(session: AsyncSession, plant_id: int) -> None:
+    """
+    Announce a new command for ``plant_id``.  Call inside the inserting
+    transaction: Postgres only delivers the NOTIFY once it commits.  The
+    local notifier is poked separately by the caller after commit.
+    """
+    if COMMAND_PG_NOTIFY:
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": str(plant_id)},
+        )
+
+
+async def listen_loop(engine: AsyncEngine) -> None:
+    """Background task: forward Postgres notifications to ``command_notifier``."""
+
+    def on_notify(_conn, _pid, _channel, payload: str) -> None:
+        try:
+            command_notifier.notify(int(payload))
+        except ValueError:
+            logger.warning("Ignoring malformed command notification %r", payload)
+
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection  # asyncpg.Connection
+                await driver.add_listener(CHANNEL, on_notify)  # type: ignore[union-attr]
+                logger.info("Listening for command notifications on %s", CHANNEL)
+                try:
+                    # Keep the connection checked out; probe it now and then
+                    # so a dropped connection is noticed and re-established.
+                    while True:
+                        await asyncio.sleep(60)
+                        await driver.execute("SELECT 1")  # type: ignore[union-attr]
+                finally:
+                    await driver.remove_listener(CHANNEL, on_notify)  # type: ignore[union-attr]
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Command listener failed, reconnecting: %s", exc)
+            await asyncio.sleep(_RECONNECT_SECONDS)
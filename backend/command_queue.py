@@ -0,0 +1,140 @@
+"""
+command_queue.py
+────────────────
+Claim / acknowledge semantics for the ``command`` table.
+
+A device never just *reads* its next command — it claims it.  ``claim_next``
+is a single statement that:
+
+  • sweeps the plant's dead commands: past ``expires_at`` and not held by a
+    live claim → ``expired``, or claimed, lease run out and out of attempts
+    → ``failed``.  A command the device is executing under its lease is
+    never expired from under it, so its acknowledgement still lands;
+  • picks the head of the plant's queue (oldest live command), so commands
+    for one plant are always delivered in order and never skipped;
+  • locks that row with ``FOR UPDATE SKIP LOCKED`` — if another worker is
+    claiming it right now we return nothing rather than wait or skip ahead;
+  • claims it if it is pending, or re-delivers it if a previous claim's lease
+    (``COMMAND_VISIBILITY_TIMEOUT`` + the pump duration) has run out.
+
+While the head is claimed with a live lease, later commands wait behind it.
+``acknowledge`` closes a claim, but only for the plant that owns it.
+
+Statuses: pending → claimed → executed | failed, or expired.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import UTC, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from models import Command
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+COMMAND_VISIBILITY_TIMEOUT: int = int(os.getenv("COMMAND_VISIBILITY_TIMEOUT", "60"))
+COMMAND_TTL: int = int(os.getenv("COMMAND_TTL", "900"))  # 0 = never expire
+COMMAND_MAX_ATTEMPTS: int = int(os.getenv("COMMAND_MAX_ATTEMPTS", "3"))
+
+FINAL_STATUSES = ("executed", "failed", "expired")
+
+# A live command that ``swept`` finalizes: expired while pending or after its
+# claim lapsed, or lapsed with no attempts left.  (The CTEs share one
+# snapshot, so ``head`` must exclude these itself.)
+_DEAD = """
+    ((expires_at IS NOT NULL AND expires_at < now()
+      AND (status = 'pending' OR lease_expires_at < now()))
+     OR (status = 'claimed' AND lease_expires_at < now()
+         AND attempts >= :max_attempts))
+"""
+
+_CLAIM_NEXT = text(
+    f"""
+    WITH swept AS (
+        UPDATE command
+        SET status = CASE WHEN expires_at < now() THEN 'expired' ELSE 'failed' END
+        WHERE plant_id = :plant_id
+          AND status IN ('pending', 'claimed')
+          AND {_DEAD}
+        RETURNING id
+    ),
+    head AS (
+        SELECT id FROM command
+        WHERE plant_id = :plant_id
+          AND status IN ('pending', 'claimed')
+          AND NOT {_DEAD}
+        ORDER BY created_at, id
+        LIMIT 1
+    ),
+    claimable AS (
+        SELECT c.id FROM command c JOIN head ON head.id = c.id
+        WHERE c.status = 'pending' OR c.lease_expires_at < now()
+        FOR UPDATE OF c SKIP LOCKED
+    )
+    UPDATE command c
+    SET status = 'claimed',
+        claimed_at = now(),
+        lease_expires_at = now() + make_interval(secs => :visibility + c.duration),
+        attempts = c.attempts + 1
+    FROM claimable
+    WHERE c.id = claimable.id
+    RETURNING c.*
+    """
+)
+
+
+def expiry_for(created_at: datetime) -> Optional[datetime]:
+    """``expires_at`` for a command created at ``created_at`` (None = never)."""
+    if COMMAND_TTL <= 0:
+        return None
+    return created_at + timedelta(seconds=COMMAND_TTL)
+
+
+async def claim_next(session: AsyncSession, plant_id: int) -> Optional[Command]:
+    """Atomically claim the plant's next command and commit; None if none."""
+    result = await session.execute(
+        select(Command).from_statement(_CLAIM_NEXT),
+        {
+            "plant_id": plant_id,
+            "visibility": COMMAND_VISIBILITY_TIMEOUT,
+            "max_attempts": COMMAND_MAX_ATTEMPTS,
+        },
+    )
+    command = result.scalars().first()
+    await session.commit()
+    return command
+
+
+async def acknowledge(
+    session: AsyncSession, plant_id: int, command_id: int, status: str
+) -> Optional[Command]:
+    """
+    Close a claimed command with ``status`` (executed / failed).
+
+    Returns None if the command doesn't exist or belongs to another plant.
+    A command past ``expires_at`` is still finalized by the device that
+    claimed it — expiry only stops it being handed out.  Acknowledging a
+    command that is already final is a no-op, so a device retrying its
+    acknowledgement gets the same answer back.
+    """
+    result = await session.execute(
+        select(Command)
+        .where(Command.id == command_id, Command.plant_id == plant_id)
+        .with_for_update()
+    )
+    command = result.scalars().first()
+    if command is None or command.status in FINAL_STATUSES:
+        return command
+
+    command.status = status
+    command.executed_at = datetime.now(UTC)
+    command.lease_expires_at = None
+    session.add(command)
+    await session.commit()
+    await session.refresh(command)
+    return command
@@ -0,0 +1,171 @@
+"""
+db.py
+─────
+Database engines, the shared session factories and the session dependency.
+
+Lives outside ``main.py`` so processes other than the API — the inference
+worker pool in particular — can talk to the database without importing the
+FastAPI app.
+
+Pool sizing
+  Each process gets ``DB_POOL_SIZE`` persistent connections plus up to
+  ``DB_MAX_OVERFLOW`` temporary ones; a checkout that finds none free waits
+  ``DB_POOL_TIMEOUT`` seconds and then fails, rather than queueing requests
+  indefinitely behind a stuck pool.  By Little's law a device fleet of N
+  boards, each posting a reading and polling for commands every 5 s with
+  connections held ~5 ms, keeps about N / 500 connections busy — 1000 devices
+  need ~2, so the defaults leave ample room for the dashboard, exports and
+  bursts after an outage.  Long-polls and SSE streams hand their connection
+  back while parked.  Keep ``processes × (size + overflow)`` under the
+  server's ``max_connections``.
+
+Connections are pinged on checkout (``DB_POOL_PRE_PING``) and replaced after
+``DB_POOL_RECYCLE`` seconds, so a Postgres restart or an idle-timeout on a
+proxy costs a reconnect rather than a failed request.  asyncpg keeps up to
+``DB_STATEMENT_CACHE_SIZE`` prepared statements per connection (set 0 behind
+PgBouncer in transaction mode); SQLAlchemy caches compiled SQL for up to
+``DB_QUERY_CACHE_SIZE`` statements.
+
+With ``DB_REPLICA_URL`` set there is a second, read-only engine on a
+streaming replica (``replica_engine`` / ``replica_session_maker``, pool sized
+by ``DB_REPLICA_POOL_SIZE``); ``replica.py`` decides which requests use it.
+
+``stats()`` reports pool occupancy plus checkout wait times for ``/metrics``.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, Optional, cast
+
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DATABASE_URL = os.getenv("DB_URL")
+
+if not DATABASE_URL:
+    raise RuntimeError("DB_URL environment variable is not set")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+DB_QUERY_CACHE_SIZE: int = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+
+DB_REPLICA_URL: str = os.getenv("DB_REPLICA_URL", "")
+DB_REPLICA_POOL_SIZE: int = int(os.getenv("DB_REPLICA_POOL_SIZE", str(DB_POOL_SIZE)))
+
+# ── Pool ──────────────────────────────────────────────────────────────────────
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    """``AsyncAdaptedQueuePool`` that times every checkout."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.counters: Dict[str, Any] = {
+            "checkouts": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "connects": 0,
+        }
+
+    def recreate(self) -> "_TimedQueuePool":
+        pool = super().recreate()
+        pool.counters = self.counters  # type: ignore[attr-defined]
+        return pool  # type: ignore[return-value]
+
+    def _create_connection(self):
+        self.counters["connects"] += 1
+        return super()._create_connection()
+
+    def _do_get(self):
+        exhausted = self.checkedin() == 0 and self._overflow >= self._max_overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.counters["checkouts"] += 1
+            self.counters["waited"] += exhausted
+            self.counters["wait_seconds_total"] += elapsed
+            if elapsed > self.counters["wait_seconds_max"]:
+                self.counters["wait_seconds_max"] = elapsed
+
+
+def _create_engine(url: str, pool_size: int) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        echo=False,
+        poolclass=_TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    )
+
+
+engine = _create_engine(DATABASE_URL, DB_POOL_SIZE)
+replica_engine: Optional[AsyncEngine] = (
+    _create_engine(DB_REPLICA_URL, DB_REPLICA_POOL_SIZE) if DB_REPLICA_URL else None
+)
+
+
+def pool_stats(db_engine: AsyncEngine) -> Dict[str, Any]:
+    pool = cast(_TimedQueuePool, db_engine.sync_engine.pool)
+    counters = pool.counters
+    checkouts = counters["checkouts"]
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        **counters,
+        "wait_seconds_total": round(counters["wait_seconds_total"], 4),
+        "wait_seconds_max": round(counters["wait_seconds_max"], 4),
+        "wait_ms_mean": (
+            round(counters["wait_seconds_total"] / checkouts * 1000, 3)
+            if checkouts
+            else None
+        ),
+    }
+
+
+def stats() -> Dict[str, Any]:
+    return pool_stats(engine)
+
+
+# ── Sessions ──────────────────────────────────────────────────────────────────
+
+# One factory for the whole process; sessions are cheap, the factory need not
+# be rebuilt per request.
+session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+replica_session_maker: Optional[async_sessionmaker[AsyncSession]] = (
+    async_sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+    if replica_engine is not None
+    else None
+)
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    async with session_maker() as session:
+        yield session
@@ -0,0 +1,285 @@
+"""
+diagnosis_policy.py
+───────────────────
+Decides whether a vision result that asks for an LLM diagnosis
+(``trigger_llm``) actually gets one.
+
+Each diagnosis sends a multi-kilobyte prompt plus the image through up to
+four models, and the vision service sets ``trigger_llm`` on every degraded
+result — so without a policy LLM spend tracks upload count.  ``schedule``
+compares the new vision result and the plant's latest sensor state with the
+snapshot taken at its last diagnosis (``diagnosis_baseline``):
+
+  • skip      — nothing material changed: same health class, green density
+                within ``DIAGNOSIS_GREEN_DELTA``, every sensor within its band,
+                same critical flag, baseline younger than
+                ``DIAGNOSIS_MAX_AGE``.  The baseline image's diagnosis (the
+                last fresh one, never a placeholder) is copied onto the new
+                image.  A degraded vision result (no health class) counts as
+                "no change" on the vision side.
+  • coalesce  — a diagnosis for this plant is already queued; it is pointed
+                at the newer image instead of queueing a second one.
+  • diagnose  — queue the job now.
+  • defer     — something changed but the plant (``DIAGNOSIS_PLANT_BUDGET``
+                per ``DIAGNOSIS_PLANT_WINDOW``) or the whole fleet
+                (``DIAGNOSIS_GLOBAL_BUDGET`` per ``DIAGNOSIS_GLOBAL_WINDOW``)
+                is out of budget; the job is queued with ``run_after`` set to
+                when the sliding window has room again.
+
+Budgets are counted from the ``inference_job`` table, so every worker process
+shares them; a transaction-scoped advisory lock serialises the check.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import jobs
+import latest_state
+from models import DiagnosisBaseline, Image, PlantLatestState
+
+logger = logging.getLogger("plantvita.backend.diagnosis_policy")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+DIAGNOSIS_POLICY: bool = os.getenv("DIAGNOSIS_POLICY", "1") == "1"
+DIAGNOSIS_GREEN_DELTA: float = float(os.getenv("DIAGNOSIS_GREEN_DELTA", "0.05"))
+DIAGNOSIS_MAX_AGE: int = int(os.getenv("DIAGNOSIS_MAX_AGE", "86400"))  # seconds
+DIAGNOSIS_PLANT_BUDGET: int = int(os.getenv("DIAGNOSIS_PLANT_BUDGET", "4"))
+DIAGNOSIS_PLANT_WINDOW: int = int(os.getenv("DIAGNOSIS_PLANT_WINDOW", "86400"))
+DIAGNOSIS_GLOBAL_BUDGET: int = int(os.getenv("DIAGNOSIS_GLOBAL_BUDGET", "120"))
+DIAGNOSIS_GLOBAL_WINDOW: int = int(os.getenv("DIAGNOSIS_GLOBAL_WINDOW", "3600"))
+
+# Sensor drift (absolute, in the metric's unit) that counts as a real change.
+SENSOR_BANDS: Dict[str, float] = {
+    "temp_c": 3.0,
+    "humidity_pct": 10.0,
+    "light_lux": 2000.0,
+    "soil_surface_pct": 10.0,
+    "soil_root_pct": 8.0,
+}
+
+# Arbitrary constant shared by all workers for pg_advisory_xact_lock.
+_BUDGET_LOCK_ID = 74_212_017
+
+_QUEUED_FOR_PLANT = text(
+    """
+    SELECT j.id FROM inference_job j JOIN image i ON i.id = j.image_id
+    WHERE j.kind = :kind AND j.status = 'queued' AND i.plant_id = :plant_id
+    ORDER BY j.id
+    LIMIT 1
+    FOR UPDATE OF j
+    """
+)
+
+# Diagnoses counted against a budget: scheduled inside the window (or later,
+# if already deferred) and not dead-lettered.
+_WINDOW_RUNS = text(
+    """
+    SELECT j.run_after FROM inference_job j
+    WHERE j.kind = :kind AND j.status <> 'dead'
+      AND j.run_after > now() - make_interval(secs => :window)
+    ORDER BY j.run_after
+    """
+)
+
+_WINDOW_RUNS_FOR_PLANT = text(
+    """
+    SELECT j.run_after FROM inference_job j JOIN image i ON i.id = j.image_id
+    WHERE j.kind = :kind AND j.status <> 'dead' AND i.plant_id = :plant_id
+      AND j.run_after > now() - make_interval(secs => :window)
+    ORDER BY j.run_after
+    """
+)
+
+SKIP = "skip"
+COALESCE = "coalesce"
+DIAGNOSE = "diagnose"
+DEFER = "defer"
+
+decision_counts: Dict[str, int] = {SKIP: 0, COALESCE: 0, DIAGNOSE: 0, DEFER: 0}
+
+
+@dataclass
+class Decision:
+    action: str
+    reason: str
+    run_after: Optional[datetime] = None
+
+
+# ── Change detection ──────────────────────────────────────────────────────────
+
+
+def material_change(
+    baseline: Optional[DiagnosisBaseline],
+    vision: Mapping[str, Any],
+    state: Optional[PlantLatestState],
+    now: datetime,
+) -> Optional[str]:
+    """Why the plant needs a fresh diagnosis, or None if nothing changed."""
+    if baseline is None:
+        return "no previous diagnosis"
+    if (now - baseline.diagnosed_at).total_seconds() > DIAGNOSIS_MAX_AGE:
+        return "last diagnosis too old"
+
+    if not vision.get("vision_error"):
+        if vision.get("health") != baseline.detected_health:
+            return f"health {baseline.detected_health} → {vision.get('health')}"
+        green = vision.get("green_density")
+        if green is not None and (
+            baseline.green_density is None
+            or abs(green - baseline.green_density) > DIAGNOSIS_GREEN_DELTA
+        ):
+            return "green density changed"
+
+    if state is not None:
+        if state.is_critical != baseline.is_critical:
+            return "critical flag changed"
+        for metric, band in SENSOR_BANDS.items():
+            now_value = getattr(state, metric)
+            then_value = getattr(baseline, metric)
+            if now_value is None or then_value is None:
+                continue
+            if abs(now_value - then_value) > band:
+                return f"{metric} drifted"
+    return None
+
+
+# ── Budgets ───────────────────────────────────────────────────────────────────
+
+
+def _next_slot(runs: List[datetime], budget: int, window: int) -> Optional[datetime]:
+    """When a sliding window holding ``runs`` has room for one more (None = now)."""
+    if budget <= 0 or len(runs) < budget:
+        return None
+    # The (len - budget + 1)-th oldest run has to leave the window first.
+    return runs[len(runs) - budget] + timedelta(seconds=window)
+
+
+async def _budget_slot(session: AsyncSession, plant_id: int) -> Optional[datetime]:
+    result = await session.execute(
+        _WINDOW_RUNS_FOR_PLANT,
+        {
+            "kind": jobs.DIAGNOSIS,
+            "plant_id": plant_id,
+            "window": DIAGNOSIS_PLANT_WINDOW,
+        },
+    )
+    plant_slot = _next_slot(
+        list(result.scalars()), DIAGNOSIS_PLANT_BUDGET, DIAGNOSIS_PLANT_WINDOW
+    )
+    result = await session.execute(
+        _WINDOW_RUNS, {"kind": jobs.DIAGNOSIS, "window": DIAGNOSIS_GLOBAL_WINDOW}
+    )
+    global_slot = _next_slot(
+        list(result.scalars()), DIAGNOSIS_GLOBAL_BUDGET, DIAGNOSIS_GLOBAL_WINDOW
+    )
+    slots = [s for s in (plant_slot, global_slot) if s is not None]
+    return max(slots) if slots else None
+
+
+# ── Entry points ──────────────────────────────────────────────────────────────
+
+
+async def schedule(
+    session: AsyncSession, img: Image, vision: Mapping[str, Any]
+) -> Decision:
+    """
+    Apply the policy to a vision result with ``trigger_llm`` set, inside the
+    transaction that writes it: queue, defer, coalesce or skip the diagnosis.
+    """
+    image_id = img.id
+    assert image_id is not None
+    if not DIAGNOSIS_POLICY:
+        await jobs.enqueue(session, jobs.DIAGNOSIS, image_id)
+        return _decided(Decision(DIAGNOSE, "policy disabled"), image_id)
+
+    await session.execute(
+        text("SELECT pg_advisory_xact_lock(:id)"), {"id": _BUDGET_LOCK_ID}
+    )
+    now = datetime.now(UTC)
+    baseline = await session.get(DiagnosisBaseline, img.plant_id)
+    state = await latest_state.get_state(session, img.plant_id)
+
+    reason = material_change(baseline, vision, state, now)
+    # Reuse the diagnosis the baseline was taken from — never a placeholder
+    # left by a failed run on a later image.
+    last_diagnosis = (
+        await session.scalar(
+            select(Image.ai_diagnosis).where(Image.id == baseline.image_id)
+        )
+        if reason is None and baseline is not None
+        else None
+    )
+    if last_diagnosis:
+        img.ai_diagnosis = last_diagnosis
+        session.add(img)
+        await latest_state.record_diagnosis(
+            session, img.plant_id, image_id, last_diagnosis
+        )
+        return _decided(Decision(SKIP, "no material change"), image_id)
+    reason = reason or "no diagnosis to reuse"
+
+    queued = await session.scalar(
+        _QUEUED_FOR_PLANT, {"kind": jobs.DIAGNOSIS, "plant_id": img.plant_id}
+    )
+    if queued is not None:
+        await session.execute(
+            text("UPDATE inference_job SET image_id = :image_id WHERE id = :id"),
+            {"image_id": image_id, "id": queued},
+        )
+        return _decided(Decision(COALESCE, reason), image_id)
+
+    slot = await _budget_slot(session, img.plant_id)
+    job = await jobs.enqueue(session, jobs.DIAGNOSIS, image_id)
+    if slot is not None and slot > now:
+        job.run_after = slot
+        return _decided(Decision(DEFER, reason, slot), image_id)
+    return _decided(Decision(DIAGNOSE, reason), image_id)
+
+
+def _decided(decision: Decision, image_id: int) -> Decision:
+    decision_counts[decision.action] += 1
+    logger.info(
+        "Diagnosis for image_id=%d: %s (%s)%s",
+        image_id,
+        decision.action,
+        decision.reason,
+        f" until {decision.run_after.isoformat()}" if decision.run_after else "",
+    )
+    return decision
+
+
+async def record_baseline(session: AsyncSession, img: Image) -> None:
+    """Snapshot the state a fresh diagnosis was made against (before commit)."""
+    state = await latest_state.get_state(session, img.plant_id)
+    values: Dict[str, Any] = {
+        "plant_id": img.plant_id,
+        "image_id": img.id,
+        "diagnosed_at": datetime.now(UTC),
+        "detected_health": img.detected_health,
+        "green_density": img.green_density,
+        "is_critical": state.is_critical if state is not None else False,
+    }
+    for metric in SENSOR_BANDS:
+        values[metric] = getattr(state, metric) if state is not None else None
+
+    stmt = pg_insert(DiagnosisBaseline).values(**values)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["plant_id"],
+            set_={k: stmt.excluded[k] for k in values if k != "plant_id"},
+        )
+    )
+
+
+def stats() -> Dict[str, Any]:
+    return {"enabled": DIAGNOSIS_POLICY, **decision_counts}
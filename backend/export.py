@@ -0,0 +1,237 @@
+"""
+export.py
+─────────
+Streaming bulk export of sensor and image history.
+
+``export_chunks`` runs the export query on a server-side cursor
+(``AsyncSession.stream`` with ``yield_per``) and encodes each partition of
+rows as soon as it arrives, so an export of several years of readings holds at
+most ``EXPORT_CHUNK_ROWS`` rows in memory at a time.  The generator is meant to
+be handed straight to a ``StreamingResponse``.
+
+Formats:
+  • csv     — header row, ISO-8601 timestamps
+  • ndjson  — one JSON object per line
+  • parquet — one row group per chunk; needs ``pyarrow`` (optional dependency)
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Literal, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.sql import sqltypes
+from sqlmodel import select
+
+from models import SENSOR_METRICS, Image, SensorReading
+
+ExportFormat = Literal["csv", "ndjson", "parquet"]
+ExportTable = Literal["readings", "images"]
+
+EXPORT_CHUNK_ROWS = 2000
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_COLUMNS = {
+    "readings": (SensorReading, ("id", "plant_id", "timestamp", *SENSOR_METRICS)),
+    "images": (
+        Image,
+        (
+            "id",
+            "plant_id",
+            "timestamp",
+            "image_url",
+            "ai_diagnosis",
+            "green_density",
+            "segmentation_success",
+            "detected_species",
+            "species_confidence",
+            "in_model_scope",
+            "detected_health",
+            "health_confidence",
+            "trigger_llm",
+            "vision_error",
+        ),
+    ),
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # type: ignore[import]  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _query(
+    table: ExportTable,
+    plant_ids: Sequence[int],
+    start: Optional[datetime],
+    end: Optional[datetime],
+):
+    model, names = _COLUMNS[table]
+    query = select(*(getattr(model, n) for n in names)).where(
+        model.plant_id.in_(plant_ids)  # type: ignore[attr-defined]
+    )
+    if start is not None:
+        query = query.where(model.timestamp >= start)  # type: ignore[attr-defined]
+    if end is not None:
+        query = query.where(model.timestamp < end)  # type: ignore[attr-defined]
+    # (plant_id, timestamp) walks the composite history index.
+    query = query.order_by(model.plant_id, model.timestamp)  # type: ignore[attr-defined]
+    return query.execution_options(yield_per=EXPORT_CHUNK_ROWS)
+
+
+# ── Encoders ──────────────────────────────────────────────────────────────────
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+class _CsvEncoder:
+    def __init__(self, names: Sequence[str]) -> None:
+        self._names = names
+        self._header = True
+
+    def encode(self, rows) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if self._header:
+            writer.writerow(self._names)
+            self._header = False
+        for row in rows:
+            writer.writerow(
+                v.isoformat() if isinstance(v, datetime) else v for v in row
+            )
+        return buf.getvalue().encode()
+
+    def finish(self) -> bytes:
+        return self.encode([]) if self._header else b""
+
+
+class _NdjsonEncoder:
+    def __init__(self, names: Sequence[str]) -> None:
+        self._names = names
+
+    def encode(self, rows) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(self._names, row)), default=_json_default) + "\n"
+            for row in rows
+        ).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object that hands back whatever was written since the
+    last ``drain`` while keeping ``tell`` absolute, as the Parquet footer needs."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        self._buf += data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+class _ParquetEncoder:
+    def __init__(self, table: ExportTable, names: Sequence[str]) -> None:
+        import pyarrow as pa  # type: ignore[import]
+        import pyarrow.parquet as pq  # type: ignore[import]
+
+        arrow_types = (
+            (sqltypes.Boolean, pa.bool_()),
+            (sqltypes.Integer, pa.int64()),
+            (sqltypes.Float, pa.float64()),
+            (sqltypes.DateTime, pa.timestamp("us", tz="UTC")),
+            (sqltypes.String, pa.string()),
+        )
+
+        def arrow_type(column):
+            # SQLModel's AutoString is a TypeDecorator around String.
+            col_type = getattr(column.type, "impl", column.type)
+            for sql_type, arrow in arrow_types:
+                if isinstance(col_type, sql_type):
+                    return arrow
+            raise TypeError(f"No Parquet type for column {column.name}")
+
+        columns = _COLUMNS[table][0].__table__.c  # type: ignore[attr-defined]
+        self._pa = pa
+        self._schema = pa.schema([(n, arrow_type(columns[n])) for n in names])
+        self._sink = _Sink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema)
+
+    def encode(self, rows) -> bytes:
+        columns = list(zip(*rows)) or [[] for _ in self._schema.names]
+        self._writer.write_table(
+            self._pa.Table.from_arrays(
+                [list(c) for c in columns], schema=self._schema
+            )
+        )
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+# ── Stream ────────────────────────────────────────────────────────────────────
+
+
+async def export_chunks(
+    session_maker: async_sessionmaker[AsyncSession],
+    table: ExportTable,
+    fmt: ExportFormat,
+    plant_ids: Sequence[int],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yield the encoded export in chunks of at most ``EXPORT_CHUNK_ROWS`` rows.
+
+    Opens its own session: the generator runs while the response is being
+    sent, after the request's dependency-scoped session may be gone.
+    """
+    names = _COLUMNS[table][1]
+    if fmt == "parquet":
+        encoder = _ParquetEncoder(table, names)
+    elif fmt == "ndjson":
+        encoder = _NdjsonEncoder(names)  # type: ignore[assignment]
+    else:
+        encoder = _CsvEncoder(names)  # type: ignore[assignment]
+
+    async with session_maker() as session:
+        result = await session.stream(_query(table, plant_ids, start, end))
+        async for rows in result.partitions():
+            chunk = encoder.encode(rows)
+            if chunk:
+                yield chunk
+    tail = encoder.finish()
+    if tail:
+        yield tail
@@ -0,0 +1,90 @@
+"""
+history.py
+──────────
+Windowed accessors over a plant's time-series tables.
+
+``Plant``'s relationships are declared ``lazy="raise"``, so a plant's history
+is never pulled in implicitly.  Endpoints that need readings ask for a bounded
+window through these helpers instead — the newest N rows, optionally only
+those since a given time.
+
+All helpers return rows in chronological order (oldest first), which is what
+the charting clients expect.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import ARRAY, Integer, bindparam, func, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+
+from models import SensorReading
+
+
+async def latest_readings(
+    session: AsyncSession,
+    plant_id: int,
+    limit: int,
+    since: Optional[datetime] = None,
+) -> List[SensorReading]:
+    """Newest ``limit`` readings for one plant, optionally bounded by ``since``."""
+    if limit <= 0:
+        return []
+
+    query = select(SensorReading).where(SensorReading.plant_id == plant_id)
+    if since is not None:
+        query = query.where(SensorReading.timestamp >= since)  # type: ignore[operator]
+
+    result = await session.execute(
+        query.order_by(SensorReading.timestamp.desc()).limit(limit)  # type: ignore[attr-defined]
+    )
+    return list(reversed(result.scalars().all()))
+
+
+async def latest_readings_for_plants(
+    session: AsyncSession,
+    plant_ids: Sequence[int],
+    limit: int,
+    since: Optional[datetime] = None,
+) -> Dict[int, List[SensorReading]]:
+    """
+    Newest ``limit`` readings for each of ``plant_ids`` in a single query.
+
+    ``unnest(plant_ids)`` joined to a ``LATERAL (… ORDER BY timestamp DESC
+    LIMIT n)`` per plant, so each plant's scan of the ``(plant_id, timestamp
+    DESC)`` index stops after ``limit`` rows however long its history is.
+    """
+    windows: Dict[int, List[SensorReading]] = {pid: [] for pid in plant_ids}
+    if limit <= 0 or not plant_ids:
+        return windows
+
+    plants = (
+        func.unnest(
+            bindparam("plant_ids", list(plant_ids), type_=ARRAY(Integer))
+        )
+        .table_valued("plant_id")
+        .render_derived()
+    )
+    inner = select(SensorReading).where(SensorReading.plant_id == plants.c.plant_id)
+    if since is not None:
+        inner = inner.where(SensorReading.timestamp >= since)  # type: ignore[operator]
+    window = (
+        inner.order_by(SensorReading.timestamp.desc())  # type: ignore[attr-defined]
+        .limit(limit)
+        .lateral("window")
+    )
+    reading = aliased(SensorReading, window)
+
+    result = await session.execute(
+        select(reading)
+        .select_from(plants)
+        .join(window, true())
+        .order_by(reading.plant_id, reading.timestamp)  # type: ignore[arg-type]
+    )
+    for reading in result.scalars().all():
+        windows[reading.plant_id].append(reading)
+    return windows
@@ -0,0 +1,212 @@
+"""
+http_clients.py
+───────────────
+Shared, pooled HTTP clients for outbound calls: the Vision Microservice, the
+LLM provider (OpenRouter) and fetching stored images.
+
+Creating an ``httpx.AsyncClient`` per call means a fresh TCP (and TLS)
+handshake for every image.  Instead each upstream gets one long-lived client
+with a connection pool and keep-alive, opened in the app's ``lifespan`` (or
+the inference worker's ``main``) via ``open_clients`` and closed via
+``close_clients``.  A client used before ``open_clients`` — a script, say —
+is created on first use.
+
+HTTP/2 is negotiated where the ``h2`` package is installed and the upstream
+speaks it over TLS (OpenRouter does); plain-http upstreams stay on HTTP/1.1.
+
+On top of the pool limits every client caps concurrent requests *per host*
+(``HTTP_PER_HOST_LIMIT``, or the client-specific override), so a burst of
+jobs queues in-process instead of opening connections without bound.
+``stats()`` reports in-flight / waiting requests and pool connections per
+client for /metrics — ``waiting`` above zero means the cap is saturated.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger("plantvita.backend.http_clients")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_PER_HOST_LIMIT: int = int(os.getenv("HTTP_PER_HOST_LIMIT", "16"))
+HTTP2_ENABLED: bool = (
+    os.getenv("HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+)
+
+VISION = "vision"
+LLM = "llm"
+STORAGE = "storage"
+
+# name → (timeout seconds, per-host concurrency cap)
+_CLIENT_CONFIG: Dict[str, tuple[float, int]] = {
+    VISION: (
+        float(os.getenv("VISION_TIMEOUT", "60")),
+        int(os.getenv("VISION_MAX_CONCURRENCY", str(HTTP_PER_HOST_LIMIT))),
+    ),
+    LLM: (
+        float(os.getenv("LLM_TIMEOUT", "120")),
+        int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+    ),
+    STORAGE: (30.0, HTTP_PER_HOST_LIMIT),
+}
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that gives its per-host slot back once closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release) -> None:
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Pooled transport that caps concurrent requests per host."""
+
+    def __init__(self, per_host: int) -> None:
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._per_host = per_host
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated = 0  # requests that had to wait for the per-host cap
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        sem = self._hosts.get(host)
+        if sem is None:
+            sem = self._hosts[host] = asyncio.Semaphore(self._per_host)
+
+        if sem.locked():
+            self.saturated += 1
+        self.waiting += 1
+        try:
+            await sem.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        def release() -> None:
+            self.in_flight -= 1
+            sem.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        # The slot is held until the body has been read (or the stream
+        # closed), so the cap covers the whole exchange — streamed downloads
+        # included — and not just the headers.
+        response.stream = _ReleasingStream(response.stream, release)  # type: ignore[arg-type]
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        # httpcore's pool is not public API; report what it exposes, if anything.
+        pool = getattr(self._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        return {
+            "per_host_limit": self._per_host,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": self.waiting,
+            "saturated": self.saturated,
+            "requests": self.requests,
+            "connections": len(connections),
+            "idle_connections": sum(1 for c in connections if c.is_idle()),
+        }
+
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transports: Dict[str, _HostLimitedTransport] = {}
+_openrouter: Optional[Any] = None
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """The shared client for ``name`` (``VISION`` / ``LLM`` / ``STORAGE``)."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        timeout, per_host = _CLIENT_CONFIG[name]
+        transport = _transports[name] = _HostLimitedTransport(per_host)
+        client = _clients[name] = httpx.AsyncClient(
+            transport=transport, timeout=timeout
+        )
+    return client
+
+
+def openrouter_client(api_key: str) -> Any:
+    """Shared ``AsyncOpenAI`` client for OpenRouter, on the pooled LLM client."""
+    global _openrouter
+    from openai import AsyncOpenAI
+
+    if _openrouter is None or _openrouter.api_key != api_key:
+        _openrouter = AsyncOpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=api_key,
+            max_retries=2,
+            http_client=get_client(LLM),
+        )
+    return _openrouter
+
+
+async def open_clients() -> None:
+    for name in _CLIENT_CONFIG:
+        get_client(name)
+    logger.info(
+        "HTTP clients ready (http2=%s, max_connections=%d, keepalive=%d)",
+        HTTP2_ENABLED,
+        HTTP_MAX_CONNECTIONS,
+        HTTP_MAX_KEEPALIVE,
+    )
+
+
+async def close_clients() -> None:
+    global _openrouter
+    clients = list(_clients.values())
+    _clients.clear()
+    _transports.clear()
+    _openrouter = None
+    await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2_ENABLED,
+        **{name: t.stats() for name, t in _transports.items()},
+    }
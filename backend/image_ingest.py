@@ -0,0 +1,158 @@
+"""
+image_ingest.py
+───────────────
+Streaming ingest of device image uploads, and file-backed access to stored
+images for the inference jobs.
+
+``spool`` writes the request body to a temp file in ``IMAGE_SPOOL_DIR`` chunk
+by chunk as it arrives, hashing (SHA-256) and counting it on the way, so an
+upload holds one chunk in memory however large it is or however many
+cameras post at once.  Bodies over ``IMAGE_MAX_BYTES`` are cut off with
+``ImageTooLarge``.  The finished file is then moved into place with an atomic
+rename (``publish_local``) or uploaded from disk by ``image_store`` — a
+half-written image is never visible under its final name.
+
+Consumers don't get a bytes copy either: ``open_image`` yields a file object
+(the stored file itself, or a temp file the remote object was streamed into)
+that can be handed to the multipart encoder or Pillow, and ``data_uri``
+base64-encodes straight from a memory map of the file.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO
+
+import aiofiles
+
+from http_clients import STORAGE, get_client
+
+logger = logging.getLogger("plantvita.backend.image_ingest")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+IMAGE_MAX_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+# Where the local image store keeps files, and the fixed URL prefix the app
+# serves them under — the URL never depends on the filesystem path.
+LOCAL_IMAGE_DIR: str = os.getenv("LOCAL_IMAGE_DIR", "received_images")
+LOCAL_IMAGE_URL_PREFIX = "/received_images"
+# Keep on the same filesystem as LOCAL_IMAGE_DIR so publishing is a rename.
+IMAGE_SPOOL_DIR: str = os.getenv("IMAGE_SPOOL_DIR", "upload_spool")
+_DOWNLOAD_CHUNK = 256 * 1024
+
+
+class ImageTooLarge(Exception):
+    """The upload exceeded ``IMAGE_MAX_BYTES``."""
+
+
+@dataclass
+class SpooledImage:
+    path: str
+    size: int
+    sha256: str
+
+    def discard(self) -> None:
+        """Delete the spool file (a no-op once it has been published)."""
+        with suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+async def spool(
+    chunks: AsyncIterator[bytes], max_bytes: int = IMAGE_MAX_BYTES
+) -> SpooledImage:
+    """Write ``chunks`` to a spool file, hashing and sizing incrementally."""
+    os.makedirs(IMAGE_SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=IMAGE_SPOOL_DIR, suffix=".part")
+    os.close(fd)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+        raise
+    return SpooledImage(path, size, digest.hexdigest())
+
+
+def publish_local(spooled: SpooledImage, final_path: str) -> None:
+    """Move the spool file to ``final_path`` atomically (same filesystem)."""
+    os.makedirs(os.path.dirname(final_path) or ".", exist_ok=True)
+    os.chmod(spooled.path, 0o644)  # mkstemp creates 0600
+    try:
+        os.replace(spooled.path, final_path)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        # Spool dir on another filesystem: copy beside the target, then rename.
+        tmp = f"{final_path}.part"
+        shutil.copyfile(spooled.path, tmp)
+        os.replace(tmp, final_path)
+        spooled.discard()
+
+
+# ── Reading stored images ─────────────────────────────────────────────────────
+
+
+def local_path(image_url: str) -> str:
+    """Filesystem path of a locally stored image URL (``/received_images/…``)."""
+    prefix = f"{LOCAL_IMAGE_URL_PREFIX}/"
+    if image_url.startswith(prefix):
+        return os.path.join(LOCAL_IMAGE_DIR, image_url[len(prefix) :])
+    return image_url.lstrip("/")
+
+
+@asynccontextmanager
+async def open_image(image_url: str) -> AsyncIterator[BinaryIO]:
+    """
+    Open a stored image for reading.  Local files are opened in place;
+    remote ones are streamed into an anonymous temp file first.
+    """
+    if not image_url.startswith("http"):
+        f = await asyncio.to_thread(open, local_path(image_url), "rb")
+        try:
+            yield f
+        finally:
+            f.close()
+        return
+
+    os.makedirs(IMAGE_SPOOL_DIR, exist_ok=True)
+    tmp = tempfile.TemporaryFile(dir=IMAGE_SPOOL_DIR)
+    try:
+        async with get_client(STORAGE).stream("GET", image_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK):
+                await asyncio.to_thread(tmp.write, chunk)
+        tmp.seek(0)
+        yield tmp  # type: ignore[misc]
+    finally:
+        tmp.close()
+
+
+def _encode_data_uri(path: str) -> str:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return "data:image/jpeg;base64," + base64.b64encode(m).decode("ascii")
+
+
+async def data_uri(image_url: str) -> str:
+    """``data:`` URI of a locally stored image, encoded from a memory map."""
+    return await asyncio.to_thread(_encode_data_uri, local_path(image_url))
@@ -0,0 +1,374 @@
+"""
+image_store.py
+──────────────
+Pluggable storage for uploaded images.
+
+``IMAGE_STORE`` picks the backend (default: ``gcs`` when ``GCS_BUCKET`` is
+set, otherwise ``local``):
+
+  • local — renames the spool file into ``LOCAL_IMAGE_DIR`` under a sharded
+            layout (``ab/cd/plant_…jpg``, from a hash of the name up to its
+            first dot, so ``plant_….thumb.jpg`` variants land beside their
+            original) so no single directory grows to hundreds of thousands
+            of entries.  Served by the app's ``/received_images`` StaticFiles
+            mount, whatever directory ``LOCAL_IMAGE_DIR`` points at.
+  • gcs   — Google Cloud Storage.  The client library is synchronous, so
+            uploads run on this module's own thread pool
+            (``IMAGE_STORE_THREADS``) — a slow bucket ties up those threads,
+            not the event loop or the default executor other code shares.
+  • s3    — any S3-compatible store (AWS, MinIO, …), fully async: a
+            SigV4-signed ``PUT`` streamed from the spool file over the pooled
+            ``STORAGE`` HTTP client.  The payload hash is the SHA-256 already
+            computed while spooling.  Path-style addressing.
+
+Cloud objects must be publicly readable — their URL is handed to the LLM
+provider as is.  GCS objects are made public one by one; for S3 grant
+anonymous read on the bucket (``S3_PUBLIC_URL`` overrides the URL prefix,
+e.g. for a CDN).  If a cloud upload fails the image is kept locally instead.
+
+Clients are created once, by ``open_store`` at startup; ``get_store`` creates
+the store on first use otherwise.  docker-compose's ``minio`` profile runs a
+local MinIO for exercising the s3 path offline.
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from typing import Any, AsyncIterator, Callable, Dict, Mapping, Optional, TypeVar
+from urllib.parse import quote, urlsplit
+
+import aiofiles
+
+from http_clients import STORAGE, get_client
+from image_ingest import (
+    LOCAL_IMAGE_DIR,
+    LOCAL_IMAGE_URL_PREFIX,
+    SpooledImage,
+    publish_local,
+)
+
+logger = logging.getLogger("plantvita.backend.image_store")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+GCS_BUCKET: str = os.getenv("GCS_BUCKET", "")
+IMAGE_STORE: str = os.getenv("IMAGE_STORE", "gcs" if GCS_BUCKET else "local")
+IMAGE_STORE_THREADS: int = int(os.getenv("IMAGE_STORE_THREADS", "8"))
+
+S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+S3_REGION: str = os.getenv("S3_REGION", "us-east-1")
+S3_ENDPOINT_URL: str = os.getenv(
+    "S3_ENDPOINT_URL", f"https://s3.{S3_REGION}.amazonaws.com"
+).rstrip("/")
+S3_ACCESS_KEY_ID: str = os.getenv(
+    "S3_ACCESS_KEY_ID", os.getenv("AWS_ACCESS_KEY_ID", "")
+)
+S3_SECRET_ACCESS_KEY: str = os.getenv(
+    "S3_SECRET_ACCESS_KEY", os.getenv("AWS_SECRET_ACCESS_KEY", "")
+)
+S3_PUBLIC_URL: str = os.getenv("S3_PUBLIC_URL", f"{S3_ENDPOINT_URL}/{S3_BUCKET}")
+
+# Object name prefix in cloud buckets.
+_OBJECT_PREFIX = "images/"
+# GCS resumable uploads send the file in chunks of this size (multiple of 256 KiB).
+_GCS_CHUNK_SIZE = 1024 * 1024
+_UPLOAD_CHUNK = 256 * 1024
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _run_blocking(fn: Callable[..., T], *args: Any) -> "asyncio.Future[T]":
+    """Run ``fn`` on the bounded image-store thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=IMAGE_STORE_THREADS, thread_name_prefix="image-store"
+        )
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+# ── Stores ────────────────────────────────────────────────────────────────────
+
+
+class ImageStore(abc.ABC):
+    """Interface: ``put`` a spooled file under ``name`` and return its URL."""
+
+    backend = "base"
+
+    def __init__(self) -> None:
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.upload_seconds = 0.0
+
+    async def open(self) -> None:
+        """Create clients (called once at startup)."""
+
+    async def close(self) -> None:
+        """Release clients."""
+
+    @abc.abstractmethod
+    async def _put(self, spooled: SpooledImage, name: str, content_type: str) -> str:
+        """Backend-specific upload; returns the stored image's URL."""
+
+    async def put(
+        self, spooled: SpooledImage, name: str, content_type: str = "image/jpeg"
+    ) -> str:
+        """Store the spool file as ``name``; the spool file is consumed or left."""
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            url = await self._put(spooled, name, content_type)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.uploads += 1
+        self.bytes += spooled.size
+        self.upload_seconds += time.monotonic() - started
+        return url
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "uploads": self.uploads,
+            "failures": self.failures,
+            "bytes": self.bytes,
+            "in_flight": self.in_flight,
+            "avg_upload_ms": (
+                round(self.upload_seconds / self.uploads * 1000, 1)
+                if self.uploads
+                else None
+            ),
+        }
+
+
+class LocalImageStore(ImageStore):
+    backend = "local"
+
+    def __init__(self, root: str = LOCAL_IMAGE_DIR) -> None:
+        super().__init__()
+        self.root = root
+
+    def relative_path(self, name: str) -> str:
+        digest = hashlib.sha256(name.split(".", 1)[0].encode()).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+    async def _put(self, spooled: SpooledImage, name: str, content_type: str) -> str:
+        relative = self.relative_path(name)
+        await _run_blocking(publish_local, spooled, os.path.join(self.root, relative))
+        return f"{LOCAL_IMAGE_URL_PREFIX}/{relative}"
+
+
+class GCSImageStore(ImageStore):
+    backend = "gcs"
+
+    def __init__(self, bucket: str = GCS_BUCKET) -> None:
+        super().__init__()
+        self.bucket_name = bucket
+        self._bucket: Any = None
+
+    def _connect(self) -> Any:
+        from google.cloud import storage as gcs  # type: ignore[import]
+
+        return gcs.Client().bucket(self.bucket_name)
+
+    async def open(self) -> None:
+        if self._bucket is None:
+            self._bucket = await _run_blocking(self._connect)
+
+    def _upload(self, path: str, name: str, content_type: str) -> str:
+        blob = self._bucket.blob(_OBJECT_PREFIX + name, chunk_size=_GCS_CHUNK_SIZE)
+        blob.upload_from_filename(path, content_type=content_type)
+        blob.make_public()
+        return blob.public_url
+
+    async def _put(self, spooled: SpooledImage, name: str, content_type: str) -> str:
+        await self.open()
+        return await _run_blocking(self._upload, spooled.path, name, content_type)
+
+
+def sigv4_headers(
+    method: str,
+    url: str,
+    headers: Mapping[str, str],
+    payload_sha256: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    now: datetime,
+    service: str = "s3",
+) -> Dict[str, str]:
+    """
+    ``headers`` plus the AWS Signature Version 4 ones (``x-amz-date``,
+    ``x-amz-content-sha256``, ``Authorization``).  ``url`` has no query string.
+    """
+    parts = urlsplit(url)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    out = {
+        **headers,
+        "host": parts.netloc,
+        "x-amz-date": amz_date,
+        "x-amz-content-sha256": payload_sha256,
+    }
+    signed = sorted(out, key=str.lower)
+    canonical_request = "\n".join(
+        [
+            method,
+            quote(parts.path or "/", safe="/~"),
+            "",
+            "".join(f"{k.lower()}:{str(out[k]).strip()}\n" for k in signed),
+            ";".join(k.lower() for k in signed),
+            payload_sha256,
+        ]
+    )
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = f"AWS4{secret_key}".encode()
+    for part in (amz_date[:8], region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    out["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={';'.join(k.lower() for k in signed)}, "
+        f"Signature={signature}"
+    )
+    return out
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        while chunk := await f.read(_UPLOAD_CHUNK):
+            yield chunk
+
+
+class S3ImageStore(ImageStore):
+    backend = "s3"
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: str = S3_ENDPOINT_URL,
+        region: str = S3_REGION,
+        access_key: str = S3_ACCESS_KEY_ID,
+        secret_key: str = S3_SECRET_ACCESS_KEY,
+        public_url: str = S3_PUBLIC_URL,
+    ) -> None:
+        super().__init__()
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self.public_url = public_url.rstrip("/")
+
+    async def _put(self, spooled: SpooledImage, name: str, content_type: str) -> str:
+        key = _OBJECT_PREFIX + name
+        url = f"{self.endpoint_url}/{self.bucket}/{key}"
+        headers = sigv4_headers(
+            "PUT",
+            url,
+            {"content-type": content_type, "content-length": str(spooled.size)},
+            spooled.sha256,
+            self._access_key,
+            self._secret_key,
+            self.region,
+            datetime.now(UTC),
+        )
+        response = await get_client(STORAGE).put(
+            url, headers=headers, content=_file_chunks(spooled.path)
+        )
+        response.raise_for_status()
+        return f"{self.public_url}/{key}"
+
+
+_STORES: Dict[str, Callable[[], ImageStore]] = {
+    "local": LocalImageStore,
+    "gcs": GCSImageStore,
+    "s3": S3ImageStore,
+}
+
+_store: Optional[ImageStore] = None
+_fallback: Optional[LocalImageStore] = None
+
+
+def get_store() -> ImageStore:
+    """The configured store (``IMAGE_STORE``)."""
+    global _store
+    if _store is None:
+        if IMAGE_STORE not in _STORES:
+            raise ValueError(
+                f"IMAGE_STORE must be one of {sorted(_STORES)}, not {IMAGE_STORE!r}"
+            )
+        _store = _STORES[IMAGE_STORE]()
+    return _store
+
+
+async def save(
+    spooled: SpooledImage, name: str, content_type: str = "image/jpeg"
+) -> str:
+    """Store an upload and return its URL, keeping it locally if the cloud fails."""
+    global _fallback
+    store = get_store()
+    try:
+        return await store.put(spooled, name, content_type)
+    except Exception as exc:
+        if isinstance(store, LocalImageStore):
+            raise
+        logger.warning(
+            "%s upload of %s failed, falling back to local: %s",
+            store.backend,
+            name,
+            exc,
+        )
+    if _fallback is None:
+        _fallback = LocalImageStore()
+    return await _fallback.put(spooled, name, content_type)
+
+
+async def open_store() -> None:
+    store = get_store()
+    try:
+        await store.open()
+    except Exception as exc:  # noqa: BLE001 — uploads fall back to local
+        logger.error("Image store %s unavailable at startup: %s", store.backend, exc)
+    logger.info(
+        "Image store: %s (%d upload threads)", store.backend, IMAGE_STORE_THREADS
+    )
+
+
+async def close_store() -> None:
+    global _store, _executor
+    if _store is not None:
+        await _store.close()
+        _store = None
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def stats() -> Dict[str, Any]:
+    out = get_store().stats()
+    out["threads"] = IMAGE_STORE_THREADS
+    if _fallback is not None:
+        out["local_fallback"] = _fallback.stats()
+    return out
@@ -0,0 +1,187 @@
+"""
+image_variants.py
+─────────────────
+Downscaled derivatives of each uploaded image:
+
+  • thumb   — ``IMAGE_THUMB_EDGE`` px (default 160) for gallery grids and the
+              dashboard cards
+  • preview — ``IMAGE_PREVIEW_EDGE`` px (default 640) for the detail view
+  • llm     — ``IMAGE_LLM_EDGE`` px (default 1024, i.e. 1024×768 for a 4:3
+              frame) sent to the diagnosis model instead of the full frame
+
+Sizes are the longest edge.  All variants come from one decode of the
+original (JPEG draft mode, so libjpeg already decodes at reduced scale) and
+are stored through ``image_store`` next to it as ``<name>.<variant>.jpg``.
+A variant the original is already no larger than just reuses the original's
+URL.
+
+A ``variants`` job is queued with every upload, so they normally exist by the
+time anyone looks.  ``ensure`` fills in whatever is missing on demand — for
+the ``/images/{id}/{variant}`` redirect and for the diagnosis job — with
+concurrent requests for the same image sharing one render.  The URLs are
+cached on the Image row (``thumbnail_url`` / ``preview_url`` /
+``llm_image_url``).
+
+Needs Pillow; without it every variant is the original.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import posixpath
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy import update
+from sqlmodel import select
+
+import image_ingest
+import image_store
+from db import session_maker
+from models import Image
+
+logger = logging.getLogger("plantvita.backend.image_variants")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+THUMB = "thumb"
+PREVIEW = "preview"
+LLM = "llm"
+
+# variant → (longest edge in px, JPEG quality), largest first.
+VARIANTS: Dict[str, tuple[int, int]] = {
+    LLM: (int(os.getenv("IMAGE_LLM_EDGE", "1024")), 85),
+    PREVIEW: (int(os.getenv("IMAGE_PREVIEW_EDGE", "640")), 80),
+    THUMB: (int(os.getenv("IMAGE_THUMB_EDGE", "160")), 70),
+}
+
+# variant → Image column caching its URL.
+COLUMNS: Dict[str, str] = {
+    THUMB: "thumbnail_url",
+    PREVIEW: "preview_url",
+    LLM: "llm_image_url",
+}
+
+_in_flight: Dict[int, "asyncio.Task[Dict[str, str]]"] = {}
+
+counters: Dict[str, int] = {"generated": 0, "reused_original": 0, "on_demand": 0}
+
+
+def variant_name(image_url: str, variant: str) -> str:
+    """``…/plant_AA_1.jpg`` → ``plant_AA_1.thumb.jpg``."""
+    stem, _ = posixpath.splitext(posixpath.basename(image_url))
+    return f"{stem}.{variant}.jpg"
+
+
+# ── Rendering ─────────────────────────────────────────────────────────────────
+
+
+def _render(image: Any) -> Dict[str, Optional[bytes]]:
+    """JPEG bytes per variant; None where the original is small enough."""
+    try:
+        from PIL import Image as PILImage  # type: ignore[import]
+    except ImportError:
+        return {variant: None for variant in VARIANTS}
+
+    out: Dict[str, Optional[bytes]] = {}
+    try:
+        with PILImage.open(image) as img:
+            largest = max(edge for edge, _ in VARIANTS.values())
+            img.draft("RGB", (largest, largest))
+            frame = img.convert("RGB")
+    except Exception as exc:  # noqa: BLE001 — corrupt / truncated upload
+        logger.warning("Cannot decode image for variants: %s", exc)
+        return {variant: None for variant in VARIANTS}
+    for variant, (edge, quality) in VARIANTS.items():  # largest first
+        if max(frame.size) <= edge:
+            out[variant] = None
+            continue
+        frame = frame.copy()
+        frame.thumbnail((edge, edge), PILImage.Resampling.LANCZOS, reducing_gap=2.0)
+        buf = io.BytesIO()
+        frame.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+        out[variant] = buf.getvalue()
+    return out
+
+
+async def _chunks(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def _generate(image_id: int) -> Dict[str, str]:
+    async with session_maker() as session:
+        img = await session.get(Image, image_id)
+    if img is None or not img.image_url:
+        return {}
+
+    async with image_ingest.open_image(img.image_url) as f:
+        rendered = await asyncio.to_thread(_render, f)
+
+    urls: Dict[str, str] = {}
+    for variant, data in rendered.items():
+        if data is None:
+            urls[variant] = img.image_url
+            counters["reused_original"] += 1
+            continue
+        spooled = await image_ingest.spool(_chunks(data))
+        try:
+            urls[variant] = await image_store.save(
+                spooled, variant_name(img.image_url, variant)
+            )
+        finally:
+            spooled.discard()
+        counters["generated"] += 1
+
+    async with session_maker() as session:
+        await session.execute(
+            update(Image)
+            .where(Image.id == image_id)  # type: ignore[arg-type]
+            .values({COLUMNS[v]: url for v, url in urls.items()})
+        )
+        await session.commit()
+    logger.info("Image variants for image_id=%d: %s", image_id, ", ".join(urls))
+    return urls
+
+
+async def generate(image_id: int) -> None:
+    """Variants job: render and store every variant of an uploaded image."""
+    await ensure(image_id, force=True)
+
+
+async def ensure(image_id: int, force: bool = False) -> Dict[str, str]:
+    """
+    URL of every variant of the image, rendering them if any is missing.
+    Concurrent calls for one image share a single render.
+    """
+    if not force:
+        async with session_maker() as session:
+            row = (
+                await session.execute(
+                    select(*(getattr(Image, c) for c in COLUMNS.values())).where(
+                        Image.id == image_id
+                    )
+                )
+            ).first()
+        if row is None:
+            return {}
+        urls = {v: url for v, url in zip(COLUMNS, row) if url}
+        if len(urls) == len(COLUMNS):
+            return urls
+        counters["on_demand"] += 1
+
+    task = _in_flight.get(image_id)
+    if task is None:
+        task = asyncio.create_task(_generate(image_id))
+        _in_flight[image_id] = task
+        task.add_done_callback(lambda _: _in_flight.pop(image_id, None))
+    return await asyncio.shield(task)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "sizes": {variant: edge for variant, (edge, _) in VARIANTS.items()},
+        **counters,
+        "in_flight": len(_in_flight),
+    }
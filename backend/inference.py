@@ -0,0 +1,461 @@
+"""
+inference.py
+────────────
+Vision and LLM inference for uploaded images, run by the inference workers
+(``inference_worker.py``) from durable jobs rather than inside the request.
+
+Two job kinds:
+  • vision    — fetch the stored JPEG, call the Vision Microservice
+                (SAM3 + ResNet18), write the results, and queue a diagnosis
+                job when the service sets ``trigger_llm``.
+  • diagnosis — ask a vision LLM on OpenRouter for a natural-language
+                diagnosis with sensor / history context.
+
+Handlers raise ``RetryLater`` when an upstream service is unavailable and the
+job has attempts left; on the final attempt they fall back to writing the
+degraded result, as the old in-process background task always did.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import select
+
+import diagnosis_policy
+import image_ingest
+import image_variants
+import latest_state
+import vision_cache
+from db import session_maker
+from http_clients import openrouter_client
+from models import DiagnosisBaseline, Image, Plant
+from vision_cache import VISION_CACHE_SIZE
+from vision_client import call_vision_service
+
+logger = logging.getLogger("plantvita.backend.inference")
+
+
+class RetryLater(Exception):
+    """An upstream service is unavailable; retry the job after a backoff."""
+
+
+# ── Vision ────────────────────────────────────────────────────────────────────
+
+
+async def run_vision(
+    image_id: int,
+    force_universal: bool = False,
+    final_attempt: bool = True,
+) -> None:
+    """
+    Vision job: calls Vision Microservice → writes results → queues diagnosis.
+
+    A frame matching an earlier one in ``vision_cache`` reuses that image's
+    vision results without calling the service.  Its diagnosis is reused only
+    when the earlier image is of the same plant — a diagnosis is written from
+    that plant's sensors and history, so it never crosses to another plant —
+    and is that plant's diagnosis baseline, so a placeholder is never copied.
+    Otherwise the diagnosis goes through ``diagnosis_policy.schedule``.
+    """
+    async with session_maker() as session:
+        result = await session.execute(
+            select(
+                Image.image_url, Image.content_sha256, Image.plant_id, Plant.species
+            )
+            .join(Plant, Plant.id == Image.plant_id)  # type: ignore[arg-type]
+            .where(Image.id == image_id)
+        )
+        row = result.first()
+
+    if row is None:
+        logger.error("Image row %d not found — vision job dropped", image_id)
+        return
+
+    plant_species = row.species if row.species else "Unknown"
+
+    # The image is read from its file handle, never loaded into a bytes copy.
+    async with image_ingest.open_image(row.image_url) as image:
+        # ── 1. Same frame seen before? ────────────────────────────────────────
+        fp: Optional[vision_cache.Fingerprint] = None
+        hit: Optional[vision_cache.CacheHit] = None
+        if VISION_CACHE_SIZE > 0:
+            fp = await vision_cache.fingerprint(image, row.content_sha256)
+            async with session_maker() as session:
+                hit = await vision_cache.lookup(
+                    session, fp, plant_species, force_universal
+                )
+
+        # ── 2. Call Vision Microservice ───────────────────────────────────────
+        if hit is not None:
+            vision = {**hit.result, "vision_error": None}
+            logger.info(
+                "Vision cache hit (%s) for image_id=%d — reusing image_id=%d",
+                hit.kind,
+                image_id,
+                hit.source_image_id,
+            )
+        else:
+            vision = await call_vision_service(
+                image,
+                filename=f"plant_{row.plant_id}.jpg",
+                plant_species=plant_species,
+                force_universal=force_universal,
+            )
+            if vision.get("vision_error") and not final_attempt:
+                raise RetryLater(vision["vision_error"])
+
+    # ── 3. Persist vision fields (and queue the diagnosis atomically) ─────────
+    async with session_maker() as session:
+        result = await session.execute(select(Image).where(Image.id == image_id))
+        img = result.scalars().first()
+        if img is None:
+            logger.error(
+                "Image row %d not found — vision results discarded", image_id
+            )
+            return
+
+        img.green_density = vision.get("green_density")
+        img.segmentation_success = vision.get("segmentation_success")
+        img.detected_species = vision.get("species")
+        img.species_confidence = vision.get("species_confidence")
+        img.in_model_scope = vision.get("in_model_scope")
+        img.detected_health = vision.get("health")
+        img.health_confidence = vision.get("health_confidence")
+        img.trigger_llm = vision.get("trigger_llm")
+        img.vision_error = vision.get("vision_error")
+
+        session.add(img)
+        await latest_state.record_vision(session, img.plant_id, image_id, vision)
+        if hit is None and fp is not None:
+            await vision_cache.store(
+                session, fp, plant_species, force_universal, vision, image_id
+            )
+
+        # ── 4. OpenRouter diagnosis (only when trigger_llm is True) ───────────
+        cached_diagnosis = None
+        if hit is not None and vision.get("trigger_llm"):
+            # Only the plant's baseline image carries a known-fresh diagnosis;
+            # any other source may hold a placeholder from a failed run.
+            cached_diagnosis = await session.scalar(
+                select(Image.ai_diagnosis)
+                .join(
+                    DiagnosisBaseline,
+                    DiagnosisBaseline.image_id == Image.id,  # type: ignore[arg-type]
+                )
+                .where(
+                    Image.id == hit.source_image_id,
+                    Image.plant_id == img.plant_id,
+                )
+            )
+        if cached_diagnosis:
+            img.ai_diagnosis = cached_diagnosis
+            await latest_state.record_diagnosis(
+                session, img.plant_id, image_id, cached_diagnosis
+            )
+        elif vision.get("trigger_llm"):
+            await diagnosis_policy.schedule(session, img, vision)
+        await session.commit()
+
+    logger.info(
+        "Vision results written for image_id=%d  trigger_llm=%s",
+        image_id,
+        vision.get("trigger_llm"),
+    )
+
+
+# ── Diagnosis ─────────────────────────────────────────────────────────────────
+
+
+async def run_diagnosis(image_id: int, final_attempt: bool = True) -> None:
+    """
+    Diagnosis job: OpenRouter vision LLM → ``Image.ai_diagnosis``.  The model
+    gets the downscaled ``llm`` variant, not the full frame.
+    """
+    async with session_maker() as session:
+        result = await session.execute(
+            select(Image.image_url).where(Image.id == image_id)
+        )
+        image_url = result.scalar()
+    if image_url is None:
+        logger.error("Image row %d not found — diagnosis job dropped", image_id)
+        return
+    try:
+        variants = await image_variants.ensure(image_id)
+        image_url = variants.get(image_variants.LLM, image_url)
+    except Exception as exc:  # noqa: BLE001 — fall back to the original
+        logger.warning("No LLM variant for image_id=%d: %s", image_id, exc)
+    await _call_openrouter(image_id, image_url, session_maker, final_attempt)
+
+
+async def _call_gemini(
+    image_id: int,
+    image_url: str,
+    async_session_maker: async_sessionmaker,
+) -> None:
+    """
+    Calls the Gemini Vision API with the stored image URL and writes the
+    natural-language diagnosis back to the Image row.
+
+    Requires GEMINI_API_KEY in the environment.
+    """
+    gemini_key = os.getenv("GEMINI_API_KEY", "")
+    if not gemini_key:
+        logger.warning("GEMINI_API_KEY not set — skipping Gemini diagnosis")
+        return
+
+    try:
+        import google.generativeai as genai  # type: ignore[import]
+
+        genai.configure(api_key=gemini_key)
+        model = genai.GenerativeModel("gemini-1.5-flash")
+        prompt = (
+            "You are a plant pathologist. Analyze this plant image and answer:\n"
+            "1. Is the plant healthy? If not, what disease or condition is visible?\n"
+            "2. What are the visible symptoms?\n"
+            "3. What treatment or care changes do you recommend?\n"
+            "Be concise (3-5 sentences)."
+        )
+        response = model.generate_content([{"url": image_url}, prompt])
+        diagnosis = response.text.strip()
+    except Exception as exc:
+        logger.error("Gemini API call failed: %s", exc)
+        diagnosis = f"Gemini API error: {exc}"
+
+    async with async_session_maker() as session:
+        result = await session.execute(select(Image).where(Image.id == image_id))
+        img = result.scalars().first()
+        if img:
+            img.ai_diagnosis = diagnosis
+            session.add(img)
+            await session.commit()
+    logger.info("Gemini diagnosis written for image_id=%d", image_id)
+
+
+async def _call_openrouter(
+    image_id: int,
+    image_url: str,
+    async_session_maker: async_sessionmaker,
+    final_attempt: bool = True,
+) -> None:
+    """
+    Calls a Vision LLM via OpenRouter with the stored image URL and writes the
+    natural-language diagnosis back to the Image row.
+
+    Now uses dynamic context (Sensor data, history, and vision pre-scans).
+    Requires OPENROUTER_API_KEY in the environment.
+
+    If every model is unavailable and this isn't the job's final attempt,
+    raises ``RetryLater`` instead of writing a placeholder diagnosis.
+    """
+    openrouter_key = os.getenv("OPENROUTER_API_KEY", "")
+    if not openrouter_key:
+        logger.warning("OPENROUTER_API_KEY not set — skipping LLM diagnosis")
+        return
+
+    # ── Handle Local vs. Cloud Image URLs ────────────────────────────────────
+    payload_image_url = image_url
+
+    # If the URL doesn't start with http, it's a local file.
+    if not image_url.startswith("http"):
+        # Map the /received_images/... URL to its file under LOCAL_IMAGE_DIR
+        local_file_path = image_ingest.local_path(image_url)
+
+        try:
+            # Create the standard Data URI format that Vision LLMs expect
+            # (encoded straight from a memory map of the file)
+            payload_image_url = await image_ingest.data_uri(image_url)
+        except FileNotFoundError:
+            logger.error("Could not find local image on disk: %s", local_file_path)
+            # Write error to DB and exit early
+            async with async_session_maker() as session:
+                result = await session.execute(
+                    select(Image).where(Image.id == image_id)
+                )
+                if img := result.scalars().first():
+                    img.ai_diagnosis = (
+                        "Error: Local image file lost before AI analysis."
+                    )
+                    session.add(img)
+                    await session.commit()
+            return
+
+    # ── 1. Gather Context from Database ──────────────────────────────────────
+    async with async_session_maker() as session:
+        # Get current image and plant ID
+        img_result = await session.execute(select(Image).where(Image.id == image_id))
+        current_img = img_result.scalars().first()
+        if not current_img:
+            return
+
+        plant_id = current_img.plant_id
+
+        # Get plant details
+        plant_result = await session.execute(select(Plant).where(Plant.id == plant_id))
+        plant = plant_result.scalars().first()
+        plant_species = plant.species if plant and plant.species else "Unknown Plant"
+
+        # Latest sensor reading and previous diagnosis, from plant_latest_state
+        state = await latest_state.get_state(session, plant_id)
+
+    latest_sensor = state if state and state.reading_timestamp else None
+    previous_diagnosis = (
+        state.ai_diagnosis
+        if state and state.diagnosis_image_id not in (None, image_id)
+        else None
+    )
+
+    # ── 2. Format Variables for the Prompt ───────────────────────────────────
+    if latest_sensor:
+        temp = f"Air: {latest_sensor.temp_c}°C | Soil: {latest_sensor.soil_temp_c}°C"
+        moisture = f"Surface: {latest_sensor.soil_surface_pct}% | Root: {latest_sensor.soil_root_pct}%"
+        humidity = f"{latest_sensor.humidity_pct}%"
+        lux = f"{latest_sensor.light_lux} lx"
+        air = (
+            f"PPM: {latest_sensor.air_ppm} | Quality: {latest_sensor.air_quality_pct}%"
+        )
+    else:
+        temp = moisture = humidity = lux = air = "Sensor offline/Unknown"
+
+    if previous_diagnosis:
+        past_history = previous_diagnosis[:300] + "..."
+    else:
+        past_history = "No previous diseases recorded."
+
+    if current_img.detected_health:
+        pre_scan = f"Local Vision AI predicts: {current_img.detected_health} (Confidence: {current_img.health_confidence})"
+    else:
+        pre_scan = "No local vision prescan available."
+
+    # ── 3. The Mega-Prompt ───────────────────────────────────────────────────
+    prompt = f"""You are an expert plant pathologist and agronomist. 
+Analyze the provided plant image alongside its environmental sensor data and medical history to provide a highly accurate diagnosis.
+
+### 📊 Contextual Data
+* **Plant Species:** {plant_species}
+* **Current Sensor Readings:** - Temperature: {temp} 
+  - Moisture: {moisture} 
+  - Ambient Humidity: {humidity} 
+  - Light: {lux}
+  - Air Metrics: {air}
+* **Vision AI Pre-scan:** {pre_scan}
+* **Past Diagnostic History:** {past_history}
+
+### 🎯 Your Task
+Based on the visual evidence in the image AND the contextual data provided above, provide a comprehensive assessment:
+
+1. **Primary Diagnosis:** What is the most likely issue? (Consider diseases, pests, watering habits, or environmental stress).
+2. **Data Correlation:** Explicitly explain how the visible symptoms correlate with the sensor readings or past history. 
+3. **Recommended Action:** Provide 2-3 specific, actionable steps to remedy the situation based on the data.
+
+### 📝 Output Rules
+* Be concise and professional.
+* Do not hallucinate data; if the sensor data contradicts the visual image, point out the discrepancy.
+* Format your response using clear markdown headings and bullet points for readability.
+"""
+
+    # ── 4. Call OpenRouter ───────────────────────────────────────────────────
+    fresh = False  # a model actually answered
+    try:
+        from openai import RateLimitError, APIStatusError
+
+        client = openrouter_client(openrouter_key)
+
+        fallback_models = [
+            "google/gemma-3-27b-it:free",
+            "meta-llama/llama-3.2-11b-vision-instruct:free",
+            "qwen/qwen2.5-vl-72b-instruct:free",
+            "openrouter/auto",  # 'auto' is generally better than 'free' for fallback routing on OpenRouter
+        ]
+
+        diagnosis = None
+
+        for model_id in fallback_models:
+            try:
+                logger.info(f"Attempting OpenRouter diagnosis with {model_id}...")
+
+                response = await client.chat.completions.create(
+                    model=model_id,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {"url": payload_image_url},
+                                },
+                            ],
+                        }
+                    ],
+                    extra_headers={
+                        "HTTP-Referer": "https://your-site-url.com",
+                        "X-Title": "Plant-Vita",
+                    },
+                )
+
+                diagnosis = (
+                    response.choices[0].message.content
+                    or "OpenRouter didn't return a diagnosis"
+                ).strip()
+                logger.info(f"Successfully got diagnosis from {model_id}")
+                break  # Success! Break out of the loop.
+
+            except RateLimitError:
+                logger.warning(
+                    f"Model {model_id} is rate-limited (429). Trying next fallback..."
+                )
+                continue
+
+            except APIStatusError as e:
+                if e.status_code == 429:
+                    logger.warning(
+                        f"Model {model_id} returned a 429 status. Trying next fallback..."
+                    )
+                    continue
+                # If it's a 400 (Bad Request) or 500 (Internal Server Error), still failover
+                logger.warning(
+                    f"Model {model_id} failed with status {e.status_code}: {e}. Trying next..."
+                )
+                continue
+
+            except Exception as e:
+                logger.warning(
+                    f"Model {model_id} failed with unexpected error: {e}. Trying next..."
+                )
+                continue
+
+        fresh = diagnosis is not None
+        if not diagnosis:
+            logger.error("All fallback models failed or were rate-limited.")
+            if not final_attempt:
+                raise RetryLater("All fallback models failed or were rate-limited")
+            diagnosis = "AI diagnosis is temporarily unavailable due to high server load. Please try again later."
+
+    except RetryLater:
+        raise
+    except Exception as exc:
+        logger.error("OpenRouter API call failed: %s", exc)
+        diagnosis = f"OpenRouter API error: {exc}"
+
+    # ── 5. Write the diagnosis back to the database ──────────────────────────
+    async with async_session_maker() as session:
+        # Re-fetch the image row in a new session to ensure we don't hit state issues
+        result = await session.execute(select(Image).where(Image.id == image_id))
+        img = result.scalars().first()
+        if img:
+            img.ai_diagnosis = diagnosis
+            session.add(img)
+            # Placeholders stay on this image only; the plant keeps its last
+            # real diagnosis for the dashboard and the next prompt's history.
+            if fresh:
+                await latest_state.record_diagnosis(
+                    session, img.plant_id, image_id, diagnosis
+                )
+                await diagnosis_policy.record_baseline(session, img)
+            await session.commit()
+
+    logger.info("OpenRouter diagnosis written for image_id=%d", image_id)
@@ -0,0 +1,213 @@
+"""
+inference_worker.py
+───────────────────
+Worker pool that drains the ``inference_job`` queue (see ``jobs.py``).
+
+Run it as its own process — start as many as the vision service and LLM
+quota can take:
+
+    python inference_worker.py
+
+Each process runs at most ``INFERENCE_CONCURRENCY`` jobs at a time — keep it
+at least ``VISION_BATCH_MAX`` so vision batches can fill (``vision_client``).  For
+development the API can host a pool itself with
+``INFERENCE_WORKERS_IN_PROCESS=1``; in production keep it 0 so upload latency
+and web-process memory are independent of inference.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+from typing import Awaitable, Callable, Dict, Optional
+
+import http_clients
+import image_variants
+import inference
+import jobs
+from db import engine, session_maker
+from vision_client import VISION_HEALTH_INTERVAL, health_monitor_loop
+from models import InferenceJob
+
+logger = logging.getLogger("plantvita.backend.inference_worker")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+INFERENCE_CONCURRENCY: int = int(os.getenv("INFERENCE_CONCURRENCY", "8"))
+# Development convenience: run a pool inside the API process as well.
+INFERENCE_WORKERS_IN_PROCESS: bool = (
+    os.getenv("INFERENCE_WORKERS_IN_PROCESS", "0") == "1"
+)
+_POLL_SECONDS: float = float(os.getenv("INFERENCE_POLL_INTERVAL", "2"))
+
+_HANDLERS: Dict[str, Callable[[InferenceJob, bool], Awaitable[None]]] = {
+    jobs.VISION: lambda job, final: inference.run_vision(
+        job.image_id, job.force_universal, final_attempt=final
+    ),
+    jobs.DIAGNOSIS: lambda job, final: inference.run_diagnosis(
+        job.image_id, final_attempt=final
+    ),
+    jobs.VARIANTS: lambda job, final: image_variants.generate(job.image_id),
+}
+
+# Per-process counters, reported by the API's /metrics when running in-process.
+pool_stats: Dict[str, int] = {
+    "in_flight": 0,
+    "completed": 0,
+    "retried": 0,
+    "dead": 0,
+    "lease_lost": 0,
+}
+
+
+async def _keep_lease(job: InferenceJob, done: asyncio.Event) -> None:
+    """Renew ``job``'s lease every third of it until ``done`` or lost."""
+    while True:
+        try:
+            await asyncio.wait_for(done.wait(), timeout=jobs.INFERENCE_JOB_LEASE / 3)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            async with session_maker() as session:
+                held = await jobs.extend_lease(session, job)
+        except Exception as exc:  # noqa: BLE001 — retry on the next beat
+            logger.warning("Could not renew lease of job %d: %s", job.id, exc)
+            continue
+        if not held:
+            logger.warning("Inference job %d lost its lease", job.id)
+            return
+
+
+def _lease_lost(job: InferenceJob) -> None:
+    pool_stats["lease_lost"] += 1
+    logger.warning(
+        "Inference job %d (%s) finished after its lease was lost — "
+        "outcome dropped, the new owner's stands",
+        job.id,
+        job.kind,
+    )
+
+
+async def _process(job: InferenceJob) -> None:
+    job_id = job.id
+    if job.attempts > job.max_attempts:
+        # Lease ran out on the final attempt — the worker running it died.
+        async with session_maker() as session:
+            if await jobs.fail(session, job, "Lease expired on final attempt"):
+                pool_stats["dead"] += 1
+                logger.error("Inference job %d dead-lettered: lease expired", job_id)
+        return
+
+    handler = _HANDLERS.get(job.kind)
+    final = job.attempts >= job.max_attempts
+    # Stopped, not cancelled, so a renewal is never cut off between its commit
+    # and recording the new lease on ``job``.
+    done = asyncio.Event()
+    heartbeat = asyncio.create_task(_keep_lease(job, done))
+    error: Optional[str] = None
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind {job.kind!r}")
+        await handler(job, final)
+    except inference.RetryLater as exc:
+        error = str(exc)
+    except Exception as exc:  # noqa: BLE001
+        logger.exception("Inference job %d (%s) failed", job_id, job.kind)
+        error = f"{type(exc).__name__}: {exc}"
+    finally:
+        done.set()
+        await heartbeat
+
+    if error is None:
+        async with session_maker() as session:
+            if not await jobs.complete(session, job):
+                _lease_lost(job)
+                return
+        pool_stats["completed"] += 1
+        return
+
+    async with session_maker() as session:
+        status = await jobs.fail(session, job, error)
+    if status is None:
+        _lease_lost(job)
+        return
+    pool_stats["dead" if status == "dead" else "retried"] += 1
+    log = logger.error if status == "dead" else logger.warning
+    log(
+        "Inference job %d (%s) attempt %d/%d failed → %s: %s",
+        job_id,
+        job.kind,
+        job.attempts,
+        job.max_attempts,
+        status,
+        error,
+    )
+
+
+async def _worker(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            async with session_maker() as session:
+                job = await jobs.claim(session)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Could not claim inference job: %s", exc)
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        pool_stats["in_flight"] += 1
+        try:
+            await _process(job)
+        finally:
+            pool_stats["in_flight"] -= 1
+
+
+async def run_pool(
+    concurrency: int = INFERENCE_CONCURRENCY, stop: Optional[asyncio.Event] = None
+) -> None:
+    """Run ``concurrency`` workers until ``stop`` is set (in-flight jobs finish)."""
+    stop = stop or asyncio.Event()
+    logger.info("Inference worker pool started (concurrency=%d)", concurrency)
+    await asyncio.gather(*(_worker(stop) for _ in range(concurrency)))
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s  %(levelname)-8s  %(name)s — %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    async def _run() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await http_clients.open_clients()
+        # Lets an open vision circuit half-open as soon as the service is back.
+        monitor = (
+            asyncio.create_task(health_monitor_loop())
+            if VISION_HEALTH_INTERVAL > 0
+            else None
+        )
+        try:
+            await run_pool(INFERENCE_CONCURRENCY, stop)
+        finally:
+            if monitor is not None:
+                monitor.cancel()
+            await http_clients.close_clients()
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+jobs.py
+───────
+Durable queue of inference jobs on the ``inference_job`` table.
+
+The API only ``enqueue``s — in the same transaction as the Image row, so an
+upload can't be committed without its job.  Workers (``inference_worker.py``)
+``claim`` jobs with ``FOR UPDATE SKIP LOCKED``, so any number of worker
+processes can drain the queue without handing the same job out twice.
+
+A claim holds a lease (``INFERENCE_JOB_LEASE``) that the worker renews while
+the job runs (``extend_lease``); a worker that dies mid-job simply lets the
+lease run out and the job is claimed again.  The lease's ``locked_until`` is
+also the claim token: ``complete`` / ``fail`` / ``extend_lease`` only touch a
+job still running under the caller's lease, so a worker that lost its lease
+can't overwrite the new owner's outcome.
+
+Failures are retried with exponential backoff plus jitter; a job that fails
+``INFERENCE_MAX_ATTEMPTS`` times is parked as ``dead`` (dead-lettered) with
+its last error for someone to look at.
+
+Statuses: queued → running → done | dead (running → queued on retry).
+"""
+
+from __future__ import annotations
+
+import os
+import random
+from datetime import UTC, datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import func, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from models import InferenceJob
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+INFERENCE_MAX_ATTEMPTS: int = int(os.getenv("INFERENCE_MAX_ATTEMPTS", "5"))
+INFERENCE_JOB_LEASE: int = int(os.getenv("INFERENCE_JOB_LEASE", "300"))  # seconds
+_RETRY_BASE_SECONDS: float = float(os.getenv("INFERENCE_RETRY_BASE", "10"))
+_RETRY_MAX_SECONDS: float = float(os.getenv("INFERENCE_RETRY_MAX", "900"))
+
+VISION = "vision"
+DIAGNOSIS = "diagnosis"
+VARIANTS = "variants"  # thumbnails etc. (image_variants.py)
+
+_CLAIM = text(
+    """
+    UPDATE inference_job j
+    SET status = 'running',
+        attempts = j.attempts + 1,
+        locked_until = now() + make_interval(secs => :lease),
+        updated_at = now()
+    WHERE j.id = (
+        SELECT id FROM inference_job
+        WHERE (status = 'queued' AND run_after <= now())
+           OR (status = 'running' AND locked_until < now())
+        ORDER BY run_after, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.*
+    """
+)
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retry number ``attempts`` (1-based): exponential, jittered."""
+    delay = min(_RETRY_BASE_SECONDS * 2 ** (attempts - 1), _RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+async def enqueue(
+    session: AsyncSession,
+    kind: str,
+    image_id: int,
+    force_universal: bool = False,
+) -> InferenceJob:
+    """Add a job to ``session``; it becomes visible when the caller commits."""
+    job = InferenceJob(
+        kind=kind,
+        image_id=image_id,
+        force_universal=force_universal,
+        max_attempts=INFERENCE_MAX_ATTEMPTS,
+    )
+    session.add(job)
+    return job
+
+
+async def claim(session: AsyncSession) -> Optional[InferenceJob]:
+    """Claim the next runnable job (or one whose lease ran out) and commit."""
+    result = await session.execute(
+        select(InferenceJob).from_statement(_CLAIM), {"lease": INFERENCE_JOB_LEASE}
+    )
+    job = result.scalars().first()
+    await session.commit()
+    return job
+
+
+def _held(job: InferenceJob):
+    """WHERE clause: ``job`` is still running under the lease we took."""
+    return (
+        (InferenceJob.id == job.id)  # type: ignore[operator]
+        & (InferenceJob.status == "running")  # type: ignore[operator]
+        & (InferenceJob.locked_until == job.locked_until)  # type: ignore[operator]
+    )
+
+
+async def extend_lease(session: AsyncSession, job: InferenceJob) -> bool:
+    """Renew ``job``'s lease; False if it has been lost to another worker."""
+    result = await session.execute(
+        update(InferenceJob)
+        .where(_held(job))
+        .values(
+            locked_until=func.now() + timedelta(seconds=INFERENCE_JOB_LEASE),
+            updated_at=datetime.now(UTC),
+        )
+        .returning(InferenceJob.locked_until)
+    )
+    locked_until = result.scalar()
+    await session.commit()
+    if locked_until is None:
+        return False
+    job.locked_until = locked_until
+    return True
+
+
+async def complete(session: AsyncSession, job: InferenceJob) -> bool:
+    """Mark ``job`` done; False (and no change) if its lease was lost."""
+    now = datetime.now(UTC)
+    result = await session.execute(
+        update(InferenceJob)
+        .where(_held(job))
+        .values(
+            status="done",
+            locked_until=None,
+            last_error=None,
+            updated_at=now,
+            finished_at=now,
+        )
+    )
+    await session.commit()
+    return result.rowcount == 1  # type: ignore[attr-defined]
+
+
+async def fail(session: AsyncSession, job: InferenceJob, error: str) -> Optional[str]:
+    """
+    Schedule a retry, or dead-letter the job once it's out of attempts.
+    Returns the new status, or None (and no change) if the lease was lost.
+    """
+    now = datetime.now(UTC)
+    dead = job.attempts >= job.max_attempts
+    values: Dict[str, object] = {
+        "status": "dead" if dead else "queued",
+        "locked_until": None,
+        "last_error": error[:2000],
+        "updated_at": now,
+    }
+    if dead:
+        values["finished_at"] = now
+    else:
+        values["run_after"] = now + backoff(job.attempts)
+
+    result = await session.execute(
+        update(InferenceJob).where(_held(job)).values(**values)
+    )
+    await session.commit()
+    if result.rowcount != 1:  # type: ignore[attr-defined]
+        return None
+    return "dead" if dead else "queued"
+
+
+async def counts(session: AsyncSession) -> Dict[str, int]:
+    """Number of jobs per status, for /metrics."""
+    result = await session.execute(
+        select(InferenceJob.status, func.count()).group_by(InferenceJob.status)
+    )
+    return {status: n for status, n in result.all()}
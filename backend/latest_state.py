@@ -0,0 +1,262 @@
+"""
+latest_state.py
+───────────────
+Maintains ``plant_latest_state`` — the newest reading, image and diagnosis for
+every plant.
+
+Writers call the ``record_*`` helpers inside the same session/transaction as
+the row they insert, before committing.  Every helper is an upsert guarded by
+timestamp (or image id), so out-of-order writes such as a device flushing
+old buffered readings never overwrite newer state.
+
+Readers (dashboard, LLM context) use ``get_state`` or join the table directly.
+"""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime
+from typing import Dict, Iterable, Mapping, Optional
+
+from sqlalchemy import (
+    DateTime,
+    Float,
+    Integer,
+    cast,
+    column,
+    or_,
+    text,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlmodel import select
+
+from models import SENSOR_METRICS, Plant, PlantLatestState
+
+# Mirrored onto the state row; PlantLatestState has a column for each metric.
+_READING_FIELDS = SENSOR_METRICS
+
+_VISION_FIELDS = {
+    # state column      ← vision service result key
+    "detected_health": "health",
+    "health_confidence": "health_confidence",
+    "green_density": "green_density",
+}
+
+_STATE = PlantLatestState.__table__  # type: ignore[attr-defined]
+_PLANT = Plant.__table__  # type: ignore[attr-defined]
+
+
+def _utc(ts: datetime) -> datetime:
+    """Naive timestamps are UTC (as the batch schema reads them)."""
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=UTC)
+
+
+def _critical(soil_root_pct, t_min, t_max):
+    """SQL: root moisture outside the plant's configured thresholds."""
+    return soil_root_pct.is_not(None) & (
+        (soil_root_pct < t_min) | (soil_root_pct > t_max)
+    )
+
+
+# ── Writers ───────────────────────────────────────────────────────────────────
+
+
+async def record_readings(session: AsyncSession, rows: Iterable[Mapping]) -> None:
+    """
+    Fold freshly inserted sensor rows into the state table.
+
+    ``rows`` are the inserted reading dicts (``plant_id``, ``timestamp`` and the
+    metric fields).  Only the newest row per plant is written, with one
+    multi-row upsert.  ``is_critical`` is computed in that statement against
+    the ``plant`` row's thresholds — not the plant cache, which another worker
+    may not have invalidated after a threshold change.
+    """
+    newest: Dict[int, Mapping] = {}
+    for row in rows:
+        current = newest.get(row["plant_id"])
+        if current is None or _utc(row["timestamp"]) >= _utc(current["timestamp"]):
+            newest[row["plant_id"]] = row
+    if not newest:
+        return
+
+    readings = values(
+        column("plant_id", Integer),
+        column("reading_timestamp", DateTime(timezone=True)),
+        *(column(f, Float) for f in _READING_FIELDS),
+        name="r",
+    ).data(
+        [
+            (plant_id, row["timestamp"], *(row.get(f) for f in _READING_FIELDS))
+            for plant_id, row in newest.items()
+        ]
+    )
+    # A NULL in VALUES is rendered untyped (text) — cast the metrics back.
+    metrics = {f: cast(readings.c[f], Float) for f in _READING_FIELDS}
+    stmt = pg_insert(_STATE).from_select(
+        ["plant_id", "reading_timestamp", *_READING_FIELDS, "is_critical"],
+        select(
+            readings.c.plant_id,
+            readings.c.reading_timestamp,
+            *metrics.values(),
+            _critical(
+                metrics["soil_root_pct"],
+                _PLANT.c.moisture_threshold_min,
+                _PLANT.c.moisture_threshold_max,
+            ),
+        )
+        .select_from(readings)
+        .join(_PLANT, _PLANT.c.id == readings.c.plant_id),
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_STATE.c.plant_id],
+            set_={
+                c: stmt.excluded[c]
+                for c in ("reading_timestamp", *_READING_FIELDS, "is_critical")
+            },
+            where=or_(
+                _STATE.c.reading_timestamp.is_(None),
+                _STATE.c.reading_timestamp <= stmt.excluded.reading_timestamp,
+            ),
+        )
+    )
+
+
+async def record_image(
+    session: AsyncSession,
+    plant_id: int,
+    image_id: int,
+    image_url: str,
+    timestamp: datetime,
+) -> None:
+    """Point the state row at a newly uploaded image (vision fields reset)."""
+    stmt = pg_insert(_STATE).values(
+        plant_id=plant_id,
+        image_id=image_id,
+        image_timestamp=timestamp,
+        image_url=image_url,
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_STATE.c.plant_id],
+            set_={
+                "image_id": stmt.excluded.image_id,
+                "image_timestamp": stmt.excluded.image_timestamp,
+                "image_url": stmt.excluded.image_url,
+                **{c: None for c in _VISION_FIELDS},
+            },
+            where=or_(
+                _STATE.c.image_timestamp.is_(None),
+                _STATE.c.image_timestamp <= stmt.excluded.image_timestamp,
+            ),
+        )
+    )
+
+
+async def record_vision(
+    session: AsyncSession, plant_id: int, image_id: int, vision: Mapping
+) -> None:
+    """Copy vision results onto the state row if ``image_id`` is still latest."""
+    await session.execute(
+        update(_STATE)
+        .where(_STATE.c.plant_id == plant_id, _STATE.c.image_id == image_id)
+        .values({col: vision.get(key) for col, key in _VISION_FIELDS.items()})
+    )
+
+
+async def record_diagnosis(
+    session: AsyncSession, plant_id: int, image_id: int, diagnosis: str
+) -> None:
+    """Remember the newest LLM diagnosis for the plant."""
+    stmt = pg_insert(_STATE).values(
+        plant_id=plant_id, diagnosis_image_id=image_id, ai_diagnosis=diagnosis
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_STATE.c.plant_id],
+            set_={
+                "diagnosis_image_id": stmt.excluded.diagnosis_image_id,
+                "ai_diagnosis": stmt.excluded.ai_diagnosis,
+            },
+            where=or_(
+                _STATE.c.diagnosis_image_id.is_(None),
+                _STATE.c.diagnosis_image_id <= stmt.excluded.diagnosis_image_id,
+            ),
+        )
+    )
+
+
+async def refresh_critical(
+    session: AsyncSession, plant_id: int, t_min: int, t_max: int
+) -> None:
+    """Recompute ``is_critical`` after the plant's thresholds change."""
+    await session.execute(
+        update(_STATE)
+        .where(_STATE.c.plant_id == plant_id)
+        .values(is_critical=_critical(_STATE.c.soil_root_pct, t_min, t_max))
+    )
+
+
+# ── Readers ───────────────────────────────────────────────────────────────────
+
+
+async def get_state(
+    session: AsyncSession, plant_id: int
+) -> Optional[PlantLatestState]:
+    result = await session.execute(
+        select(PlantLatestState).where(PlantLatestState.plant_id == plant_id)
+    )
+    return result.scalars().first()
+
+
+# ── Backfill ──────────────────────────────────────────────────────────────────
+
+_BACKFILL_SQL = text(
+    f"""
+    INSERT INTO plant_latest_state (
+        plant_id,
+        reading_timestamp, {", ".join(_READING_FIELDS)},
+        is_critical,
+        image_id, image_timestamp, image_url,
+        detected_health, health_confidence, green_density,
+        diagnosis_image_id, ai_diagnosis
+    )
+    SELECT
+        p.id,
+        r.timestamp, {", ".join(f"r.{f}" for f in _READING_FIELDS)},
+        COALESCE(r.soil_root_pct < p.moisture_threshold_min
+                 OR r.soil_root_pct > p.moisture_threshold_max, false),
+        i.id, i.timestamp, i.image_url,
+        i.detected_health, i.health_confidence, i.green_density,
+        d.id, d.ai_diagnosis
+    FROM plant p
+    LEFT JOIN LATERAL (
+        SELECT * FROM sensorreading s
+        WHERE s.plant_id = p.id ORDER BY s.timestamp DESC LIMIT 1
+    ) r ON true
+    LEFT JOIN LATERAL (
+        SELECT * FROM image im
+        WHERE im.plant_id = p.id ORDER BY im.timestamp DESC LIMIT 1
+    ) i ON true
+    LEFT JOIN LATERAL (
+        SELECT id, ai_diagnosis FROM image im
+        WHERE im.plant_id = p.id AND im.ai_diagnosis IS NOT NULL
+        ORDER BY im.timestamp DESC LIMIT 1
+    ) d ON true
+    WHERE NOT EXISTS (
+        SELECT 1 FROM plant_latest_state ls WHERE ls.plant_id = p.id
+    )
+    ON CONFLICT (plant_id) DO NOTHING
+    """
+)
+
+
+async def backfill(conn: AsyncConnection) -> int:
+    """
+    Seed state rows for plants that don't have one yet (first deploy, or plants
+    created before this table existed).  Cheap no-op once every plant has a row.
+    """
+    result = await conn.execute(_BACKFILL_SQL)
+    return result.rowcount or 0
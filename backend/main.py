@@ -7,28 +7,40 @@ Changes vs original:
   • POST /plants/{mac_address}/image/
       - Accepts multipart JPEG from ESP32-CAM
       - Saves to Google Cloud Storage (or local disk as fallback)
-      - Fires a BackgroundTask that:
+      - Queues a durable inference job (``jobs.py``); an inference worker
+        (``inference_worker.py``) then:
           1. Calls the host-side Vision Microservice → ResNet18 + SAM3
           2. Writes all vision fields back to the Image row
-          3. If trigger_llm is True → calls Gemini API for a diagnosis
+          3. If trigger_llm is True → queues an LLM diagnosis job
   • GET /plants/{plant_id}/images/   — list all images for a plant
   • GET /plants/{plant_id}/diagnosis/ — latest image + vision + Gemini result
   • GET /health                      — backend + vision service liveness
+  • POST /plants/{mac_address}/readings/batch — buffered readings, one INSERT
+  • POST /readings/batch             — fleet-wide batch ingest keyed by MAC
+  • GET /metrics                     — in-process cache / pool counters
+  • GET /plants/{plant_id}/export    — streamed csv / ndjson / parquet history
+  • GET /export                      — same, for every plant on the account
+  • GET /plants/{mac_address}/commands?wait=N — long-poll for the next command
+  • GET /plants/{mac_address}/commands/stream — SSE push of queued commands
+  • Token-bucket rate limits per device / per user (``rate_limit``) → 429
+  • Read-only endpoints served by the replica when one is configured
+    (``replica``), with read-your-writes after a user's own changes
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import math
 from pydantic import BaseModel
 import os
 from contextlib import asynccontextmanager
 from datetime import timedelta
-from typing import AsyncGenerator, List, cast, Any, Optional
+from typing import AsyncGenerator, List, Literal, cast, Any, Optional
 import aiofiles
 import base64
 
 from fastapi import (
-    BackgroundTasks,
     Depends,
     FastAPI,
     File,
@@ -37,27 +49,57 @@ from fastapi import (
     UploadFile,
     status,
     Form,
+    Query,
     Request,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import selectinload
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import SQLModel, select, text
 from datetime import datetime, timezone, date, UTC
 
 from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
-    ALGORITHM,
-    SECRET_KEY,
     create_access_token,
     create_refresh_token,
     decode_token,
-    get_hashed_password,
-    verify_password,
+    PasswordHasherBusy,
+    get_hashed_password_async,
+    hash_pool,
+    verify_password_async,
 )
-from models import Image, Plant, SensorReading, User, Command
+from models import Image, Plant, PlantLatestState, SensorReading, User, Command
+from plant_cache import plant_cache, resolve_plant, resolve_plants
+from auth_cache import UserRef
+import auth_cache
+from history import latest_readings, latest_readings_for_plants
+import latest_state
+import sensor_aggregates
+import export
+import command_notify
+import command_queue
+import jobs
+import http_clients
+import image_ingest
+import image_store
+import image_variants
+import diagnosis_policy
+import rate_limit
+import replica
+import db
+from db import engine, get_session, session_maker
+from inference_worker import INFERENCE_WORKERS_IN_PROCESS, pool_stats, run_pool
+from command_notify import COMMAND_PG_NOTIFY, command_notifier, listen_loop
+from rate_limit import RateLimited, per_client, per_device
+from migrations import (
+    SENSOR_PARTITIONING,
+    apply_migrations,
+    ensure_sensor_partitions,
+    partition_maintenance_loop,
+)
+from rollups import ROLLUP_INTERVAL, rollup_loop
 from schemas import (
     ImageRead,
     ImageUploadResponse,
@@ -65,11 +107,16 @@ from schemas import (
     PlantRead,
     PlantUpdate,
     PlantSummary,
+    SensorReadingBatchItem,
+    SensorReadingBatchResponse,
     SensorReadingCreate,
     SensorReadingRead,
+    FleetSensorReadingCreate,
+    MetricStats,
+    SensorAggregateRead,
+    SensorBucket,
     SocialLogin,
     Token,
-    TokenData,
     TokenRefreshRequest,
     UserCreate,
     UserRead,
@@ -79,7 +126,15 @@ from schemas import (
     CommandCreate,
     CommandRead,
 )
-from vision_client import call_vision_service, check_vision_health
+from vision_cache import vision_cache
+from vision_client import (
+    VISION_HEALTH_INTERVAL,
+    check_vision_health,
+    health_monitor_loop,
+    vision_batcher,
+    vision_breaker,
+    vision_health,
+)
 from fastapi.staticfiles import StaticFiles
 
 
@@ -94,34 +149,63 @@ logger = logging.getLogger("plantvita.backend")
 
 # ── Config ────────────────────────────────────────────────────────────────────
 
-DATABASE_URL = os.getenv("DB_URL")
 API_SECRET_KEY = os.getenv("API_SECRET_KEY")
-GCS_BUCKET = os.getenv("GCS_BUCKET", "")  # optional — falls back to local
 
-if not DATABASE_URL:
-    raise RuntimeError("DB_URL environment variable is not set")
-if not API_SECRET_KEY:
-    raise RuntimeError("API_SECRET_KEY environment variable is not set")
+# Upper bound on rows accepted by the batch ingest endpoints.  Keeps the single
+# multi-row INSERT well under Postgres' 32767 bind-parameter limit.
+READINGS_BATCH_MAX = int(os.getenv("READINGS_BATCH_MAX", "500"))
 
-# ── Database ──────────────────────────────────────────────────────────────────
+# Default number of embedded sensor readings in PlantRead responses.
+READINGS_WINDOW_DEFAULT = 24
+READINGS_WINDOW_MAX = 1000
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# Longest a device may park on GET /plants/{mac}/commands?wait=N.  Keep it
+# below any proxy / load-balancer idle timeout in front of the backend.
+COMMAND_WAIT_MAX = int(os.getenv("COMMAND_WAIT_MAX", "55"))
+COMMAND_STREAM_KEEPALIVE = 15.0
 
+if not API_SECRET_KEY:
+    raise RuntimeError("API_SECRET_KEY environment variable is not set")
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async_session = async_sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
-        yield session
+# ── Database ──────────────────────────────────────────────────────────────────
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await apply_migrations(conn)
+        await ensure_sensor_partitions(conn)
+        seeded = await latest_state.backfill(conn)
+        if seeded:
+            logger.info("Seeded plant_latest_state for %d plants", seeded)
+
+    await http_clients.open_clients()
+    await image_store.open_store()
+
+    tasks: List[asyncio.Task] = []
+    if SENSOR_PARTITIONING:
+        tasks.append(asyncio.create_task(partition_maintenance_loop(engine)))
+    if ROLLUP_INTERVAL > 0:
+        tasks.append(asyncio.create_task(rollup_loop(engine)))
+    if COMMAND_PG_NOTIFY:
+        tasks.append(asyncio.create_task(listen_loop(engine)))
+    if INFERENCE_WORKERS_IN_PROCESS:
+        tasks.append(asyncio.create_task(run_pool()))
+    if VISION_HEALTH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(health_monitor_loop()))
+    if replica.enabled():
+        tasks.append(asyncio.create_task(replica.monitor_loop()))
+
     yield
 
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await image_store.close_store()
+    await rate_limit.close_limiter()
+    await http_clients.close_clients()
+
 
 # ── App ───────────────────────────────────────────────────────────────────────
 
@@ -141,7 +225,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/received_images", StaticFiles(directory="received_images"), name="images")
+app.mount(
+    image_ingest.LOCAL_IMAGE_URL_PREFIX,
+    StaticFiles(directory=image_ingest.LOCAL_IMAGE_DIR),
+    name="images",
+)
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    """Login / register backpressure: the bcrypt pool's queue is full."""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many login attempts in progress, retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited(request: Request, exc: RateLimited):
+    """A device or user ran its token bucket for this route class dry."""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": f"Rate limit exceeded ({exc.route_class}), slow down"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
 
 
 # ── Auth helpers ──────────────────────────────────────────────────────────────
@@ -150,404 +258,61 @@ app.mount("/received_images", StaticFiles(directory="received_images"), name="im
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     session: AsyncSession = Depends(get_session),
-) -> User:
+) -> UserRef:
+    """
+    Resolve the bearer token to a ``UserRef``.  Verified tokens and user
+    identities are cached (``auth_cache``), so repeat requests skip both the
+    signature check and the user query.  Also takes a token from the user's
+    rate-limit bucket, so every authenticated endpoint is limited per user.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str | None = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
+    email = auth_cache.token_subject(token)
+    if email is None:
         raise credentials_exception
 
-    result = await session.execute(select(User).where(User.email == token_data.email))
-    user = result.scalars().first()
+    user = await auth_cache.resolve_user(session, email)
     if user is None:
         raise credentials_exception
+    await rate_limit.check(rate_limit.USER, str(user.id))
     return user
 
 
-# ── Image storage helper ──────────────────────────────────────────────────────
-
-
-async def _store_image(jpeg_bytes: bytes, mac: str, image_id: int) -> str:
-    """
-    Store JPEG bytes and return a public URL.
-
-    If GCS_BUCKET is configured, stream to Google Cloud Storage.
-    Otherwise, write to ./received_images/ (dev/fallback mode).
-    """
-    filename = f"plant_{mac}_{image_id}.jpg"
-
-    if GCS_BUCKET:
-        try:
-            from google.cloud import storage as gcs  # type: ignore[import]
-
-            client = gcs.Client()
-            blob = client.bucket(GCS_BUCKET).blob(f"images/{filename}")
-            blob.upload_from_string(jpeg_bytes, content_type="image/jpeg")
-            blob.make_public()
-            return blob.public_url
-        except Exception as exc:
-            logger.warning("GCS upload failed, falling back to local: %s", exc)
+# ── Read routing ──────────────────────────────────────────────────────────────
 
-    # Local fallback — useful in development / before GCS is wired
-    import aiofiles  # pip install aiofiles
 
-    local_dir = "received_images"
-    os.makedirs(local_dir, exist_ok=True)
-    path = os.path.join(local_dir, filename)
-    async with aiofiles.open(path, "wb") as f:
-        await f.write(jpeg_bytes)
-    return f"/received_images/{filename}"  # relative URL — serve with StaticFiles if needed
-
-
-# ── Vision background task ────────────────────────────────────────────────────
+async def get_user_read_session(
+    current_user: UserRef = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """Session for a read-only view of the user's plants (replica if fresh)."""
+    async with replica.read_session(replica.user_key(current_user.id)) as session:
+        yield session
 
 
-async def _run_vision_and_LLM_inference(
-    image_id: int,
-    jpeg_bytes: bytes,
+async def get_plant_read_session(
     plant_id: int,
-    force_universal: bool = False,
-) -> None:
-    """
-    BackgroundTask: calls Vision Microservice → writes results → optional Gemini call.
-
-    Runs after the HTTP response has already been sent to the ESP32-CAM so the
-    device doesn't have to wait for SAM3 + ResNet18 (~5-20 s on CPU).
-    """
-    async_session = async_sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
-
-    async with async_session() as session:
-        result = await session.execute(select(Plant).where(Plant.id == plant_id))
-        plant = result.scalars().first()
-
-    if not plant:
-        raise HTTPException(status_code=404, detail="Plant not found")
-
-    plant_species = plant.species if plant.species else "Unknown"
-
-    # ── 1. Call Vision Microservice ───────────────────────────────────────────
-    vision = await call_vision_service(
-        jpeg_bytes,
-        filename=f"plant_{plant_id}.jpg",
-        plant_species=plant_species,
-        force_universal=force_universal,
-    )
-
-    # ── 2. Persist vision fields ──────────────────────────────────────────────
-    async with async_session() as session:
-        result = await session.execute(select(Image).where(Image.id == image_id))
-        img = result.scalars().first()
-        if img is None:
-            logger.error("Image row %d not found — vision results discarded", image_id)
-            return
-
-        img.green_density = vision.get("green_density")
-        img.segmentation_success = vision.get("segmentation_success")
-        img.detected_species = vision.get("species")
-        img.species_confidence = vision.get("species_confidence")
-        img.in_model_scope = vision.get("in_model_scope")
-        img.detected_health = vision.get("health")
-        img.health_confidence = vision.get("health_confidence")
-        img.trigger_llm = vision.get("trigger_llm")
-        img.vision_error = vision.get("vision_error")
-
-        session.add(img)
-        await session.commit()
-
-    logger.info(
-        "Vision results written for image_id=%d  trigger_llm=%s",
-        image_id,
-        vision.get("trigger_llm"),
-    )
-
-    # ── 3. OpenRouter diagnosis (only when trigger_llm is True) ───────────────────
-    if vision.get("trigger_llm"):
-        await _call_openrouter(image_id, img.image_url, async_session)
+) -> AsyncGenerator[AsyncSession, None]:
+    """Session for a read-only view of one plant (replica if fresh)."""
+    async with replica.read_session(replica.plant_key(plant_id)) as session:
+        yield session
 
 
-async def _call_gemini(
-    image_id: int,
-    image_url: str,
-    async_session_maker: async_sessionmaker,
-) -> None:
-    """
-    Calls the Gemini Vision API with the stored image URL and writes the
-    natural-language diagnosis back to the Image row.
+# ── Image storage helper ──────────────────────────────────────────────────────
 
-    Requires GEMINI_API_KEY in the environment.
-    """
-    gemini_key = os.getenv("GEMINI_API_KEY", "")
-    if not gemini_key:
-        logger.warning("GEMINI_API_KEY not set — skipping Gemini diagnosis")
-        return
 
-    try:
-        import google.generativeai as genai  # type: ignore[import]
-
-        genai.configure(api_key=gemini_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        prompt = (
-            "You are a plant pathologist. Analyze this plant image and answer:\n"
-            "1. Is the plant healthy? If not, what disease or condition is visible?\n"
-            "2. What are the visible symptoms?\n"
-            "3. What treatment or care changes do you recommend?\n"
-            "Be concise (3-5 sentences)."
-        )
-        response = model.generate_content([{"url": image_url}, prompt])
-        diagnosis = response.text.strip()
-    except Exception as exc:
-        logger.error("Gemini API call failed: %s", exc)
-        diagnosis = f"Gemini API error: {exc}"
-
-    async with async_session_maker() as session:
-        result = await session.execute(select(Image).where(Image.id == image_id))
-        img = result.scalars().first()
-        if img:
-            img.ai_diagnosis = diagnosis
-            session.add(img)
-            await session.commit()
-    logger.info("Gemini diagnosis written for image_id=%d", image_id)
-
-
-async def _call_openrouter(
-    image_id: int,
-    image_url: str,
-    async_session_maker: async_sessionmaker,
-) -> None:
+async def _store_image(
+    spooled: image_ingest.SpooledImage, mac: str, image_id: int
+) -> str:
     """
-    Calls a Vision LLM via OpenRouter with the stored image URL and writes the
-    natural-language diagnosis back to the Image row.
+    Store a spooled JPEG and return a public URL.
 
-    Now uses dynamic context (Sensor data, history, and vision pre-scans).
-    Requires OPENROUTER_API_KEY in the environment.
+    Goes to the configured ``image_store`` backend (local disk, GCS or S3);
+    a failed cloud upload falls back to ./received_images/.
     """
-    openrouter_key = os.getenv("OPENROUTER_API_KEY", "")
-    if not openrouter_key:
-        logger.warning("OPENROUTER_API_KEY not set — skipping LLM diagnosis")
-        return
-
-    # ── Handle Local vs. Cloud Image URLs ────────────────────────────────────
-    payload_image_url = image_url
-
-    # If the URL doesn't start with http, it's a local file.
-    if not image_url.startswith("http"):
-        import base64
-        import aiofiles
-
-        # Strip the leading slash so it correctly points to the local folder
-        # relative to where you run your FastAPI app (e.g., "received_images/...")
-        local_file_path = image_url.lstrip("/")
-
-        try:
-            async with aiofiles.open(local_file_path, "rb") as img_file:
-                image_bytes = await img_file.read()
-                base64_encoded = base64.b64encode(image_bytes).decode("utf-8")
-                # Create the standard Data URI format that Vision LLMs expect
-                payload_image_url = f"data:image/jpeg;base64,{base64_encoded}"
-        except FileNotFoundError:
-            logger.error("Could not find local image on disk: %s", local_file_path)
-            # Write error to DB and exit early
-            async with async_session_maker() as session:
-                result = await session.execute(
-                    select(Image).where(Image.id == image_id)
-                )
-                if img := result.scalars().first():
-                    img.ai_diagnosis = (
-                        "Error: Local image file lost before AI analysis."
-                    )
-                    session.add(img)
-                    await session.commit()
-            return
-
-    # ── 1. Gather Context from Database ──────────────────────────────────────
-    async with async_session_maker() as session:
-        # Get current image and plant ID
-        img_result = await session.execute(select(Image).where(Image.id == image_id))
-        current_img = img_result.scalars().first()
-        if not current_img:
-            return
-
-        plant_id = current_img.plant_id
-
-        # Get plant details
-        plant_result = await session.execute(select(Plant).where(Plant.id == plant_id))
-        plant = plant_result.scalars().first()
-        plant_species = plant.species if plant and plant.species else "Unknown Plant"
-
-        # Get latest sensor reading
-        sensor_result = await session.execute(
-            select(SensorReading)
-            .where(SensorReading.plant_id == plant_id)
-            .order_by(SensorReading.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(1)
-        )
-        latest_sensor = sensor_result.scalars().first()
-
-        # Get previous AI diagnosis (skip the current image)
-        history_result = await session.execute(
-            select(Image)
-            .where(
-                Image.plant_id == plant_id,
-                Image.id != image_id,
-                Image.ai_diagnosis != None,
-            )
-            .order_by(Image.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(1)
-        )
-        last_image = history_result.scalars().first()
-
-    # ── 2. Format Variables for the Prompt ───────────────────────────────────
-    if latest_sensor:
-        temp = f"Air: {latest_sensor.temp_c}°C | Soil: {latest_sensor.soil_temp_c}°C"
-        moisture = f"Surface: {latest_sensor.soil_surface_pct}% | Root: {latest_sensor.soil_root_pct}%"
-        humidity = f"{latest_sensor.humidity_pct}%"
-        lux = f"{latest_sensor.light_lux} lx"
-        air = (
-            f"PPM: {latest_sensor.air_ppm} | Quality: {latest_sensor.air_quality_pct}%"
-        )
-    else:
-        temp = moisture = humidity = lux = air = "Sensor offline/Unknown"
-
-    if last_image and last_image.ai_diagnosis:
-        past_history = last_image.ai_diagnosis[:300] + "..."
-    else:
-        past_history = "No previous diseases recorded."
-
-    if current_img.detected_health:
-        pre_scan = f"Local Vision AI predicts: {current_img.detected_health} (Confidence: {current_img.health_confidence})"
-    else:
-        pre_scan = "No local vision prescan available."
-
-    # ── 3. The Mega-Prompt ───────────────────────────────────────────────────
-    prompt = f"""You are an expert plant pathologist and agronomist. 
-Analyze the provided plant image alongside its environmental sensor data and medical history to provide a highly accurate diagnosis.
-
-### 📊 Contextual Data
-* **Plant Species:** {plant_species}
-* **Current Sensor Readings:** - Temperature: {temp} 
-  - Moisture: {moisture} 
-  - Ambient Humidity: {humidity} 
-  - Light: {lux}
-  - Air Metrics: {air}
-* **Vision AI Pre-scan:** {pre_scan}
-* **Past Diagnostic History:** {past_history}
-
-### 🎯 Your Task
-Based on the visual evidence in the image AND the contextual data provided above, provide a comprehensive assessment:
-
-1. **Primary Diagnosis:** What is the most likely issue? (Consider diseases, pests, watering habits, or environmental stress).
-2. **Data Correlation:** Explicitly explain how the visible symptoms correlate with the sensor readings or past history. 
-3. **Recommended Action:** Provide 2-3 specific, actionable steps to remedy the situation based on the data.
-
-### 📝 Output Rules
-* Be concise and professional.
-* Do not hallucinate data; if the sensor data contradicts the visual image, point out the discrepancy.
-* Format your response using clear markdown headings and bullet points for readability.
-"""
-
-    # ── 4. Call OpenRouter ───────────────────────────────────────────────────
-    try:
-        from openai import AsyncOpenAI, RateLimitError, APIStatusError
-
-        client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_key,
-            max_retries=2,
-        )
-
-        fallback_models = [
-            "google/gemma-3-27b-it:free",
-            "meta-llama/llama-3.2-11b-vision-instruct:free",
-            "qwen/qwen2.5-vl-72b-instruct:free",
-            "openrouter/auto",  # 'auto' is generally better than 'free' for fallback routing on OpenRouter
-        ]
-
-        diagnosis = None
-
-        for model_id in fallback_models:
-            try:
-                logger.info(f"Attempting OpenRouter diagnosis with {model_id}...")
-
-                response = await client.chat.completions.create(
-                    model=model_id,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": payload_image_url},
-                                },
-                            ],
-                        }
-                    ],
-                    extra_headers={
-                        "HTTP-Referer": "https://your-site-url.com",
-                        "X-Title": "Plant-Vita",
-                    },
-                )
-
-                diagnosis = (
-                    response.choices[0].message.content
-                    or "OpenRouter didn't return a diagnosis"
-                ).strip()
-                logger.info(f"Successfully got diagnosis from {model_id}")
-                break  # Success! Break out of the loop.
-
-            except RateLimitError:
-                logger.warning(
-                    f"Model {model_id} is rate-limited (429). Trying next fallback..."
-                )
-                continue
-
-            except APIStatusError as e:
-                if e.status_code == 429:
-                    logger.warning(
-                        f"Model {model_id} returned a 429 status. Trying next fallback..."
-                    )
-                    continue
-                # If it's a 400 (Bad Request) or 500 (Internal Server Error), still failover
-                logger.warning(
-                    f"Model {model_id} failed with status {e.status_code}: {e}. Trying next..."
-                )
-                continue
-
-            except Exception as e:
-                logger.warning(
-                    f"Model {model_id} failed with unexpected error: {e}. Trying next..."
-                )
-                continue
-
-        if not diagnosis:
-            logger.error("All fallback models failed or were rate-limited.")
-            diagnosis = "AI diagnosis is temporarily unavailable due to high server load. Please try again later."
-
-    except Exception as exc:
-        logger.error("OpenRouter API call failed: %s", exc)
-        diagnosis = f"OpenRouter API error: {exc}"
-
-    # ── 5. Write the diagnosis back to the database ──────────────────────────
-    async with async_session_maker() as session:
-        # Re-fetch the image row in a new session to ensure we don't hit state issues
-        result = await session.execute(select(Image).where(Image.id == image_id))
-        img = result.scalars().first()
-        if img:
-            img.ai_diagnosis = diagnosis
-            session.add(img)
-            await session.commit()
-
-    logger.info("OpenRouter diagnosis written for image_id=%d", image_id)
+    return await image_store.save(spooled, f"plant_{mac}_{image_id}.jpg")
 
 
 # ═════════════════════════════════════════════════════════════════════════════
@@ -565,11 +330,57 @@ def read_root():
 
 @app.get("/health", tags=["ops"])
 async def health():
-    """Backend liveness + vision service reachability."""
-    vision_status = await check_vision_health()
+    """
+    Backend liveness + vision service reachability.
+
+    The vision status is the health monitor's last probe (see
+    ``vision_client``), so this answers instantly even during an outage;
+    with ``VISION_HEALTH_INTERVAL=0`` it probes live instead.
+    """
+    if VISION_HEALTH_INTERVAL <= 0:
+        vision_status = await check_vision_health()
+        return {
+            "backend": "ok",
+            "vision_service": vision_status or "unreachable",
+            "vision_circuit": vision_breaker.state,
+        }
+
+    cached = vision_health()
+    if cached["checked_at"] is None:
+        vision_service: Any = "unknown"
+    else:
+        vision_service = cached["status"] or "unreachable"
     return {
         "backend": "ok",
-        "vision_service": vision_status or "unreachable",
+        "vision_service": vision_service,
+        "vision_checked_at": cached["checked_at"],
+        "vision_circuit": cached["circuit"],
+    }
+
+
+@app.get("/metrics", tags=["ops"])
+async def metrics(session: AsyncSession = Depends(get_session)):
+    """In-process counters for caches and pools (per backend worker)."""
+    return {
+        "db_pool": db.stats(),
+        "db_replica": replica.stats(),
+        "plant_cache": plant_cache.stats(),
+        "command_waiters": command_notifier.stats(),
+        "inference_jobs": await jobs.counts(session),
+        "inference_workers": {
+            "in_process": INFERENCE_WORKERS_IN_PROCESS,
+            **pool_stats,
+        },
+        "vision_batcher": vision_batcher.stats(),
+        "vision_circuit": vision_breaker.stats(),
+        "vision_cache": vision_cache.stats(),
+        "diagnosis_policy": diagnosis_policy.stats(),
+        "auth_cache": auth_cache.stats(),
+        "password_hashing": hash_pool.stats(),
+        "http_clients": http_clients.stats(),
+        "image_store": image_store.stats(),
+        "image_variants": image_variants.stats(),
+        "rate_limit": rate_limit.stats(),
     }
 
 
@@ -585,9 +396,12 @@ async def register_user(
     existing = result.scalars().first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
+    # Hand the connection back to the pool for the slow bcrypt call.
+    await session.rollback()
 
     db_user = User(
-        email=user.email.lower(), hash_pass=get_hashed_password(user.password)
+        email=user.email.lower(),
+        hash_pass=await get_hashed_password_async(user.password),
     )
     session.add(db_user)
     await session.commit()
@@ -601,10 +415,17 @@ async def login_for_access_token(
     session: AsyncSession = Depends(get_session),
 ):
     result = await session.execute(
-        select(User).where(User.email == form_data.username.lower())
+        select(User.email, User.hash_pass).where(
+            User.email == form_data.username.lower()
+        )
     )
-    user = result.scalars().first()
-    if not user or not verify_password(form_data.password, user.hash_pass):
+    user = result.first()
+    # Don't hold a pooled connection while waiting on bcrypt — a login burst
+    # would otherwise drain the pool that device ingest needs.
+    await session.rollback()
+    if not user or not await verify_password_async(
+        form_data.password, user.hash_pass
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -673,39 +494,77 @@ async def refresh_token(
 # ── Plants ────────────────────────────────────────────────────────────────────
 
 
+def _plant_read(plant: Plant, readings: List[SensorReading]) -> PlantRead:
+    """Build a PlantRead from a plant and an explicitly loaded reading window."""
+    return PlantRead(
+        **plant.model_dump(),
+        sensor_readings=[
+            SensorReadingRead.model_validate(r.model_dump()) for r in readings
+        ],
+    )
+
+
 @app.post("/plants/", response_model=PlantRead)
 async def create_plant(
     plant: PlantCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserRef = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     db_plant = Plant(**plant.model_dump(), owner_id=current_user.id or 0)
     session.add(db_plant)
     await session.commit()
     await session.refresh(db_plant)
-    return db_plant
+    plant_cache.invalidate(db_plant.mac_address)
+    replica.note_write(replica.user_key(current_user.id))
+    return _plant_read(db_plant, [])
+
+
+@app.get("/plants/my_plants", response_model=List[PlantRead])
+async def read_my_plants(
+    readings_limit: int = Query(READINGS_WINDOW_DEFAULT, ge=0, le=READINGS_WINDOW_MAX),
+    readings_since: Optional[datetime] = None,
+    current_user: UserRef = Depends(get_current_user),
+    session: AsyncSession = Depends(get_user_read_session),
+):
+    result = await session.execute(
+        select(Plant).where(Plant.owner_id == current_user.id)
+    )
+    plants = result.scalars().all()
+    windows = await latest_readings_for_plants(
+        session,
+        [cast(int, p.id) for p in plants],
+        readings_limit,
+        since=readings_since,
+    )
+    return [_plant_read(p, windows[cast(int, p.id)]) for p in plants]
 
 
 @app.get("/plants/{plant_id}", response_model=PlantRead)
 async def read_plant(
     plant_id: int,
-    session: AsyncSession = Depends(get_session),
+    readings_limit: int = Query(READINGS_WINDOW_DEFAULT, ge=0, le=READINGS_WINDOW_MAX),
+    readings_since: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_plant_read_session),
 ):
-    result = await session.execute(
-        select(Plant)
-        .where(Plant.id == plant_id)
-        .options(selectinload(Plant.sensor_readings), selectinload(Plant.images))  # type: ignore[arg-type]
-    )
+    """
+    Plant profile plus a bounded window of its newest sensor readings
+    (``readings_limit`` rows, optionally only those since ``readings_since``).
+    """
+    result = await session.execute(select(Plant).where(Plant.id == plant_id))
     plant = result.scalars().first()
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
-    return plant
+
+    readings = await latest_readings(
+        session, plant_id, readings_limit, since=readings_since
+    )
+    return _plant_read(plant, readings)
 
 
 @app.get("/plants/{plant_id}/settings", response_model=PlantUpdate)
 async def get_plant_settings(
     plant_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserRef = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     result = await session.execute(select(Plant).where(Plant.id == plant_id))
@@ -715,19 +574,6 @@ async def get_plant_settings(
     return plant
 
 
-@app.get("/plants/my_plants", response_model=List[PlantRead])
-async def read_my_plants(
-    current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
-):
-    result = await session.execute(
-        select(Plant)
-        .where(Plant.owner_id == current_user.id)
-        .options(selectinload(Plant.sensor_readings))  # type: ignore[arg-type]
-    )
-    return result.scalars().all()
-
-
 @app.post("/devices/register", response_model=DeviceRegisterResponse)
 async def register_device(
     payload: DeviceRegister,
@@ -751,6 +597,11 @@ async def register_device(
         existing_plant.owner_id = cast(int, user.id)
         await session.commit()
         await session.refresh(existing_plant)
+        plant_cache.invalidate(payload.mac_address)
+        replica.note_write(
+            replica.user_key(cast(int, user.id)),
+            replica.plant_key(cast(int, existing_plant.id)),
+        )
         return {"registered": True, "is_new": False, "plant_id": existing_plant.id}
 
     # 3. Auto-increment plant name per user
@@ -772,6 +623,8 @@ async def register_device(
     session.add(new_plant)
     await session.commit()
     await session.refresh(new_plant)
+    plant_cache.invalidate(payload.mac_address)
+    replica.note_write(replica.user_key(cast(int, user.id)))
 
     return {"registered": True, "is_new": True, "plant_id": cast(int, new_plant.id)}
 
@@ -779,26 +632,122 @@ async def register_device(
 # ── Sensor readings ───────────────────────────────────────────────────────────
 
 
-@app.post("/plants/{mac_address}/readings/", response_model=SensorReadingRead)
+@app.post(
+    "/plants/{mac_address}/readings/",
+    response_model=SensorReadingRead,
+    dependencies=[Depends(per_device(rate_limit.READINGS))],
+)
 async def create_sensor_reading(
     mac_address: str,
     reading: SensorReadingCreate,
     session: AsyncSession = Depends(get_session),
 ):
-    result = await session.execute(
-        select(Plant).where(Plant.mac_address == mac_address)
-    )
-    plant = result.scalars().first()
+    plant = await resolve_plant(session, mac_address)
     if not plant:
         raise HTTPException(status_code=404, detail="Device/Plant not registered")
 
-    db_reading = SensorReading(**reading.model_dump(), plant_id=cast(int, plant.id))
+    db_reading = SensorReading(**reading.model_dump(), plant_id=plant.plant_id)
     session.add(db_reading)
+    await latest_state.record_readings(session, [db_reading.model_dump()])
     await session.commit()
     await session.refresh(db_reading)
     return db_reading
 
 
+async def _insert_readings(session: AsyncSession, rows: List[dict]) -> int:
+    """
+    Write ``rows`` with a single multi-row INSERT, fold the newest row per plant
+    into ``plant_latest_state``, and commit.
+
+    Readings without a device-side timestamp are stamped here, since the
+    model's ``default_factory`` only runs for ORM-constructed instances.
+    """
+    if not rows:
+        return 0
+
+    now = datetime.now(UTC)
+    for row in rows:
+        if row.get("timestamp") is None:
+            row["timestamp"] = now
+
+    await session.execute(insert(SensorReading).values(rows))
+    await latest_state.record_readings(session, rows)
+    await session.commit()
+    return len(rows)
+
+
+def _check_batch_size(size: int) -> None:
+    if size > READINGS_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {size} readings (max {READINGS_BATCH_MAX})",
+        )
+
+
+@app.post(
+    "/plants/{mac_address}/readings/batch",
+    response_model=SensorReadingBatchResponse,
+    tags=["iot"],
+    dependencies=[Depends(per_device(rate_limit.READINGS))],
+)
+async def create_sensor_readings_batch(
+    mac_address: str,
+    readings: List[SensorReadingBatchItem],
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    **Device-facing endpoint** — flushes readings buffered while offline.
+
+    The MAC is resolved once and all rows go out in one INSERT, so ingest cost
+    no longer scales with the number of round trips.
+    """
+    _check_batch_size(len(readings))
+
+    plant = await resolve_plant(session, mac_address)
+    if not plant:
+        raise HTTPException(status_code=404, detail="Device/Plant not registered")
+
+    rows = [{**r.model_dump(), "plant_id": plant.plant_id} for r in readings]
+    inserted = await _insert_readings(session, rows)
+    return SensorReadingBatchResponse(inserted=inserted)
+
+
+@app.post(
+    "/readings/batch",
+    response_model=SensorReadingBatchResponse,
+    tags=["iot"],
+    dependencies=[Depends(per_client(rate_limit.GATEWAY))],
+)
+async def create_fleet_readings_batch(
+    readings: List[FleetSensorReadingCreate],
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Fleet-wide ingest keyed by MAC (e.g. from a gateway relaying many devices).
+
+    All MACs are resolved with one query.  Readings for unregistered MACs are
+    skipped and reported back in ``unknown_macs`` instead of failing the batch.
+    """
+    _check_batch_size(len(readings))
+
+    macs = {r.mac_address for r in readings}
+    plants = await resolve_plants(session, macs)
+
+    rows = [
+        {
+            **r.model_dump(exclude={"mac_address"}),
+            "plant_id": plants[r.mac_address].plant_id,
+        }
+        for r in readings
+        if r.mac_address in plants
+    ]
+    inserted = await _insert_readings(session, rows)
+    return SensorReadingBatchResponse(
+        inserted=inserted,
+        unknown_macs=sorted(macs - plants.keys()),
+    )
+
+
 # ── Image upload (IoT → Backend → Vision Service) ─────────────────────────────
 
 
@@ -808,10 +757,10 @@ async def create_sensor_reading(
     status_code=201,
     summary="ESP32-CAM image upload",
     tags=["iot"],
+    dependencies=[Depends(per_device(rate_limit.IMAGE))],
 )
 async def upload_plant_image(
     mac_address: str,
-    background_tasks: BackgroundTasks,
     request: Request,
     session: AsyncSession = Depends(get_session),
 ):
@@ -819,27 +768,29 @@ async def upload_plant_image(
     **Device-facing endpoint** — called by the ESP32-CAM firmware.
 
     1. Looks up the plant by MAC address (404 if not registered).
-    2. Stores the JPEG (GCS or local fallback).
+    2. Streams the JPEG to a spool file (never held in memory; 413 over
+       ``IMAGE_MAX_BYTES``), then stores it (local, GCS or S3).
     3. Creates an Image row immediately.
-    4. Fires a BackgroundTask to:
+    4. Queues a vision job in the same transaction; an inference worker will:
        - Call the Vision Microservice (SAM3 + ResNet18)
-       - Optionally call Gemini for a natural-language diagnosis
+       - Optionally queue an LLM diagnosis
     5. Returns HTTP 201 to the device **without waiting** for vision analysis.
     """
     # Verify device is registered
-    result = await session.execute(
-        select(Plant).where(Plant.mac_address == mac_address)
-    )
-    plant = result.scalars().first()
+    plant = await resolve_plant(session, mac_address)
     if not plant:
         raise HTTPException(
             status_code=404,
             detail=f"Device with MAC {mac_address} is not registered to any plant",
         )
 
-    # Read bytes
-    jpeg_bytes = await request.body()
-    if not jpeg_bytes:
+    # Spool the body to disk as it arrives, hashing it on the way
+    try:
+        spooled = await image_ingest.spool(request.stream())
+    except image_ingest.ImageTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    if not spooled.size:
+        spooled.discard()
         raise HTTPException(status_code=400, detail="Empty image payload")
 
     # Handle force_universal via Header instead of Form (Optional)
@@ -847,29 +798,33 @@ async def upload_plant_image(
         request.headers.get("X-Force-Universal", "false").lower() == "true"
     )
 
-    # Create a stub Image row to get the auto-generated id before storage
-    db_image = Image(
-        plant_id=cast(int, plant.id),
-        image_url="",  # filled in below once we have the id
-    )
-    session.add(db_image)
-    await session.commit()
-    await session.refresh(db_image)
+    try:
+        # Create a stub Image row to get the auto-generated id before storage
+        db_image = Image(
+            plant_id=plant.plant_id,
+            image_url="",  # filled in below once we have the id
+            content_sha256=spooled.sha256,
+            size_bytes=spooled.size,
+        )
+        session.add(db_image)
+        await session.commit()
+        await session.refresh(db_image)
 
-    # Store the image and update the URL
-    image_url = await _store_image(jpeg_bytes, mac_address, cast(int, db_image.id))
+        # Store the image and update the URL
+        image_url = await _store_image(spooled, mac_address, cast(int, db_image.id))
+    finally:
+        spooled.discard()  # no-op once published
     db_image.image_url = image_url
     session.add(db_image)
+    await latest_state.record_image(
+        session, plant.plant_id, cast(int, db_image.id), image_url, db_image.timestamp
+    )
+    await jobs.enqueue(
+        session, jobs.VISION, cast(int, db_image.id), force_universal=force_universal
+    )
+    await jobs.enqueue(session, jobs.VARIANTS, cast(int, db_image.id))
     await session.commit()
 
-    # background_tasks.add_task(
-    #     _run_vision_and_LLM_inference,
-    #     image_id=cast(int, db_image.id),
-    #     jpeg_bytes=jpeg_bytes,
-    #     plant_id=cast(int, plant.id),
-    #     force_universal=force_universal,
-    # )
-
     return ImageUploadResponse(
         id=cast(int, db_image.id),
         image_url=image_url,
@@ -882,8 +837,44 @@ async def upload_plant_image(
 BASE_URL = "http://192.168.137.1:8000"
 
 
+def _public_image_url(image_url: Optional[str]) -> Optional[str]:
+    """Cloud URLs pass through; local paths get BASE_URL prepended."""
+    if not image_url or image_url.startswith("http"):
+        return image_url
+    # Clean up the path (e.g. /received_images/...) and prepend the base URL
+    return f"{BASE_URL}/{image_url.lstrip('/')}"
+
+
+def _variant_url(image_id: int, variant: str, stored: Optional[str]) -> str:
+    """Stored variant URL, or the endpoint that renders it on first request."""
+    return _public_image_url(stored) or f"{BASE_URL}/images/{image_id}/{variant}"
+
+
+def _public_image_urls(img: Image) -> None:
+    img.image_url = _public_image_url(img.image_url) or ""
+    for variant, column in image_variants.COLUMNS.items():
+        stored = getattr(img, column)
+        setattr(img, column, _variant_url(cast(int, img.id), variant, stored))
+
+
+@app.get("/images/{image_id}/{variant}", tags=["vision"])
+async def get_image_variant(image_id: int, variant: str):
+    """
+    Redirect to a downscaled variant (``thumb`` / ``preview`` / ``llm``) of
+    an image, rendering and storing it first if it doesn't exist yet.
+    """
+    if variant not in image_variants.COLUMNS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    urls = await image_variants.ensure(image_id)
+    if variant not in urls:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return RedirectResponse(cast(str, _public_image_url(urls[variant])))
+
+
 @app.get("/plants/{plant_id}/images/", response_model=List[ImageRead])
-async def get_plant_images(plant_id: int, session: AsyncSession = Depends(get_session)):
+async def get_plant_images(
+    plant_id: int, session: AsyncSession = Depends(get_plant_read_session)
+):
     result = await session.execute(
         select(Image)
         .where(Image.plant_id == plant_id)
@@ -892,10 +883,7 @@ async def get_plant_images(plant_id: int, session: AsyncSession = Depends(get_se
     db_images = result.scalars().all()
 
     for img in db_images:
-        if img.image_url and not img.image_url.startswith("http"):
-            # Clean up the path and prepend the base URL
-            path = img.image_url.lstrip("/")
-            img.image_url = f"{BASE_URL}/{path}"
+        _public_image_urls(img)
 
     return db_images
 
@@ -908,7 +896,7 @@ async def get_plant_images(plant_id: int, session: AsyncSession = Depends(get_se
 )
 async def get_latest_diagnosis(
     plant_id: int,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_plant_read_session),
 ):
     """
     Returns the most recent Image row with full vision and Gemini results.
@@ -926,10 +914,7 @@ async def get_latest_diagnosis(
     if not img:
         raise HTTPException(status_code=404, detail="No images found for this plant")
 
-    # FIX: Prepend the BASE_URL to the image path before returning
-    if img.image_url and not img.image_url.startswith("http"):
-        path = img.image_url.lstrip("/")
-        img.image_url = f"{BASE_URL}/{path}"
+    _public_image_urls(img)
 
     return img
 
@@ -938,15 +923,11 @@ async def get_latest_diagnosis(
 async def update_plant(
     plant_id: int,
     plant_update: PlantUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserRef = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     # 1. Fetch the plant
-    result = await session.execute(
-        select(Plant)
-        .where(Plant.id == plant_id)
-        .options(selectinload(cast(Any, Plant.sensor_readings)))
-    )
+    result = await session.execute(select(Plant).where(Plant.id == plant_id))
     plant = result.scalars().first()
 
     if not plant:
@@ -962,80 +943,72 @@ async def update_plant(
         setattr(plant, key, value)
 
     session.add(plant)
+    if update_data.keys() & {"moisture_threshold_min", "moisture_threshold_max"}:
+        await latest_state.refresh_critical(
+            session,
+            plant_id,
+            plant.moisture_threshold_min,
+            plant.moisture_threshold_max,
+        )
     await session.commit()
     await session.refresh(plant)
+    plant_cache.invalidate(plant.mac_address)
+    replica.note_write(replica.user_key(current_user.id), replica.plant_key(plant_id))
 
-    return plant
+    readings = await latest_readings(session, plant_id, READINGS_WINDOW_DEFAULT)
+    return _plant_read(plant, readings)
 
 
 @app.get("/dashboard/plants", response_model=List[PlantSummary], tags=["dashboard"])
 async def get_dashboard_plants(
-    current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    current_user: UserRef = Depends(get_current_user),
+    session: AsyncSession = Depends(get_user_read_session),
 ):
     """
     Returns a lightweight summary of all plants owned by the user.
     Serves local images via static URLs instead of Base64.
+
+    One round trip regardless of plant count: the latest image, reading and
+    critical flag per plant come from ``plant_latest_state``, which is kept
+    current on ingest, so this is a primary-key join rather than a scan of the
+    history tables.
     """
-    # 1. Fetch user's plants
-    plant_result = await session.execute(
-        select(Plant).where(Plant.owner_id == current_user.id)
+    result = await session.execute(
+        select(Plant, PlantLatestState, Image.thumbnail_url, Image.preview_url)
+        .outerjoin(PlantLatestState, PlantLatestState.plant_id == Plant.id)  # type: ignore[arg-type]
+        .outerjoin(Image, Image.id == PlantLatestState.image_id)  # type: ignore[arg-type]
+        .where(Plant.owner_id == current_user.id)
+        .order_by(Plant.id)  # type: ignore[arg-type]
     )
-    plants = plant_result.scalars().all()
 
     summaries = []
-    for p in plants:
-        # 2. Get latest image row
-        img_result = await session.execute(
-            select(Image)
-            .where(Image.plant_id == p.id)
-            .order_by(Image.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(1)
-        )
-        latest_img = img_result.scalars().first()
-
-        # 3. Format Image URL (Cloud vs Static)
-        final_image_url = None
-        if latest_img and latest_img.image_url:
-            if latest_img.image_url.startswith("http"):
-                final_image_url = latest_img.image_url
-            else:
-                # Prepend BASE_URL to the local path (e.g., /received_images/...)
-                path = latest_img.image_url.lstrip("/")
-                final_image_url = f"{BASE_URL}/{path}"
-
-        # 4. Get latest sensor reading
-        sensor_result = await session.execute(
-            select(SensorReading)
-            .where(SensorReading.plant_id == p.id)
-            .order_by(SensorReading.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(1)
-        )
-        latest_sensor = sensor_result.scalars().first()
-
-        # 5. Determine critical status
-        is_critical = False
-        moisture = None
-        if latest_sensor:
-            moisture = latest_sensor.soil_root_pct
-            if (
-                moisture < p.moisture_threshold_min
-                or moisture > p.moisture_threshold_max
-            ):
-                is_critical = True
-
+    for p, state, thumbnail_url, preview_url in result.all():
+        has_image = state is not None and state.image_id is not None
+        image_id = cast(int, state.image_id) if has_image else 0
         summaries.append(
             PlantSummary(
                 id=cast(int, p.id),
                 name=p.name,
                 mac_address=p.mac_address,
                 species=p.species,
-                latest_image_url=final_image_url,
-                latest_moisture_pct=moisture,
+                latest_image_url=(
+                    _public_image_url(state.image_url) or None if has_image else None
+                ),
+                latest_thumbnail_url=(
+                    _variant_url(image_id, image_variants.THUMB, thumbnail_url)
+                    if has_image
+                    else None
+                ),
+                latest_preview_url=(
+                    _variant_url(image_id, image_variants.PREVIEW, preview_url)
+                    if has_image
+                    else None
+                ),
+                latest_moisture_pct=state.soil_root_pct if state else None,
                 latest_health_status=(
-                    latest_img.detected_health if latest_img else "Pending Analysis"
+                    state.detected_health if has_image else "Pending Analysis"
                 ),
-                is_critical=is_critical,
+                is_critical=state.is_critical if state else False,
             )
         )
 
@@ -1048,14 +1021,12 @@ async def get_dashboard_plants(
 async def create_command(
     mac_address: str,
     payload: CommandCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserRef = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
-    # Verify plant exists and belongs to user
-    result = await session.execute(
-        select(Plant).where(Plant.mac_address == mac_address)
-    )
-    plant = result.scalars().first()
+    # Verify plant exists and belongs to user — ownership straight from the DB,
+    # since another worker's cache may predate a device transfer.
+    plant = await resolve_plant(session, mac_address, fresh=True)
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
     if plant.owner_id != current_user.id:
@@ -1064,15 +1035,20 @@ async def create_command(
     # Use plant's pump_duration if not specified
     duration = payload.duration or plant.pump_duration or 5
 
+    now = datetime.now(UTC)
     command = Command(
-        plant_id=cast(int, plant.id),
+        plant_id=plant.plant_id,
         command_type=payload.command_type,
         duration=duration,
         status="pending",
+        created_at=now,
+        expires_at=command_queue.expiry_for(now),
     )
     session.add(command)
+    await command_notify.publish(session, plant.plant_id)
     await session.commit()
     await session.refresh(command)
+    command_notifier.notify(plant.plant_id)
     return command
 
 
@@ -1080,52 +1056,114 @@ async def create_command(
     "/plants/{mac_address}/commands",
     response_model=Optional[CommandRead],
     tags=["commands"],
+    dependencies=[Depends(per_device(rate_limit.COMMANDS))],
 )
 async def get_pending_command(
     mac_address: str,
+    wait: int = Query(0, ge=0, le=COMMAND_WAIT_MAX),
     session: AsyncSession = Depends(get_session),
 ):
-    """ESP32 polls this. Returns the oldest pending command or null."""
-    result = await session.execute(
-        select(Plant).where(Plant.mac_address == mac_address)
-    )
-    plant = result.scalars().first()
+    """
+    ESP32 polls this. Claims and returns the plant's next command, or null.
+
+    The claim is leased: if the device doesn't acknowledge it before
+    ``lease_expires_at`` it is handed out again (see ``command_queue``).
+    With ``wait=N`` the request is held open for up to N seconds until a
+    command is queued for the plant (long-poll), instead of answering null
+    straight away.  No database work happens while it's parked.
+    """
+    plant = await resolve_plant(session, mac_address)
     if not plant:
         raise HTTPException(status_code=404, detail="Plant not found")
 
-    cmd_result = await session.execute(
-        select(Command)
-        .where(Command.plant_id == plant.id, Command.status == "pending")
-        .order_by(Command.created_at.asc())  # type: ignore
-        .limit(1)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    with command_notifier.subscribe(plant.plant_id) as woken:
+        while True:
+            command = await command_queue.claim_next(session, plant.plant_id)
+            remaining = deadline - loop.time()
+            if command is not None or remaining <= 0:
+                return command  # Returns null if no pending commands
+
+            # Hand the connection back to the pool while parked.
+            await session.close()
+            try:
+                await asyncio.wait_for(woken.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            woken.clear()
+
+
+@app.get(
+    "/plants/{mac_address}/commands/stream",
+    tags=["commands"],
+    dependencies=[Depends(per_device(rate_limit.COMMANDS))],
+)
+async def stream_commands(
+    mac_address: str,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Server-Sent Events alternative to polling: claims and emits a ``command``
+    event as soon as one is available, plus a keep-alive comment every
+    ``COMMAND_STREAM_KEEPALIVE`` seconds.  Claims are leased exactly as for
+    polling, so the next command follows once this one is acknowledged.
+    """
+    plant = await resolve_plant(session, mac_address)
+    if not plant:
+        raise HTTPException(status_code=404, detail="Plant not found")
+    await session.close()
+
+    async def events():
+        with command_notifier.subscribe(plant.plant_id) as woken:
+            while True:
+                async with session_maker() as s:
+                    command = await command_queue.claim_next(s, plant.plant_id)
+                if command is not None:
+                    body = CommandRead.model_validate(command).model_dump_json()
+                    yield f"event: command\ndata: {body}\n\n"
+                try:
+                    await asyncio.wait_for(
+                        woken.wait(), timeout=COMMAND_STREAM_KEEPALIVE
+                    )
+                    woken.clear()
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    command = cmd_result.scalars().first()
-    return command  # Returns null if no pending commands
 
 
 @app.post(
     "/plants/{mac_address}/commands/acknowledge",
     response_model=CommandRead,
     tags=["commands"],
+    dependencies=[Depends(per_device(rate_limit.COMMANDS))],
 )
 async def acknowledge_command(
     mac_address: str,
     payload: CommandAcknowledge,
     session: AsyncSession = Depends(get_session),
 ):
-    """ESP32 calls this after executing a command."""
-    cmd_result = await session.execute(
-        select(Command).where(Command.id == payload.command_id)
+    """
+    ESP32 calls this after executing a command.  Only the plant the command
+    was queued for may acknowledge it; repeating an acknowledgement is a no-op.
+    """
+    plant = await resolve_plant(session, mac_address)
+    if not plant:
+        raise HTTPException(status_code=404, detail="Plant not found")
+
+    command = await command_queue.acknowledge(
+        session, plant.plant_id, payload.command_id, payload.status
     )
-    command = cmd_result.scalars().first()
     if not command:
         raise HTTPException(status_code=404, detail="Command not found")
 
-    command.status = payload.status
-    command.executed_at = datetime.now(UTC)
-    session.add(command)
-    await session.commit()
-    await session.refresh(command)
+    # The next queued command (if any) is now at the head of the queue.
+    command_notifier.notify(plant.plant_id)
     return command
 
 
@@ -1137,7 +1175,7 @@ async def acknowledge_command(
 async def get_sensor_history(
     plant_id: int,
     limit: int = 24,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_plant_read_session),
 ):
     result = await session.execute(
         select(SensorReading)
@@ -1147,3 +1185,153 @@ async def get_sensor_history(
     )
     readings = result.scalars().all()
     return list(reversed(readings))  # chronological order for charting
+
+
+@app.get(
+    "/plants/{plant_id}/sensors/aggregate",
+    response_model=SensorAggregateRead,
+    tags=["plants"],
+)
+async def get_sensor_aggregate(
+    plant_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    bucket: str = "1h",
+    mode: Literal["stats", "lttb"] = "stats",
+    metric: str = "soil_root_pct",
+    points: int = Query(500, ge=3, le=sensor_aggregates.MAX_BUCKETS),
+    session: AsyncSession = Depends(get_plant_read_session),
+):
+    """
+    Sensor history for charting, aggregated in the database.
+
+    * ``mode=stats`` — min/max/avg per metric for every ``bucket`` (5m, 1h, 1d…)
+      in ``[from, to)``.  Defaults to the last 24 h.
+    * ``mode=lttb`` — at most ``points`` buckets chosen by LTTB on ``metric``;
+      ``bucket`` is ignored and derived from the range and point budget.
+    """
+    end = (end or datetime.now(UTC)).astimezone(UTC)
+    start = (start or end - timedelta(days=1)).astimezone(UTC)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    if mode == "lttb":
+        if metric not in sensor_aggregates.METRICS:
+            raise HTTPException(status_code=400, detail=f"Unknown metric {metric!r}")
+        # Oversample 4x so LTTB has real shape to choose from.
+        fine = min(points * 4, sensor_aggregates.MAX_BUCKETS)
+        stride = max((end - start) / fine, timedelta(minutes=1))
+    else:
+        try:
+            stride = sensor_aggregates.parse_bucket(bucket)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+    if (end - start) / stride > sensor_aggregates.MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range too large for bucket {bucket}; use a coarser bucket",
+        )
+
+    buckets = await sensor_aggregates.aggregate_readings(
+        session, plant_id, start, end, stride
+    )
+    if mode == "lttb":
+        buckets = sensor_aggregates.downsample(buckets, metric, points)
+
+    return SensorAggregateRead(
+        plant_id=plant_id,
+        start=start,
+        end=end,
+        bucket_seconds=int(stride.total_seconds()),
+        mode=mode,
+        buckets=[
+            SensorBucket(
+                bucket_start=b.start,
+                count=b.count,
+                metrics={
+                    m: MetricStats(min=acc.lo, max=acc.hi, avg=acc.avg)
+                    for m, acc in b.metrics.items()
+                },
+            )
+            for b in buckets
+        ],
+    )
+
+
+# ── Export ────────────────────────────────────────────────────────────────────
+
+
+def _export_response(
+    plant_ids: List[int],
+    filename: str,
+    table: export.ExportTable,
+    fmt: export.ExportFormat,
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> StreamingResponse:
+    if fmt == "parquet" and not export.parquet_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export requires pyarrow on the server",
+        )
+    return StreamingResponse(
+        export.export_chunks(
+            replica.read_session_maker(*map(replica.plant_key, plant_ids)),
+            table,
+            fmt,
+            plant_ids,
+            start,
+            end,
+        ),
+        media_type=export.MEDIA_TYPES[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{fmt}"'
+        },
+    )
+
+
+@app.get("/plants/{plant_id}/export", tags=["plants"])
+async def export_plant_history(
+    plant_id: int,
+    format: export.ExportFormat = "csv",
+    table: export.ExportTable = "readings",
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: UserRef = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Stream a plant's full sensor (``table=readings``) or image history.
+    Rows are read from a server-side cursor, so memory use doesn't grow with
+    the size of the export.
+    """
+    result = await session.execute(
+        select(Plant.id).where(
+            Plant.id == plant_id, Plant.owner_id == current_user.id
+        )
+    )
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Plant not found")
+    return _export_response(
+        [plant_id], f"plant_{plant_id}_{table}", table, format, start, end
+    )
+
+
+@app.get("/export", tags=["plants"])
+async def export_account_history(
+    format: export.ExportFormat = "csv",
+    table: export.ExportTable = "readings",
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: UserRef = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """Like ``/plants/{plant_id}/export`` but across every plant you own."""
+    result = await session.execute(
+        select(Plant.id).where(Plant.owner_id == current_user.id)
+    )
+    plant_ids = [cast(int, pid) for pid in result.scalars().all()]
+    return _export_response(
+        plant_ids, f"plantvita_{table}", table, format, start, end
+    )
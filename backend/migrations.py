@@ -0,0 +1,305 @@
+"""
+migrations.py
+─────────────
+Ordered, idempotent schema migrations applied at startup.
+
+``SQLModel.metadata.create_all`` only creates missing tables — it never adds
+columns or indexes to tables that already exist.  Changes to existing tables
+are therefore listed in ``MIGRATIONS`` and recorded in ``schema_migrations``
+once applied.  Every statement is written to be safe to re-run
+(``IF [NOT] EXISTS``), and the whole run holds an advisory lock so several
+backend workers starting together don't race.
+
+Also manages optional monthly range partitioning of ``sensorreading``
+(``SENSOR_PARTITIONING=monthly``): the table is converted once, and
+``ensure_sensor_partitions`` keeps the next few months' partitions created
+ahead of time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import UTC, date, datetime, time
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger("plantvita.backend.migrations")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+SENSOR_PARTITIONING: str = os.getenv("SENSOR_PARTITIONING", "").lower()  # "" | monthly
+_PARTITION_MONTHS_AHEAD: int = int(os.getenv("SENSOR_PARTITION_MONTHS_AHEAD", "3"))
+_PARTITION_CHECK_SECONDS: float = float(os.getenv("SENSOR_PARTITION_CHECK", "86400"))
+
+# Arbitrary constant shared by all workers for pg_advisory_xact_lock.
+_MIGRATION_LOCK_ID = 74_212_001
+
+# ── Migrations ────────────────────────────────────────────────────────────────
+
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+    (
+        "0001_history_composite_indexes",
+        [
+            # Every history query filters by plant and walks newest-first.
+            "CREATE INDEX IF NOT EXISTS ix_sensorreading_plant_id_timestamp "
+            "ON sensorreading (plant_id, timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_image_plant_id_timestamp "
+            "ON image (plant_id, timestamp DESC)",
+            # Command queue: oldest pending command for a plant.
+            "CREATE INDEX IF NOT EXISTS ix_command_plant_id_status_created_at "
+            "ON command (plant_id, status, created_at)",
+            # Superseded single-column indexes — only cost write amplification.
+            "DROP INDEX IF EXISTS ix_sensorreading_timestamp",
+            "DROP INDEX IF EXISTS ix_image_timestamp",
+            "DROP INDEX IF EXISTS ix_command_created_at",
+        ],
+    ),
+    (
+        "0002_command_claims",
+        [
+            "ALTER TABLE command ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ",
+            "ALTER TABLE command ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ",
+            "ALTER TABLE command "
+            "ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE command ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ",
+        ],
+    ),
+    (
+        "0003_inference_job_kind_run_after",
+        [
+            # Diagnosis budgets: recent jobs of one kind.
+            "CREATE INDEX IF NOT EXISTS ix_inference_job_kind_run_after "
+            "ON inference_job (kind, run_after)",
+        ],
+    ),
+    (
+        "0004_image_content_hash",
+        [
+            "ALTER TABLE image ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR",
+            "ALTER TABLE image ADD COLUMN IF NOT EXISTS size_bytes INTEGER",
+        ],
+    ),
+    (
+        "0005_image_variants",
+        [
+            "ALTER TABLE image ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR",
+            "ALTER TABLE image ADD COLUMN IF NOT EXISTS preview_url VARCHAR",
+            "ALTER TABLE image ADD COLUMN IF NOT EXISTS llm_image_url VARCHAR",
+        ],
+    ),
+    (
+        "0006_rollup_watermark_pending",
+        [
+            "ALTER TABLE rollup_watermark "
+            "ADD COLUMN IF NOT EXISTS pending_id BIGINT NOT NULL DEFAULT 0",
+            "ALTER TABLE rollup_watermark "
+            "ADD COLUMN IF NOT EXISTS pending_at TIMESTAMPTZ",
+        ],
+    ),
+]
+
+
+async def apply_migrations(conn: AsyncConnection) -> List[str]:
+    """Apply pending migrations inside ``conn``'s transaction; return their names."""
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:id)"), {"id": _MIGRATION_LOCK_ID}
+    )
+    await conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " name VARCHAR PRIMARY KEY,"
+            " applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+    )
+    result = await conn.execute(text("SELECT name FROM schema_migrations"))
+    done = set(result.scalars().all())
+
+    applied = []
+    for name, statements in MIGRATIONS:
+        if name in done:
+            continue
+        for stmt in statements:
+            await conn.execute(text(stmt))
+        await conn.execute(
+            text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+            {"name": name},
+        )
+        logger.info("Applied migration %s", name)
+        applied.append(name)
+    return applied
+
+
+# ── sensorreading partitioning ────────────────────────────────────────────────
+
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _add_months(d: date, months: int) -> date:
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+async def _is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(
+        text(
+            "SELECT relkind::text FROM pg_class "
+            "WHERE oid = 'sensorreading'::regclass"
+        )
+    )
+    return result.scalar() == "p"
+
+
+async def _create_month_partition(
+    conn: AsyncConnection, name: str, month: date, upper: date
+) -> None:
+    """
+    Create one monthly partition.  ``CREATE TABLE ... PARTITION OF`` fails
+    outright if ``sensorreading_default`` already holds rows for the month, so
+    the partition is built standalone, those rows are moved into it, and only
+    then is it attached.
+    """
+    lower_ts = f"{month.isoformat()} 00:00:00+00"
+    upper_ts = f"{upper.isoformat()} 00:00:00+00"
+    await conn.execute(
+        text(
+            f"CREATE TABLE {name} (LIKE sensorreading "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    has_default = await conn.execute(
+        text("SELECT to_regclass('sensorreading_default') IS NOT NULL")
+    )
+    if has_default.scalar():
+        moved = await conn.execute(
+            text(
+                "WITH moved AS (DELETE FROM sensorreading_default "
+                "WHERE timestamp >= :lower AND timestamp < :upper RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ),
+            {
+                "lower": datetime.combine(month, time(), UTC),
+                "upper": datetime.combine(upper, time(), UTC),
+            },
+        )
+        if moved.rowcount:
+            logger.warning(
+                "Moved %d reading(s) from sensorreading_default into %s",
+                moved.rowcount,
+                name,
+            )
+    await conn.execute(
+        text(
+            f"ALTER TABLE sensorreading ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower_ts}') TO ('{upper_ts}')"
+        )
+    )
+
+
+async def _create_month_partitions(
+    conn: AsyncConnection, first: date, last: date
+) -> int:
+    """
+    Create monthly partitions covering [first, last] (month granularity).
+    Each month runs in its own savepoint, so one failing month is logged and
+    retried on the next maintenance pass instead of aborting the others.
+    """
+    created = 0
+    month = _month_start(first)
+    while month <= last:
+        upper = _add_months(month, 1)
+        name = f"sensorreading_y{month.year}m{month.month:02d}"
+        exists = await conn.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}
+        )
+        if not exists.scalar():
+            try:
+                async with conn.begin_nested():
+                    await _create_month_partition(conn, name, month, upper)
+                created += 1
+            except Exception as exc:  # noqa: BLE001
+                logger.error("Could not create partition %s: %s", name, exc)
+        month = upper
+    return created
+
+
+async def _convert_sensorreading(conn: AsyncConnection) -> None:
+    """
+    One-time conversion of a plain ``sensorreading`` table into a table
+    range-partitioned by month on ``timestamp``.  Runs in a single transaction,
+    so a failure leaves the original table untouched.
+    """
+    logger.warning("Converting sensorreading to monthly range partitions")
+    bounds = await conn.execute(
+        text("SELECT min(timestamp), max(timestamp) FROM sensorreading")
+    )
+    oldest, newest = bounds.one()
+
+    for stmt in (
+        "ALTER TABLE sensorreading RENAME TO sensorreading_unpartitioned",
+        "CREATE TABLE sensorreading (LIKE sensorreading_unpartitioned "
+        "INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (timestamp)",
+        # The partition key must be part of the primary key.
+        "ALTER TABLE sensorreading ADD PRIMARY KEY (id, timestamp)",
+        "ALTER TABLE sensorreading ADD FOREIGN KEY (plant_id) REFERENCES plant (id)",
+        "ALTER SEQUENCE sensorreading_id_seq OWNED BY sensorreading.id",
+        # Catches readings from devices with wildly wrong clocks.
+        "CREATE TABLE sensorreading_default PARTITION OF sensorreading DEFAULT",
+    ):
+        await conn.execute(text(stmt))
+
+    today = datetime.now(UTC).date()
+    await _create_month_partitions(
+        conn,
+        (oldest.date() if oldest else today),
+        _add_months(max(newest.date() if newest else today, today), 1),
+    )
+
+    await conn.execute(
+        text("INSERT INTO sensorreading SELECT * FROM sensorreading_unpartitioned")
+    )
+    await conn.execute(text("DROP TABLE sensorreading_unpartitioned"))
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_sensorreading_plant_id_timestamp "
+            "ON sensorreading (plant_id, timestamp DESC)"
+        )
+    )
+
+
+async def ensure_sensor_partitions(conn: AsyncConnection) -> None:
+    """
+    No-op unless ``SENSOR_PARTITIONING=monthly``.  Converts the table on first
+    run, then makes sure partitions exist for the next few months.
+    """
+    if SENSOR_PARTITIONING != "monthly":
+        return
+
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:id)"), {"id": _MIGRATION_LOCK_ID}
+    )
+    if not await _is_partitioned(conn):
+        await _convert_sensorreading(conn)
+
+    today = datetime.now(UTC).date()
+    created = await _create_month_partitions(
+        conn, today, _add_months(today, _PARTITION_MONTHS_AHEAD)
+    )
+    if created:
+        logger.info("Created %d sensorreading partition(s)", created)
+
+
+async def partition_maintenance_loop(engine: AsyncEngine) -> None:
+    """Background task: keep future monthly partitions created."""
+    while True:
+        await asyncio.sleep(_PARTITION_CHECK_SECONDS)
+        try:
+            async with engine.begin() as conn:
+                await ensure_sensor_partitions(conn)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Partition maintenance failed: %s", exc)
@@ -8,12 +8,27 @@ Changes vs original:
     that calls the host-side Vision Microservice after each ESP32-CAM upload.
   • All new columns are Optional so existing rows (before the migration) don't
     break reads.
+  • Plant's history relationships are ``lazy="raise"``: loading a plant never
+    drags in its readings/images/commands.  Use ``selectinload`` explicitly or
+    the windowed helpers in ``history.py``.
+  • History tables are indexed on (plant_id, timestamp DESC) instead of a
+    bare timestamp index; ``migrations.py`` brings existing databases along.
 """
 
 from typing import Optional, List, Any
 from datetime import datetime, timezone, date, UTC
 from sqlmodel import Field, SQLModel, Relationship
-from sqlalchemy import Column, DateTime
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    Table,
+    text,
+)
 
 
 class User(SQLModel, table=True):
@@ -52,27 +67,45 @@ class Plant(SQLModel, table=True):
     owner: "User" = Relationship(back_populates="plants")
     sensor_readings: List["SensorReading"] = Relationship(
         back_populates="plant",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise"},
     )
     images: List["Image"] = Relationship(
         back_populates="plant",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise"},
     )
     commands: List["Command"] = Relationship(
         back_populates="plant",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise"},
     )
 
 
+# Numeric sensor columns — shared by the aggregate/rollup code.
+SENSOR_METRICS = (
+    "temp_c",
+    "humidity_pct",
+    "light_lux",
+    "air_ppm",
+    "air_quality_pct",
+    "soil_surface_pct",
+    "soil_root_pct",
+    "soil_temp_c",
+)
+
+
 class SensorReading(SQLModel, table=True):
     __tablename__: Any = "sensorreading"
+    __table_args__ = (
+        Index(
+            "ix_sensorreading_plant_id_timestamp", "plant_id", text("timestamp DESC")
+        ),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
     plant_id: int = Field(foreign_key="plant.id")
     timestamp: datetime = Field(
         default_factory=lambda: datetime.now(UTC),
-        sa_column=Column(DateTime(timezone=True), index=True, nullable=False),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
     )
 
     temp_c: float
@@ -92,7 +125,10 @@ class Image(SQLModel, table=True):
     One row per image uploaded by the ESP32-CAM.
 
     Columns set at INSERT time (device upload):
-      image_url, plant_id, timestamp
+      image_url, plant_id, timestamp, content_sha256, size_bytes
+
+    Downscaled variants (``image_variants.py``), NULL until generated:
+      thumbnail_url, preview_url, llm_image_url
 
     Columns filled in by the BackgroundTask after the Vision Microservice
     returns (may be NULL if the service is temporarily unreachable):
@@ -108,15 +144,24 @@ class Image(SQLModel, table=True):
       vision_error          — populated if the Vision Microservice was unreachable
     """
 
+    __table_args__ = (
+        Index("ix_image_plant_id_timestamp", "plant_id", text("timestamp DESC")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     plant_id: int = Field(foreign_key="plant.id")
 
     timestamp: datetime = Field(
         default_factory=lambda: datetime.now(UTC),
-        sa_column=Column(DateTime(timezone=True), index=True, nullable=False),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
     )
     image_url: str
+    content_sha256: Optional[str] = None  # hashed while the upload streamed in
+    size_bytes: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
+    llm_image_url: Optional[str] = None
     ai_diagnosis: Optional[str] = None
 
     # ── Set by Vision Microservice background task ────────────────────────
@@ -137,6 +182,20 @@ class Image(SQLModel, table=True):
 
 
 class Command(SQLModel, table=True):
+    """
+    Device command queue (see ``command_queue.py``).
+
+    status: pending → claimed → executed | failed, or expired.  A claim holds
+    a lease until ``lease_expires_at``; if the device never acknowledges, the
+    command is delivered again (up to COMMAND_MAX_ATTEMPTS times).
+    """
+
+    __table_args__ = (
+        Index(
+            "ix_command_plant_id_status_created_at", "plant_id", "status", "created_at"
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     plant_id: int = Field(foreign_key="plant.id")
     command_type: str = Field(default="pump")
@@ -144,10 +203,212 @@ class Command(SQLModel, table=True):
     duration: int = Field(default=5)
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(UTC),
-        sa_column=Column(DateTime(timezone=True), index=True, nullable=False),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
     )
     executed_at: Optional[datetime] = Field(
         default=None,
         sa_column=Column(DateTime(timezone=True), nullable=True)
     )
+    claimed_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), nullable=True),
+    )
+    lease_expires_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), nullable=True),
+    )
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": text("0")})
+    expires_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), nullable=True),
+    )
     plant: "Plant" = Relationship(back_populates="commands")
+
+
+class PlantLatestState(SQLModel, table=True):
+    """
+    Newest reading, image and diagnosis per plant — one row per plant.
+
+    Maintained by ``latest_state.py`` in the same transaction as the write it
+    mirrors (sensor ingest, image upload, vision results, LLM diagnosis), so hot
+    reads like the dashboard are a primary-key lookup instead of an
+    ORDER BY ... LIMIT 1 over the history tables.
+    """
+
+    __tablename__: Any = "plant_latest_state"
+
+    plant_id: int = Field(foreign_key="plant.id", primary_key=True)
+
+    # ── Latest sensor reading ─────────────────────────────────────────────
+    reading_timestamp: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    temp_c: Optional[float] = None
+    humidity_pct: Optional[float] = None
+    light_lux: Optional[float] = None
+    air_ppm: Optional[float] = None
+    air_quality_pct: Optional[float] = None
+    soil_surface_pct: Optional[float] = None
+    soil_root_pct: Optional[float] = None
+    soil_temp_c: Optional[float] = None
+    is_critical: bool = Field(default=False)  # soil_root_pct outside thresholds
+
+    # ── Latest image + vision results ─────────────────────────────────────
+    image_id: Optional[int] = None
+    image_timestamp: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    image_url: Optional[str] = None
+    detected_health: Optional[str] = None
+    health_confidence: Optional[float] = None
+    green_density: Optional[float] = None
+
+    # ── Latest LLM diagnosis ──────────────────────────────────────────────
+    diagnosis_image_id: Optional[int] = None
+    ai_diagnosis: Optional[str] = None
+
+
+# ── Sensor rollups ────────────────────────────────────────────────────────────
+# Hourly / daily partial aggregates maintained by ``rollups.py``.  Each metric
+# stores count / sum / min / max so buckets can be merged into any coarser
+# resolution.  Declared as Core tables because the 4-columns-per-metric layout
+# is generated from SENSOR_METRICS.
+
+
+def _rollup_table(name: str) -> Table:
+    columns = [
+        Column("plant_id", Integer, ForeignKey("plant.id"), primary_key=True),
+        Column("bucket_start", DateTime(timezone=True), primary_key=True),
+        Column("count", Integer, nullable=False),
+    ]
+    for m in SENSOR_METRICS:
+        columns += [
+            Column(f"{m}_n", Integer, nullable=False),
+            Column(f"{m}_sum", Float),
+            Column(f"{m}_min", Float),
+            Column(f"{m}_max", Float),
+        ]
+    return Table(name, SQLModel.metadata, *columns)
+
+
+sensorreading_hourly = _rollup_table("sensorreading_hourly")
+sensorreading_daily = _rollup_table("sensorreading_daily")
+
+
+class RollupWatermark(SQLModel, table=True):
+    """
+    Highest ``sensorreading.id`` already folded into the rollup tables, and
+    the candidate it advances to once every transaction open at
+    ``pending_at`` has finished (see ``rollups.py``).
+    """
+
+    __tablename__: Any = "rollup_watermark"
+
+    name: str = Field(primary_key=True)
+    last_id: int = Field(default=0, sa_type=BigInteger)
+    pending_id: int = Field(
+        default=0, sa_type=BigInteger, sa_column_kwargs={"server_default": text("0")}
+    )
+    pending_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    updated_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+
+
+class InferenceJob(SQLModel, table=True):
+    """
+    Durable vision / LLM inference job (see ``jobs.py``).
+
+    status: queued → running → done | dead.  ``run_after`` delays retries;
+    ``locked_until`` is the running worker's lease.
+    """
+
+    __tablename__: Any = "inference_job"
+    __table_args__ = (
+        Index(
+            "ix_inference_job_runnable",
+            "run_after",
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+        # Diagnosis budgets count recent jobs per kind (diagnosis_policy.py).
+        Index("ix_inference_job_kind_run_after", "kind", "run_after"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # vision / diagnosis / variants
+    image_id: int = Field(foreign_key="image.id", index=True)
+    force_universal: bool = Field(default=False)
+
+    status: str = Field(default="queued")
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    last_error: Optional[str] = None
+
+    run_after: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    locked_until: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    updated_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+    finished_at: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+
+
+class DiagnosisBaseline(SQLModel, table=True):
+    """
+    What a plant looked like at its last LLM diagnosis — the vision result
+    and sensor state ``diagnosis_policy.py`` compares new uploads against.
+    """
+
+    __tablename__: Any = "diagnosis_baseline"
+
+    plant_id: int = Field(foreign_key="plant.id", primary_key=True)
+    image_id: Optional[int] = None
+    diagnosed_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    detected_health: Optional[str] = None
+    green_density: Optional[float] = None
+    is_critical: bool = Field(default=False)
+    temp_c: Optional[float] = None
+    humidity_pct: Optional[float] = None
+    light_lux: Optional[float] = None
+    soil_surface_pct: Optional[float] = None
+    soil_root_pct: Optional[float] = None
+
+
+class VisionCacheEntry(SQLModel, table=True):
+    """
+    Persisted key of the vision result cache (see ``vision_cache.py``).
+
+    The cached result itself is the vision fields of ``source_image_id`` —
+    the image that was actually analysed.  ``phash`` is the 64-bit dHash
+    stored as a signed BIGINT (NULL when the image could not be decoded).
+    """
+
+    __tablename__: Any = "vision_cache"
+    __table_args__ = (
+        Index("ix_vision_cache_key", "plant_species", "force_universal", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True)
+    phash: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    plant_species: Optional[str] = None
+    force_universal: bool = Field(default=False)
+    source_image_id: int = Field(foreign_key="image.id")
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
@@ -0,0 +1,186 @@
+"""
+plant_cache.py
+──────────────
+In-process MAC → plant resolution cache for the device-facing endpoints.
+
+Every ESP32 request (readings, image upload, command poll) starts by turning
+its MAC address into a plant.  Loading the full ``Plant`` row for that is
+wasteful, so the hot paths go through ``resolve_plant`` instead, which returns
+a small immutable ``PlantRef`` and keeps it in a bounded LRU with a TTL.
+
+Endpoints that change any cached field (``create_plant``, ``update_plant``,
+``register_device``) must call ``plant_cache.invalidate(mac)``.  The TTL bounds
+staleness when several backend processes each hold their own cache — fine for
+a device looking up its own plant, not for deciding who may act on it: an
+authorization check (e.g. ownership after a device transfer) passes
+``fresh=True`` to read the row from the database.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from models import Plant
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+_MAX_SIZE: int = int(os.getenv("PLANT_CACHE_SIZE", "4096"))
+_TTL_SECONDS: float = float(os.getenv("PLANT_CACHE_TTL", "300"))
+
+
+@dataclass(frozen=True, slots=True)
+class PlantRef:
+    """The subset of ``Plant`` the device paths need."""
+
+    plant_id: int
+    owner_id: int
+    moisture_threshold_min: int
+    moisture_threshold_max: int
+    pump_duration: Optional[int]
+    species: Optional[str]
+
+
+# ── Cache ─────────────────────────────────────────────────────────────────────
+
+
+class PlantCache:
+    """Bounded LRU keyed by MAC address; entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size: int = _MAX_SIZE, ttl: float = _TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, PlantRef]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, mac: str) -> Optional[PlantRef]:
+        entry = self._entries.get(mac)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, ref = entry
+        if expires_at < time.monotonic():
+            del self._entries[mac]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(mac)
+        self.hits += 1
+        return ref
+
+    def put(self, mac: str, ref: PlantRef) -> None:
+        self._entries[mac] = (time.monotonic() + self.ttl, ref)
+        self._entries.move_to_end(mac)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, mac: str) -> None:
+        if self._entries.pop(mac, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+plant_cache = PlantCache()
+
+
+# ── Resolution ────────────────────────────────────────────────────────────────
+
+_REF_COLUMNS = (
+    Plant.mac_address,
+    Plant.id,
+    Plant.owner_id,
+    Plant.moisture_threshold_min,
+    Plant.moisture_threshold_max,
+    Plant.pump_duration,
+    Plant.species,
+)
+
+
+def _to_ref(row) -> PlantRef:
+    _, plant_id, owner_id, t_min, t_max, pump_duration, species = row
+    return PlantRef(
+        plant_id=plant_id,
+        owner_id=owner_id,
+        moisture_threshold_min=t_min,
+        moisture_threshold_max=t_max,
+        pump_duration=pump_duration,
+        species=species,
+    )
+
+
+async def resolve_plant(
+    session: AsyncSession, mac: str, fresh: bool = False
+) -> Optional[PlantRef]:
+    """
+    Return the ``PlantRef`` for ``mac`` or None if no plant is registered.
+    ``fresh`` bypasses (and refreshes) the cache.
+    """
+    if not fresh:
+        ref = plant_cache.get(mac)
+        if ref is not None:
+            return ref
+
+    result = await session.execute(
+        select(*_REF_COLUMNS).where(Plant.mac_address == mac)
+    )
+    row = result.first()
+    if row is None:
+        plant_cache.invalidate(mac)
+        return None
+
+    ref = _to_ref(row)
+    plant_cache.put(mac, ref)
+    return ref
+
+
+async def resolve_plants(
+    session: AsyncSession, macs: Iterable[str]
+) -> Dict[str, PlantRef]:
+    """Resolve many MACs at once; cache misses are fetched with one query."""
+    refs: Dict[str, PlantRef] = {}
+    missing = []
+    for mac in set(macs):
+        ref = plant_cache.get(mac)
+        if ref is None:
+            missing.append(mac)
+        else:
+            refs[mac] = ref
+
+    if missing:
+        result = await session.execute(
+            select(*_REF_COLUMNS).where(
+                Plant.mac_address.in_(missing)  # type: ignore[attr-defined]
+            )
+        )
+        for row in result.all():
+            ref = _to_ref(row)
+            plant_cache.put(row[0], ref)
+            refs[row[0]] = ref
+
+    return refs
@@ -0,0 +1,302 @@
+"""
+rate_limit.py
+─────────────
+Token-bucket rate limiting for the device endpoints and authenticated users.
+
+The device endpoints are unauthenticated, so a misbehaving (or reflashed)
+ESP32 looping on POST could otherwise take the whole DB pool.  Each caller
+gets a bucket per route class holding up to ``burst`` tokens and refilled at
+``rate`` per second; a request takes one token, and a request finding the
+bucket empty is rejected with ``RateLimited`` (429 + ``Retry-After``) before
+any handler or database work runs.
+
+Route classes and what they are keyed by:
+
+  • readings — per MAC: ``/plants/{mac}/readings/`` and ``…/readings/batch``
+  • image    — per MAC: ``/plants/{mac}/image/``
+  • commands — per MAC: command poll, stream and acknowledge
+  • gateway  — per client address: fleet-wide ``/readings/batch``
+  • user     — per user id: every endpoint behind ``get_current_user``
+
+Each limit comes from ``RATE_LIMIT_<CLASS>`` as ``"<count>/<s|m|h>[:burst]"``
+(e.g. ``"30/m:10"``; burst defaults to the count).  ``"off"`` disables it.
+
+Buckets live in process by default, so every backend worker enforces its own
+limit.  With ``RATE_LIMIT_REDIS_URL`` set they are kept in Redis instead and
+updated by one Lua script per request (atomic, on Redis' clock), so the limit
+is shared across workers.  Redis is optional (``pip install redis``); while
+it is missing or unreachable the in-process buckets take over, with a circuit
+breaker so a dead server costs one timeout per ``reset_timeout`` rather than
+one per request.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+
+from circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger("plantvita.backend.rate_limit")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+READINGS = "readings"
+IMAGE = "image"
+COMMANDS = "commands"
+GATEWAY = "gateway"
+USER = "user"
+
+# Firmware defaults: a reading and a command poll every 5 s, a capture every
+# few minutes — so these leave a wide margin for a well-behaved device.
+_DEFAULT_LIMITS: Dict[str, str] = {
+    READINGS: "30/m:30",
+    IMAGE: "60/h:10",
+    COMMANDS: "60/m:20",
+    GATEWAY: "120/m:30",
+    USER: "10/s:50",
+}
+
+RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "")
+_REDIS_PREFIX: str = os.getenv("RATE_LIMIT_REDIS_PREFIX", "plantvita:rl")
+_REDIS_TIMEOUT: float = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.25"))
+_LOCAL_KEYS: int = int(os.getenv("RATE_LIMIT_LOCAL_KEYS", "100000"))
+
+_UNITS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+@dataclass(frozen=True, slots=True)
+class Limit:
+    rate: float  # tokens per second
+    burst: int
+
+
+def parse_limit(spec: str) -> Optional[Limit]:
+    """``"30/m:10"`` → ``Limit(0.5, 10)``; None for ``"off"`` / ``"0"``."""
+    spec = spec.strip().lower()
+    if spec in ("", "0", "off", "none"):
+        return None
+    rate_part, _, burst_part = spec.partition(":")
+    count, _, unit = rate_part.partition("/")
+    try:
+        per_second = float(count) / _UNITS[unit or "s"]
+        burst = int(burst_part) if burst_part else max(1, math.ceil(float(count)))
+    except (KeyError, ValueError):
+        raise ValueError(
+            f"Bad rate limit {spec!r}, expected '<count>/<s|m|h>[:burst]'"
+        ) from None
+    if per_second <= 0 or burst < 1:
+        return None
+    return Limit(per_second, burst)
+
+
+LIMITS: Dict[str, Optional[Limit]] = {
+    name: parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+    for name, default in _DEFAULT_LIMITS.items()
+}
+
+
+class RateLimited(Exception):
+    """The caller's bucket for this route class is empty."""
+
+    def __init__(self, route_class: str, retry_after: float) -> None:
+        super().__init__(f"Rate limit exceeded for {route_class}")
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+
+# ── In-process buckets ────────────────────────────────────────────────────────
+
+
+class LocalBuckets:
+    """
+    Bounded LRU of buckets, ``(route_class, key) → (tokens, stamp)``.  An
+    evicted bucket comes back full, which only ever errs towards allowing.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._buckets: OrderedDict[tuple[str, str], tuple[float, float]] = (
+            OrderedDict()
+        )
+        self.evictions = 0
+
+    def take(self, route_class: str, key: str, limit: Limit) -> float:
+        """Take a token: 0 if granted, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = (route_class, key)
+        state = self._buckets.get(bucket)
+        if state is None:
+            tokens = float(limit.burst)
+        else:
+            tokens, stamp = state
+            tokens = min(limit.burst, tokens + (now - stamp) * limit.rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / limit.rate
+
+        self._buckets[bucket] = (tokens, now)
+        self._buckets.move_to_end(bucket)
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+local_buckets = LocalBuckets(_LOCAL_KEYS)
+
+
+# ── Redis buckets ─────────────────────────────────────────────────────────────
+
+# KEYS[1] = bucket key; ARGV = rate (tokens/s), burst.  Returns the wait in
+# seconds as a string (0 = granted) — Lua numbers come back truncated to ints.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = burst
+else
+  tokens = math.min(burst, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+redis_breaker = CircuitBreaker(
+    "rate_limit_redis", failure_threshold=3, reset_timeout=10
+)
+
+_redis: Any = None
+_script: Any = None
+_redis_missing = False
+
+
+def _redis_script() -> Any:
+    """The registered Lua script, connecting on first use; None without Redis."""
+    global _redis, _script, _redis_missing
+    if _script is None and RATE_LIMIT_REDIS_URL and not _redis_missing:
+        try:
+            import redis.asyncio as aioredis  # type: ignore[import]
+        except ImportError:
+            _redis_missing = True
+            logger.warning(
+                "RATE_LIMIT_REDIS_URL is set but the redis package is not "
+                "installed — using in-process buckets"
+            )
+            return None
+        _redis = aioredis.from_url(
+            RATE_LIMIT_REDIS_URL,
+            socket_timeout=_REDIS_TIMEOUT,
+            socket_connect_timeout=_REDIS_TIMEOUT,
+        )
+        _script = _redis.register_script(_TOKEN_BUCKET_LUA)
+    return _script
+
+
+async def close_limiter() -> None:
+    global _redis, _script
+    if _redis is not None:
+        await _redis.aclose()
+    _redis = _script = None
+
+
+# ── Checking ──────────────────────────────────────────────────────────────────
+
+counters: Dict[str, Dict[str, int]] = {
+    route_class: {"allowed": 0, "throttled": 0} for route_class in LIMITS
+}
+_backend_counters: Dict[str, int] = {"redis": 0, "local": 0, "redis_errors": 0}
+
+
+async def _take(route_class: str, key: str, limit: Limit) -> float:
+    script = _redis_script()
+    if script is not None and redis_breaker.allow():
+        try:
+            wait = float(
+                await script(
+                    keys=[f"{_REDIS_PREFIX}:{route_class}:{key}"],
+                    args=[limit.rate, limit.burst],
+                )
+            )
+        except Exception as exc:  # noqa: BLE001 — any Redis trouble → local
+            redis_breaker.record_failure()
+            _backend_counters["redis_errors"] += 1
+            logger.debug("Redis rate limiting failed: %s", exc)
+        else:
+            redis_breaker.record_success()
+            _backend_counters["redis"] += 1
+            return wait
+    _backend_counters["local"] += 1
+    return local_buckets.take(route_class, key, limit)
+
+
+async def check(route_class: str, key: str) -> None:
+    """Take a token from ``key``'s bucket, raising ``RateLimited`` if empty."""
+    limit = LIMITS[route_class]
+    if limit is None:
+        return
+    wait = await _take(route_class, key, limit)
+    if wait > 0:
+        counters[route_class]["throttled"] += 1
+        raise RateLimited(route_class, wait)
+    counters[route_class]["allowed"] += 1
+
+
+def per_device(route_class: str):
+    """Route dependency limiting by the ``mac_address`` path parameter."""
+
+    async def dependency(mac_address: str) -> None:
+        await check(route_class, mac_address.upper())
+
+    return dependency
+
+
+def per_client(route_class: str):
+    """Route dependency limiting by client address."""
+
+    async def dependency(request: Request) -> None:
+        await check(route_class, request.client.host if request.client else "-")
+
+    return dependency
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "backend": "redis" if _script is not None else "local",
+        "classes": {
+            route_class: {
+                "per_second": round(limit.rate, 4) if limit else None,
+                "burst": limit.burst if limit else None,
+                **counters[route_class],
+            }
+            for route_class, limit in LIMITS.items()
+        },
+        **_backend_counters,
+        "redis_circuit": redis_breaker.state if RATE_LIMIT_REDIS_URL else None,
+        "local_buckets": len(local_buckets),
+        "local_evictions": local_buckets.evictions,
+    }
@@ -0,0 +1,205 @@
+"""
+replica.py
+──────────
+Routing of read-only requests to the streaming replica (``DB_REPLICA_URL``).
+
+Dashboard, history, image and export reads are served by the replica so they
+stop competing with sensor ingest on the primary.  A read goes to the primary
+instead when:
+
+  • no replica is configured, or its last lag probe failed / is older than
+    three ``DB_REPLICA_CHECK_INTERVAL``s;
+  • the replica is more than ``DB_REPLICA_MAX_LAG`` seconds behind; or
+  • the user or plant it is about wrote something in the last
+    ``DB_REPLICA_STICKY_SECONDS`` (``note_write``) — read-your-writes, so a
+    PATCH is never followed by a dashboard that doesn't show it.
+
+``monitor_loop`` probes the replica's replay lag in the background; nothing
+on the request path touches the network to decide.  Lag is 0 while the
+replica is streaming and has replayed everything it received, otherwise the
+age of the last replayed transaction.
+
+Stickiness is per process: with several backend workers a user's next read
+may land on a worker that didn't see the write, and is then only as fresh as
+the lag bound allows.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import db
+from db import replica_engine, replica_session_maker, session_maker
+
+logger = logging.getLogger("plantvita.backend.replica")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+DB_REPLICA_MAX_LAG: float = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_STICKY_SECONDS: float = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "10"))
+DB_REPLICA_CHECK_INTERVAL: float = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+_STICKY_KEYS_MAX = 10_000
+
+_LAG_SQL = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+             AND COALESCE(pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn(), true)
+            THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """
+)
+
+_state: Dict[str, Any] = {"lag_seconds": None, "checked_at": None, "error": None}
+
+counters: Dict[str, int] = {
+    "replica": 0,
+    "primary_sticky": 0,
+    "primary_lagging": 0,
+    "primary_unavailable": 0,
+    "probe_errors": 0,
+}
+
+# key → monotonic time its stickiness ends, oldest first.
+_recent_writes: OrderedDict[str, float] = OrderedDict()
+
+
+def enabled() -> bool:
+    return replica_engine is not None
+
+
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def plant_key(plant_id: int) -> str:
+    return f"plant:{plant_id}"
+
+
+# ── Read-your-writes ──────────────────────────────────────────────────────────
+
+
+def note_write(*keys: str) -> None:
+    """Pin reads about ``keys`` to the primary for the sticky window."""
+    if not enabled():
+        return
+    now = time.monotonic()
+    for key in keys:
+        _recent_writes[key] = now + DB_REPLICA_STICKY_SECONDS
+        _recent_writes.move_to_end(key)
+    while _recent_writes and (
+        next(iter(_recent_writes.values())) <= now
+        or len(_recent_writes) > _STICKY_KEYS_MAX
+    ):
+        _recent_writes.popitem(last=False)
+
+
+def _sticky(keys: tuple[str, ...]) -> bool:
+    now = time.monotonic()
+    return any(_recent_writes.get(key, 0.0) > now for key in keys)
+
+
+# ── Routing ───────────────────────────────────────────────────────────────────
+
+
+def _replica_usable() -> Optional[str]:
+    """None if reads may go to the replica, else the counter to charge."""
+    checked_at = _state["checked_at"]
+    if (
+        replica_session_maker is None
+        or checked_at is None
+        or _state["error"] is not None
+        or time.monotonic() - checked_at > 3 * DB_REPLICA_CHECK_INTERVAL
+    ):
+        return "primary_unavailable"
+    if _state["lag_seconds"] > DB_REPLICA_MAX_LAG:
+        return "primary_lagging"
+    return None
+
+
+def read_session_maker(*keys: str) -> async_sessionmaker[AsyncSession]:
+    """Session factory for a read-only request about ``keys``."""
+    reason = _replica_usable()
+    if reason is None and _sticky(keys):
+        reason = "primary_sticky"
+    if reason is not None:
+        counters[reason] += 1
+        return session_maker
+    counters["replica"] += 1
+    return replica_session_maker  # type: ignore[return-value]
+
+
+def read_session(*keys: str) -> AsyncSession:
+    return read_session_maker(*keys)()
+
+
+# ── Lag monitor ───────────────────────────────────────────────────────────────
+
+
+async def _measure_lag() -> float:
+    assert replica_engine is not None
+    async with replica_engine.connect() as conn:
+        return float(await conn.scalar(_LAG_SQL) or 0)
+
+
+async def probe() -> None:
+    try:
+        lag = await asyncio.wait_for(
+            _measure_lag(), timeout=DB_REPLICA_CHECK_INTERVAL
+        )
+    except Exception as exc:  # noqa: BLE001 — any failure → read from primary
+        counters["probe_errors"] += 1
+        if _state["error"] is None:
+            logger.warning("Replica unavailable, reading from primary: %s", exc)
+        _state["error"] = str(exc) or type(exc).__name__
+    else:
+        previous = _state["lag_seconds"]
+        if _state["error"] is not None or previous is None:
+            logger.info("Replica available (lag %.1fs)", lag)
+        elif (lag > DB_REPLICA_MAX_LAG) != (previous > DB_REPLICA_MAX_LAG):
+            logger.warning(
+                "Replica lag %.1fs (limit %.1fs) — reads %s",
+                lag,
+                DB_REPLICA_MAX_LAG,
+                "on primary" if lag > DB_REPLICA_MAX_LAG else "back on replica",
+            )
+        _state["lag_seconds"] = lag
+        _state["error"] = None
+    _state["checked_at"] = time.monotonic()
+
+
+async def monitor_loop() -> None:
+    """Background task: keep the replica's lag reading fresh."""
+    while True:
+        await probe()
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+
+def stats() -> Dict[str, Any]:
+    if replica_engine is None:
+        return {"enabled": False}
+    checked_at = _state["checked_at"]
+    return {
+        "enabled": True,
+        "lag_seconds": _state["lag_seconds"],
+        "max_lag_seconds": DB_REPLICA_MAX_LAG,
+        "last_probe_age": (
+            round(time.monotonic() - checked_at, 1) if checked_at else None
+        ),
+        "error": _state["error"],
+        "routes": dict(counters),
+        "sticky_keys": len(_recent_writes),
+        "pool": db.pool_stats(replica_engine),
+    }
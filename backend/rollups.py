@@ -0,0 +1,302 @@
+"""
+rollups.py
+──────────
+Continuous hourly / daily rollups of ``sensorreading``.
+
+A background loop started from the backend's lifespan calls ``run_rollup``
+every ``SENSOR_ROLLUP_INTERVAL`` seconds.  Each run:
+
+  1. reads the ``rollup_watermark`` (highest sensorreading.id already folded in)
+     and picks the next id range ``(last_id, hi]`` — up to the *settled*
+     candidate recorded by an earlier run (below);
+  2. finds the (plant, hour) buckets those rows touch and *recomputes* them
+     from raw rows — replacing, never adding, so re-running a range is
+     idempotent;
+  3. recomputes the touched daily buckets from the hourly table;
+  4. advances the watermark and records the next candidate — all in one
+     transaction.
+
+Ids are handed out when a reading is inserted but become visible when its
+transaction commits, so a slow transaction can commit id 100 after id 5000 is
+already rolled up.  The watermark therefore only advances to a candidate
+``pending_id`` (the newest id seen at ``pending_at``) once every transaction
+that was open at ``pending_at`` has finished — after that, no id at or below
+the candidate can still appear.  Rows reach the rollups one run later; the
+aggregate query reads rows above the watermark raw in the meantime.
+
+Raw retention (``SENSOR_RAW_RETENTION_DAYS``, off by default) deletes raw rows
+older than N days, in whole hours, once they are below the watermark.  Hours
+at or past the retention horizon (plus one hour of margin, so a retention run
+can't catch up with a recompute) are never recomputed: late readings for them
+are merged into their hourly bucket instead, since the raw rows the bucket
+was built from may be gone.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import UTC, datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from models import SENSOR_METRICS
+
+logger = logging.getLogger("plantvita.backend.rollups")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+ROLLUP_INTERVAL: float = float(os.getenv("SENSOR_ROLLUP_INTERVAL", "300"))  # 0 = off
+_BATCH_IDS: int = int(os.getenv("SENSOR_ROLLUP_BATCH", "200000"))
+RAW_RETENTION_DAYS: int = int(os.getenv("SENSOR_RAW_RETENTION_DAYS", "0"))  # 0 = keep
+_RETENTION_DELETE_BATCH = 10_000
+
+WATERMARK_NAME = "sensorreading"
+
+# Same alignment as sensor_aggregates: buckets start on UTC boundaries.
+_ORIGIN = datetime(2000, 1, 1, tzinfo=UTC)
+
+_ROLLUP_LOCK_ID = 74_212_002
+
+_HOUR = timedelta(hours=1)
+
+# ── SQL ───────────────────────────────────────────────────────────────────────
+
+_STAT_COLS = ", ".join(
+    f"{m}_n, {m}_sum, {m}_min, {m}_max" for m in SENSOR_METRICS
+)
+_RAW_AGGS = ", ".join(
+    f"count({m}), sum({m}), min({m}), max({m})" for m in SENSOR_METRICS
+)
+_ROLLUP_AGGS = ", ".join(
+    f"sum({m}_n), sum({m}_sum), min({m}_min), max({m}_max)" for m in SENSOR_METRICS
+)
+_REPLACE = ", ".join(
+    ["count = EXCLUDED.count"]
+    + [
+        f"{c} = EXCLUDED.{c}"
+        for m in SENSOR_METRICS
+        for c in (f"{m}_n", f"{m}_sum", f"{m}_min", f"{m}_max")
+    ]
+)
+_MERGE = ", ".join(
+    ["count = t.count + EXCLUDED.count"]
+    + [
+        part
+        for m in SENSOR_METRICS
+        for part in (
+            f"{m}_n = t.{m}_n + EXCLUDED.{m}_n",
+            f"{m}_sum = COALESCE(t.{m}_sum, 0) + COALESCE(EXCLUDED.{m}_sum, 0)",
+            f"{m}_min = LEAST(t.{m}_min, EXCLUDED.{m}_min)",
+            f"{m}_max = GREATEST(t.{m}_max, EXCLUDED.{m}_max)",
+        )
+    ]
+)
+
+# Recompute every touched hour (wholly inside the retention window) from raw rows.
+_RECOMPUTE_HOURLY = text(
+    f"""
+    INSERT INTO sensorreading_hourly AS t (plant_id, bucket_start, count, {_STAT_COLS})
+    SELECT s.plant_id, th.bucket_start, count(*), {_RAW_AGGS}
+    FROM (
+        SELECT DISTINCT plant_id,
+               date_bin('1 hour', timestamp, :origin) AS bucket_start
+        FROM sensorreading
+        WHERE id > :lo AND id <= :hi AND timestamp >= :replace_from
+    ) th
+    JOIN sensorreading s
+      ON s.plant_id = th.plant_id
+     AND s.timestamp >= th.bucket_start
+     AND s.timestamp < th.bucket_start + interval '1 hour'
+     AND s.id <= :hi
+    GROUP BY s.plant_id, th.bucket_start
+    ON CONFLICT (plant_id, bucket_start) DO UPDATE SET {_REPLACE}
+    """
+)
+
+# Late rows for hours whose raw data may already be dropped: merge, don't replace.
+_MERGE_HOURLY = text(
+    f"""
+    INSERT INTO sensorreading_hourly AS t (plant_id, bucket_start, count, {_STAT_COLS})
+    SELECT plant_id, date_bin('1 hour', timestamp, :origin), count(*), {_RAW_AGGS}
+    FROM sensorreading
+    WHERE id > :lo AND id <= :hi AND timestamp < :replace_from
+    GROUP BY 1, 2
+    ON CONFLICT (plant_id, bucket_start) DO UPDATE SET {_MERGE}
+    """
+)
+
+_RECOMPUTE_DAILY = text(
+    f"""
+    INSERT INTO sensorreading_daily AS t (plant_id, bucket_start, count, {_STAT_COLS})
+    SELECT h.plant_id, td.bucket_start, sum(h.count), {_ROLLUP_AGGS}
+    FROM (
+        SELECT DISTINCT plant_id,
+               date_bin('1 day', timestamp, :origin) AS bucket_start
+        FROM sensorreading
+        WHERE id > :lo AND id <= :hi
+    ) td
+    JOIN sensorreading_hourly h
+      ON h.plant_id = td.plant_id
+     AND h.bucket_start >= td.bucket_start
+     AND h.bucket_start < td.bucket_start + interval '1 day'
+    GROUP BY h.plant_id, td.bucket_start
+    ON CONFLICT (plant_id, bucket_start) DO UPDATE SET {_REPLACE}
+    """
+)
+
+
+# Any transaction open since :pending_at that has written (or is writing —
+# an INSERT draws its id before it is assigned an xid) may still commit an id
+# at or below the pending candidate.
+_CANDIDATE_SETTLED = text(
+    """
+    SELECT NOT EXISTS (
+        SELECT 1 FROM pg_stat_activity
+        WHERE datname = current_database()
+          AND pid <> pg_backend_pid()
+          AND xact_start <= :pending_at
+          AND (backend_xid IS NOT NULL OR state = 'active')
+    )
+    """
+)
+
+
+def _retention_cutoff() -> datetime:
+    """Raw rows before this are deleted; always on an hour boundary."""
+    if RAW_RETENTION_DAYS <= 0:
+        return _ORIGIN  # nothing is ever past the horizon
+    cutoff = datetime.now(UTC) - timedelta(days=RAW_RETENTION_DAYS)
+    return _ORIGIN + ((cutoff - _ORIGIN) // _HOUR) * _HOUR
+
+
+# ── Rollup ────────────────────────────────────────────────────────────────────
+
+
+async def get_watermark(conn: AsyncConnection) -> int:
+    result = await conn.execute(
+        text("SELECT last_id FROM rollup_watermark WHERE name = :name"),
+        {"name": WATERMARK_NAME},
+    )
+    return result.scalar() or 0
+
+
+async def _record_candidate(conn: AsyncConnection, lo: int) -> None:
+    """Remember the newest visible id (if past ``lo``) for a later run."""
+    await conn.execute(
+        text(
+            "UPDATE rollup_watermark"
+            " SET pending_id = m.id, pending_at = clock_timestamp()"
+            " FROM (SELECT max(id) AS id FROM sensorreading WHERE id > :lo) m"
+            " WHERE name = :name AND m.id IS NOT NULL"
+        ),
+        {"lo": lo, "name": WATERMARK_NAME},
+    )
+
+
+async def run_rollup(conn: AsyncConnection) -> Optional[Tuple[int, int]]:
+    """
+    Fold the next settled id range into the rollups inside ``conn``'s
+    transaction.  Returns the processed ``(lo, hi]`` range, or None if there
+    was nothing settled to do or another worker holds the rollup lock.
+    """
+    locked = await conn.execute(
+        text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": _ROLLUP_LOCK_ID}
+    )
+    if not locked.scalar():
+        return None
+
+    await conn.execute(
+        text(
+            "INSERT INTO rollup_watermark (name, last_id) VALUES (:name, 0) "
+            "ON CONFLICT (name) DO NOTHING"
+        ),
+        {"name": WATERMARK_NAME},
+    )
+    result = await conn.execute(
+        text(
+            "SELECT last_id, pending_id, pending_at FROM rollup_watermark "
+            "WHERE name = :name FOR UPDATE"
+        ),
+        {"name": WATERMARK_NAME},
+    )
+    lo, pending_id, pending_at = result.one()
+
+    settled = pending_id > lo and (
+        await conn.execute(_CANDIDATE_SETTLED, {"pending_at": pending_at})
+    ).scalar()
+    if not settled:
+        if pending_id <= lo:
+            await _record_candidate(conn, lo)
+        return None
+    hi = min(pending_id, lo + _BATCH_IDS)
+
+    params = {
+        "lo": lo,
+        "hi": hi,
+        "origin": _ORIGIN,
+        "replace_from": _retention_cutoff() + _HOUR,
+    }
+    await conn.execute(_RECOMPUTE_HOURLY, params)
+    await conn.execute(_MERGE_HOURLY, params)
+    await conn.execute(_RECOMPUTE_DAILY, params)
+
+    await conn.execute(
+        text(
+            "UPDATE rollup_watermark SET last_id = :hi, updated_at = now() "
+            "WHERE name = :name"
+        ),
+        {"hi": hi, "name": WATERMARK_NAME},
+    )
+    if hi == pending_id:
+        await _record_candidate(conn, hi)
+    return lo, hi
+
+
+async def apply_retention(conn: AsyncConnection) -> int:
+    """Delete rolled-up raw rows older than the retention horizon (batched)."""
+    if RAW_RETENTION_DAYS <= 0:
+        return 0
+
+    watermark = await get_watermark(conn)
+    result = await conn.execute(
+        text(
+            "DELETE FROM sensorreading WHERE id IN ("
+            " SELECT id FROM sensorreading"
+            " WHERE timestamp < :cutoff AND id <= :watermark LIMIT :batch)"
+        ),
+        {
+            "cutoff": _retention_cutoff(),
+            "watermark": watermark,
+            "batch": _RETENTION_DELETE_BATCH,
+        },
+    )
+    return result.rowcount or 0
+
+
+async def rollup_loop(engine: AsyncEngine) -> None:
+    """Background task: keep rollups current and enforce raw retention."""
+    while True:
+        try:
+            while True:
+                async with engine.begin() as conn:
+                    processed = await run_rollup(conn)
+                if processed is None or processed[1] - processed[0] < _BATCH_IDS:
+                    break  # caught up
+
+            deleted = 0
+            while True:
+                async with engine.begin() as conn:
+                    batch = await apply_retention(conn)
+                deleted += batch
+                if batch < _RETENTION_DELETE_BATCH:
+                    break
+            if deleted:
+                logger.info("Retention removed %d raw sensor readings", deleted)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Sensor rollup failed: %s", exc)
+
+        await asyncio.sleep(ROLLUP_INTERVAL)
@@ -9,11 +9,18 @@ Changes vs original:
     immediately (before the background task finishes)
 """
 
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime, date
+import os
+
+from pydantic import BaseModel, EmailStr, field_validator
+from typing import Dict, Literal, Optional, List
+from datetime import UTC, datetime, date, timedelta
 from typing import Optional, List
 
+# How far ahead of the server clock a device-supplied timestamp may be.
+READING_MAX_CLOCK_SKEW = timedelta(
+    seconds=float(os.getenv("READING_MAX_CLOCK_SKEW", "300"))
+)
+
 
 # ── Sensor readings ────────────────────────────────────────────────────────────
 
@@ -33,6 +40,54 @@ class SensorReadingRead(SensorReadingCreate):
     plant_id: int
     timestamp: datetime
 
+
+class SensorReadingBatchItem(SensorReadingCreate):
+    # Capture time for readings buffered on the device while offline.
+    # Omitted → the server stamps the row at insert time.  Naive values are
+    # taken as UTC; ones from the future (a device with a bad RTC) are refused.
+    timestamp: Optional[datetime] = None
+
+    @field_validator("timestamp")
+    @classmethod
+    def _utc_not_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        if value > datetime.now(UTC) + READING_MAX_CLOCK_SKEW:
+            raise ValueError("timestamp is in the future — check the device clock")
+        return value.astimezone(UTC)
+
+
+class FleetSensorReadingCreate(SensorReadingBatchItem):
+    mac_address: str
+
+
+class SensorReadingBatchResponse(BaseModel):
+    inserted: int
+    unknown_macs: List[str] = []
+
+
+class MetricStats(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+    avg: Optional[float] = None
+
+
+class SensorBucket(BaseModel):
+    bucket_start: datetime
+    count: int  # raw readings folded into this bucket
+    metrics: Dict[str, MetricStats]
+
+
+class SensorAggregateRead(BaseModel):
+    plant_id: int
+    start: datetime
+    end: datetime
+    bucket_seconds: int
+    mode: str  # "stats" — every bucket; "lttb" — shape-preserving subset
+    buckets: List[SensorBucket]
+
 # ── Plant ──────────────────────────────────────────────────────────────────────
 
 class PlantCreate(BaseModel):
@@ -79,6 +134,8 @@ class PlantSummary(BaseModel):
     mac_address: str
     species: Optional[str] = None
     latest_image_url: Optional[str] = None
+    latest_thumbnail_url: Optional[str] = None
+    latest_preview_url: Optional[str] = None
     latest_moisture_pct: Optional[float] = None
     latest_health_status: Optional[str] = None
     is_critical: bool = False
@@ -139,6 +196,12 @@ class ImageRead(BaseModel):
     timestamp: datetime
     image_url: str
 
+    # Downscaled variants — a not-yet-rendered one points at
+    # GET /images/{id}/{variant}, which renders it and redirects
+    thumbnail_url: Optional[str] = None
+    preview_url:   Optional[str] = None
+    llm_image_url: Optional[str] = None
+
     # Gemini diagnosis
     ai_diagnosis: Optional[str] = None
 
@@ -178,14 +241,18 @@ class CommandRead(BaseModel):
     id: int
     plant_id: int
     command_type: str
-    status: str
+    status: str  # pending / claimed / executed / failed / expired
     duration: int
     created_at: datetime
     executed_at: Optional[datetime] = None
+    claimed_at: Optional[datetime] = None
+    lease_expires_at: Optional[datetime] = None
+    attempts: int = 0
+    expires_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
 class CommandAcknowledge(BaseModel):
     command_id: int
-    status: str = "executed"  # executed / failed
\ No newline at end of file
+    status: Literal["executed", "failed"] = "executed"
\ No newline at end of file
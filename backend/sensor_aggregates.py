@@ -0,0 +1,313 @@
+"""
+sensor_aggregates.py
+────────────────────
+Time-bucketed sensor history computed inside the database.
+
+``aggregate_readings`` groups a plant's readings into fixed-width buckets with
+Postgres' ``date_bin`` and returns min / max / avg per metric per bucket, so the
+payload size depends on the requested resolution rather than on how many raw
+rows fall in the range.
+
+Buckets that are whole hours or days are served from the ``sensorreading_hourly``
+/ ``sensorreading_daily`` rollups (those whose grain divides the bucket), plus
+raw rows above the rollup watermark that haven't been folded in yet.  Rollups
+only cover the whole grains inside ``[start, end)``; the partial grains at
+either edge come from the next finer rollup, and finally from raw rows, so
+the result matches an all-raw query exactly.  (Edges older than the raw
+retention horizon have no raw rows left to read.)
+
+``lttb`` implements Largest-Triangle-Three-Buckets downsampling.  It is applied
+to a fine-grained bucket series (never to raw rows), which keeps memory bounded
+while still preserving the visual shape of a chart for a fixed point budget.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import Interval, bindparam, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from models import (
+    SENSOR_METRICS,
+    RollupWatermark,
+    SensorReading,
+    sensorreading_daily,
+    sensorreading_hourly,
+)
+from rollups import WATERMARK_NAME
+
+METRICS = SENSOR_METRICS
+
+# Buckets are aligned to UTC midnight boundaries.
+_ORIGIN = datetime(2000, 1, 1, tzinfo=UTC)
+
+MAX_BUCKETS = 5000
+
+_HOUR = timedelta(hours=1)
+_DAY = timedelta(days=1)
+
+_BUCKET_RE = re.compile(r"^(\d+)([mhd])$")
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_bucket(spec: str) -> timedelta:
+    """``"5m"`` / ``"1h"`` / ``"1d"`` → timedelta.  Raises ValueError if invalid."""
+    match = _BUCKET_RE.match(spec)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket {spec!r}; expected e.g. 5m, 1h, 1d")
+    return timedelta(**{_UNITS[match.group(2)]: int(match.group(1))})
+
+
+# ── Partial aggregates ────────────────────────────────────────────────────────
+
+
+@dataclass
+class MetricAcc:
+    """Mergeable partial aggregate for one metric in one bucket."""
+
+    n: int = 0
+    total: float = 0.0
+    lo: Optional[float] = None
+    hi: Optional[float] = None
+
+    def merge(self, n: int, total, lo, hi) -> None:
+        if not n:
+            return
+        self.n += n
+        self.total += total
+        self.lo = lo if self.lo is None else min(self.lo, lo)
+        self.hi = hi if self.hi is None else max(self.hi, hi)
+
+    @property
+    def avg(self) -> Optional[float]:
+        return self.total / self.n if self.n else None
+
+
+@dataclass
+class BucketAcc:
+    start: datetime
+    count: int = 0
+    metrics: Dict[str, MetricAcc] = field(
+        default_factory=lambda: {m: MetricAcc() for m in METRICS}
+    )
+
+
+def _raw_stats_columns() -> list:
+    """count / sum / min / max per metric, labelled ``<metric>_{n,sum,min,max}``."""
+    cols = []
+    for m in METRICS:
+        col = getattr(SensorReading, m)
+        cols += [
+            func.count(col).label(f"{m}_n"),
+            func.sum(col).label(f"{m}_sum"),
+            func.min(col).label(f"{m}_min"),
+            func.max(col).label(f"{m}_max"),
+        ]
+    return cols
+
+
+def _rollup_stats_columns(table) -> list:
+    """Same labels as ``_raw_stats_columns``, merged from rollup partials."""
+    cols = []
+    for m in METRICS:
+        cols += [
+            func.sum(table.c[f"{m}_n"]).label(f"{m}_n"),
+            func.sum(table.c[f"{m}_sum"]).label(f"{m}_sum"),
+            func.min(table.c[f"{m}_min"]).label(f"{m}_min"),
+            func.max(table.c[f"{m}_max"]).label(f"{m}_max"),
+        ]
+    return cols
+
+
+def _fold_rows(rows, buckets: Dict[datetime, BucketAcc]) -> None:
+    for row in rows:
+        acc = buckets.setdefault(row.bucket, BucketAcc(start=row.bucket))
+        acc.count += row.n
+        for m in METRICS:
+            acc.metrics[m].merge(
+                getattr(row, f"{m}_n"),
+                getattr(row, f"{m}_sum"),
+                getattr(row, f"{m}_min"),
+                getattr(row, f"{m}_max"),
+            )
+
+
+def _rollups_for(stride: timedelta) -> list:
+    """Rollups whose grain evenly divides ``stride``, coarsest first."""
+    return [
+        (table, grain)
+        for table, grain in ((sensorreading_daily, _DAY), (sensorreading_hourly, _HOUR))
+        if stride % grain == timedelta(0)
+    ]
+
+
+def _align_down(t: datetime, grain: timedelta) -> datetime:
+    return _ORIGIN + ((t - _ORIGIN) // grain) * grain
+
+
+def _align_up(t: datetime, grain: timedelta) -> datetime:
+    return _ORIGIN - ((_ORIGIN - t) // grain) * grain
+
+
+def _stride_param(stride: timedelta):
+    return bindparam("stride", stride, type_=Interval())
+
+
+async def _fold_raw(
+    session: AsyncSession,
+    buckets: Dict[datetime, BucketAcc],
+    plant_id: int,
+    start: datetime,
+    end: datetime,
+    stride: timedelta,
+    above_id: int = 0,
+) -> None:
+    bucket = func.date_bin(
+        _stride_param(stride), SensorReading.timestamp, _ORIGIN
+    ).label("bucket")
+    query = select(bucket, func.count().label("n"), *_raw_stats_columns()).where(
+        SensorReading.plant_id == plant_id,
+        SensorReading.timestamp >= start,  # type: ignore[operator]
+        SensorReading.timestamp < end,  # type: ignore[operator]
+    )
+    if above_id:
+        query = query.where(SensorReading.id > above_id)  # type: ignore[operator]
+    result = await session.execute(query.group_by(bucket))
+    _fold_rows(result.all(), buckets)
+
+
+async def _fold_range(
+    session: AsyncSession,
+    buckets: Dict[datetime, BucketAcc],
+    plant_id: int,
+    start: datetime,
+    end: datetime,
+    stride: timedelta,
+    rollups: list,
+    watermark: int,
+) -> None:
+    """Fold ``[start, end)`` from the first rollup's whole grains, edges finer."""
+    if start >= end:
+        return
+    if not rollups:
+        await _fold_raw(session, buckets, plant_id, start, end, stride)
+        return
+
+    (table, grain), finer = rollups[0], rollups[1:]
+    inner_start, inner_end = _align_up(start, grain), _align_down(end, grain)
+    if inner_start >= inner_end:
+        await _fold_range(
+            session, buckets, plant_id, start, end, stride, finer, watermark
+        )
+        return
+
+    bucket = func.date_bin(
+        _stride_param(stride), table.c.bucket_start, _ORIGIN
+    ).label("bucket")
+    result = await session.execute(
+        select(
+            bucket,
+            func.sum(table.c["count"]).label("n"),
+            *_rollup_stats_columns(table),
+        )
+        .where(
+            table.c.plant_id == plant_id,
+            table.c.bucket_start >= inner_start,
+            table.c.bucket_start < inner_end,
+        )
+        .group_by(bucket)
+    )
+    _fold_rows(result.all(), buckets)
+
+    # Rows the rollup worker hasn't reached yet.
+    await _fold_raw(
+        session,
+        buckets,
+        plant_id,
+        inner_start,
+        inner_end,
+        stride,
+        above_id=watermark,
+    )
+
+    for edge_start, edge_end in ((start, inner_start), (inner_end, end)):
+        await _fold_range(
+            session, buckets, plant_id, edge_start, edge_end, stride, finer, watermark
+        )
+
+
+async def aggregate_readings(
+    session: AsyncSession,
+    plant_id: int,
+    start: datetime,
+    end: datetime,
+    stride: timedelta,
+) -> List[BucketAcc]:
+    """Bucketed partial aggregates over ``[start, end)``, oldest bucket first."""
+    buckets: Dict[datetime, BucketAcc] = {}
+
+    rollups = _rollups_for(stride)
+    watermark = 0
+    if rollups:
+        watermark = (
+            await session.execute(
+                select(RollupWatermark.last_id).where(
+                    RollupWatermark.name == WATERMARK_NAME
+                )
+            )
+        ).scalar() or 0
+
+    await _fold_range(
+        session, buckets, plant_id, start, end, stride, rollups, watermark
+    )
+    return [buckets[k] for k in sorted(buckets)]
+
+
+# ── LTTB ──────────────────────────────────────────────────────────────────────
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: indices of ``threshold`` points that best
+    preserve the shape of the series.  Always keeps the first and last point.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the *next* bucket is the third triangle vertex.
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        span = nxt_end - nxt_start
+        avg_x = sum(xs[nxt_start:nxt_end]) / span
+        avg_y = sum(ys[nxt_start:nxt_end]) / span
+
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs(
+                (xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a])
+            )
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def downsample(buckets: List[BucketAcc], metric: str, points: int) -> List[BucketAcc]:
+    """Keep the ``points`` buckets LTTB picks for ``metric``'s average."""
+    series = [b for b in buckets if b.metrics[metric].n]
+    xs = [b.start.timestamp() for b in series]
+    ys = [b.metrics[metric].avg or 0.0 for b in series]
+    return [series[i] for i in lttb(xs, ys, points)]
@@ -0,0 +1,318 @@
+"""
+vision_cache.py
+───────────────
+Content-addressed cache of vision results, checked before the Vision
+Microservice is called.
+
+An ESP32-CAM on a fixed schedule uploads many near-identical frames — a
+static scene, or pitch black at night.  Each image is fingerprinted by
+
+  • its SHA-256 (exact duplicates), and
+  • a 64-bit difference hash (dHash) of a 9×8 grayscale thumbnail, so frames
+    that differ only by JPEG noise or a little light still match when their
+    hashes are within ``VISION_CACHE_HAMMING`` bits.
+
+The key also includes the inputs that change the service's answer —
+``plant_species`` and ``force_universal``.  Only successful results are
+cached.  A hit copies the earlier image's vision fields onto the new row
+and skips inference.  Entries are shared across plants — the fields describe
+only the frame — so anything plant-specific, like the LLM diagnosis, must not
+be carried over from a hit on another plant's image (see ``inference``).
+
+The in-memory cache is an LRU of ``VISION_CACHE_SIZE`` entries per process.
+With ``VISION_CACHE_PERSIST=1`` entries are also written to the
+``vision_cache`` table and a memory miss falls back to it — exact matches
+by index, perceptual matches among the newest ``VISION_CACHE_SIZE`` rows for
+the key — so every worker process and restarts share one cache.
+
+The perceptual hash is computed with Pillow; if it isn't installed only
+exact duplicates are caught.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from models import Image, VisionCacheEntry
+
+logger = logging.getLogger("plantvita.backend.vision_cache")
+
+# ── Config ────────────────────────────────────────────────────────────────────
+
+VISION_CACHE_SIZE: int = int(os.getenv("VISION_CACHE_SIZE", "1024"))  # 0 = off
+VISION_CACHE_HAMMING: int = int(os.getenv("VISION_CACHE_HAMMING", "4"))
+VISION_CACHE_PERSIST: bool = os.getenv("VISION_CACHE_PERSIST", "0") == "1"
+_HASH_CHUNK = 256 * 1024
+
+# Vision result key → Image column.
+RESULT_COLUMNS: Dict[str, str] = {
+    "green_density": "green_density",
+    "segmentation_success": "segmentation_success",
+    "species": "detected_species",
+    "species_confidence": "species_confidence",
+    "in_model_scope": "in_model_scope",
+    "health": "detected_health",
+    "health_confidence": "health_confidence",
+    "trigger_llm": "trigger_llm",
+}
+
+_PERCEPTUAL_LOOKUP = text(
+    """
+    SELECT source_image_id FROM (
+        SELECT source_image_id, phash, id FROM vision_cache
+        WHERE plant_species IS NOT DISTINCT FROM :species
+          AND force_universal = :force_universal
+          AND phash IS NOT NULL
+        ORDER BY id DESC
+        LIMIT :window
+    ) recent
+    WHERE bit_count((phash # :phash)::bit(64)) <= :max_distance
+    ORDER BY bit_count((phash # :phash)::bit(64)), id DESC
+    LIMIT 1
+    """
+)
+
+
+# ── Fingerprints ──────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    sha256: str
+    phash: Optional[int]  # unsigned 64-bit dHash, None if not computable
+
+
+def _sha256(image: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: image.read(_HASH_CHUNK), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _dhash(image: BinaryIO) -> Optional[int]:
+    try:
+        from PIL import Image as PILImage  # type: ignore[import]
+    except ImportError:
+        return None
+    try:
+        with PILImage.open(image) as img:
+            img.draft("L", (64, 64))  # let libjpeg decode at reduced size
+            small = img.convert("L").resize((9, 8), PILImage.Resampling.BILINEAR)
+            pixels = list(small.getdata())
+    except Exception:  # noqa: BLE001 — corrupt / truncated upload
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _fingerprint(image: BinaryIO, sha256: Optional[str]) -> Fingerprint:
+    try:
+        if sha256 is None:
+            sha256 = _sha256(image)
+            image.seek(0)
+        return Fingerprint(sha256, _dhash(image))
+    finally:
+        image.seek(0)
+
+
+async def fingerprint(image: BinaryIO, sha256: Optional[str] = None) -> Fingerprint:
+    """
+    SHA-256 + dHash of an uploaded image file, read in place off the event
+    loop.  ``sha256`` is the digest recorded at upload, if any (rows stored
+    before it was hashed on ingest have none).  The file is left rewound.
+    """
+    return await asyncio.to_thread(_fingerprint, image, sha256)
+
+
+# ── Cache ─────────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class CacheHit:
+    result: Dict[str, Any]
+    source_image_id: int
+    kind: str  # exact / perceptual / persisted
+
+
+_Key = Tuple[Optional[str], bool, str]
+
+
+class VisionCache:
+    """LRU of successful vision results keyed by fingerprint and inputs."""
+
+    def __init__(self, max_entries: int, max_distance: int) -> None:
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[_Key, Tuple[Optional[int], CacheHit]]" = (
+            OrderedDict()
+        )
+        self.hits: Dict[str, int] = {"exact": 0, "perceptual": 0, "persisted": 0}
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self, fp: Fingerprint, species: Optional[str], force_universal: bool
+    ) -> Optional[CacheHit]:
+        key = (species, force_universal, fp.sha256)
+        found = self._entries.get(key)
+        if found is not None:
+            self._entries.move_to_end(key)
+            return CacheHit(found[1].result, found[1].source_image_id, "exact")
+
+        if fp.phash is None:
+            return None
+        best: Optional[Tuple[int, _Key]] = None
+        for other_key, (phash, _) in self._entries.items():
+            if other_key[:2] != (species, force_universal) or phash is None:
+                continue
+            distance = (phash ^ fp.phash).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, other_key)
+        if best is None:
+            return None
+        self._entries.move_to_end(best[1])
+        hit = self._entries[best[1]][1]
+        return CacheHit(hit.result, hit.source_image_id, "perceptual")
+
+    def put(
+        self,
+        fp: Fingerprint,
+        species: Optional[str],
+        force_universal: bool,
+        hit: CacheHit,
+    ) -> None:
+        key = (species, force_universal, fp.sha256)
+        self._entries[key] = (fp.phash, hit)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            "enabled": self.max_entries > 0,
+            "persist": VISION_CACHE_PERSIST,
+            "entries": len(self._entries),
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+vision_cache = VisionCache(VISION_CACHE_SIZE, VISION_CACHE_HAMMING)
+
+
+def result_from_image(img: Image) -> Dict[str, Any]:
+    """The vision result an analysed Image row holds."""
+    return {key: getattr(img, column) for key, column in RESULT_COLUMNS.items()}
+
+
+async def _lookup_persisted(
+    session: AsyncSession, fp: Fingerprint, species: Optional[str], force: bool
+) -> Optional[CacheHit]:
+    result = await session.execute(
+        select(VisionCacheEntry.source_image_id)
+        .where(
+            VisionCacheEntry.sha256 == fp.sha256,
+            VisionCacheEntry.plant_species.is_not_distinct_from(  # type: ignore[union-attr]
+                species
+            ),
+            VisionCacheEntry.force_universal == force,
+        )
+        .order_by(VisionCacheEntry.id.desc())  # type: ignore[union-attr]
+        .limit(1)
+    )
+    source_id = result.scalar()
+    if source_id is None and fp.phash is not None:
+        result = await session.execute(
+            _PERCEPTUAL_LOOKUP,
+            {
+                "species": species,
+                "force_universal": force,
+                "phash": _to_signed(fp.phash),
+                "window": max(VISION_CACHE_SIZE, 1),
+                "max_distance": VISION_CACHE_HAMMING,
+            },
+        )
+        source_id = result.scalar()
+    if source_id is None:
+        return None
+
+    img = await session.get(Image, source_id)
+    if img is None or img.vision_error is not None:
+        return None
+    return CacheHit(result_from_image(img), source_id, "persisted")
+
+
+async def lookup(
+    session: AsyncSession,
+    fp: Fingerprint,
+    species: Optional[str],
+    force_universal: bool,
+) -> Optional[CacheHit]:
+    """Cached result for this image and inputs, or None (a miss)."""
+    if VISION_CACHE_SIZE <= 0:
+        return None
+    hit = vision_cache.get(fp, species, force_universal)
+    if hit is None and VISION_CACHE_PERSIST:
+        hit = await _lookup_persisted(session, fp, species, force_universal)
+        if hit is not None:
+            vision_cache.put(fp, species, force_universal, hit)
+    if hit is None:
+        vision_cache.misses += 1
+    else:
+        vision_cache.hits[hit.kind] += 1
+    return hit
+
+
+async def store(
+    session: AsyncSession,
+    fp: Fingerprint,
+    species: Optional[str],
+    force_universal: bool,
+    result: Dict[str, Any],
+    image_id: int,
+) -> None:
+    """
+    Remember a successful result.  The persisted row is added to ``session``
+    and commits together with the image's vision fields.
+    """
+    if VISION_CACHE_SIZE <= 0 or result.get("vision_error"):
+        return
+    cached = {key: result.get(key) for key in RESULT_COLUMNS}
+    vision_cache.put(
+        fp, species, force_universal, CacheHit(cached, image_id, "exact")
+    )
+    if VISION_CACHE_PERSIST:
+        session.add(
+            VisionCacheEntry(
+                sha256=fp.sha256,
+                phash=_to_signed(fp.phash) if fp.phash is not None else None,
+                plant_species=species,
+                force_universal=force_universal,
+                source_image_id=image_id,
+            )
+        )
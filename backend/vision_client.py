@@ -6,23 +6,63 @@ Thin async wrapper around the Plant-Vita Vision Microservice.
 The vision service runs on the host machine (outside Docker) at
 VISION_SERVICE_URL (default: http://host.docker.internal:8001).
 
-Usage inside a FastAPI BackgroundTask:
+Usage inside an inference job:
     from vision_client import call_vision_service
-    result = await call_vision_service(jpeg_bytes)
+    result = await call_vision_service(image, plant_species)
+
+``image`` is JPEG bytes or an open binary file — the multipart encoder reads
+(and rewinds) a file in chunks, so a stored image is never copied into memory.
 
 All network errors are caught and returned as a degraded result dict so the
 caller never has to handle exceptions — the upload always succeeds even if
 vision analysis is temporarily unavailable.
+
+Micro-batching
+──────────────
+SAM3 + ResNet18 run on CPU, where one forward pass over N images costs far
+less than N passes.  Concurrent calls are therefore collected by
+``VisionBatcher`` for up to ``VISION_BATCH_MAX`` images or
+``VISION_BATCH_WINDOW_MS`` milliseconds, whichever comes first, and sent as
+one ``POST /analyze/batch``; each caller gets its own result back.  A lone
+image goes to ``/analyze`` (or ``/analyze/targeted``) as before, and if the
+service has no batch endpoint (404 / 405) the batcher falls back to one
+request per image for the rest of the process.  ``VISION_BATCH_MAX=1``
+disables batching.
+
+Batches only fill if enough calls are in flight at once — per inference
+worker process that is ``INFERENCE_CONCURRENCY``.
+
+``vision_stub.py`` is a stand-in service with the same endpoints for
+measuring throughput without the models.
+
+Outages
+───────
+``vision_breaker`` trips after ``VISION_BREAKER_FAILURES`` consecutive
+timeouts / connection errors / 5xx responses.  While it is open, calls return
+the degraded result at once instead of each waiting out ``VISION_TIMEOUT``
+(the inference job then retries later); after ``VISION_BREAKER_RESET``
+seconds one call goes through as a probe.  ``health_monitor_loop`` polls
+``/health`` every ``VISION_HEALTH_INTERVAL`` seconds and caches the answer
+for the backend's own ``/health``; a successful poll also half-opens the
+breaker, so recovery is noticed without waiting for the reset timeout.
 """
 
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
 import os
-from typing import Optional
+import time
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Set, Union
 
 import httpx
 
+from circuit_breaker import CircuitBreaker
+from http_clients import VISION, get_client
+
 logger = logging.getLogger("plantvita.backend.vision_client")
 
 # ── Config ────────────────────────────────────────────────────────────────────
@@ -37,6 +77,13 @@ _API_KEY: str = os.getenv("VISION_INFERENCE_KEY", "")
 # Total timeout per request.  SAM3 + ResNet can take 5-20 s on CPU.
 _TIMEOUT_SECONDS: float = float(os.getenv("VISION_TIMEOUT", "60"))
 
+VISION_BATCH_MAX: int = int(os.getenv("VISION_BATCH_MAX", "8"))
+VISION_BATCH_WINDOW_MS: float = float(os.getenv("VISION_BATCH_WINDOW_MS", "50"))
+
+VISION_BREAKER_FAILURES: int = int(os.getenv("VISION_BREAKER_FAILURES", "5"))
+VISION_BREAKER_RESET: float = float(os.getenv("VISION_BREAKER_RESET", "30"))
+VISION_HEALTH_INTERVAL: float = float(os.getenv("VISION_HEALTH_INTERVAL", "15"))
+
 # ── Sentinel returned when the service is unreachable ────────────────────────
 
 _DEGRADED_RESULT: dict = {
@@ -54,59 +101,43 @@ _DEGRADED_RESULT: dict = {
 
 # ── Client ────────────────────────────────────────────────────────────────────
 
+vision_breaker = CircuitBreaker(
+    "vision",
+    failure_threshold=VISION_BREAKER_FAILURES,
+    reset_timeout=VISION_BREAKER_RESET,
+    probe_timeout=_TIMEOUT_SECONDS,
+)
 
-async def call_vision_service(
-    jpeg_bytes: bytes,
-    plant_species: Optional[str],
-    filename: str = "image.jpg",
-    force_universal: bool = False
-) -> dict:
-    """
-    POST ``jpeg_bytes`` to ``POST {VISION_SERVICE_URL}/analyze``.
 
-    Returns the parsed JSON dict on success, or ``_DEGRADED_RESULT`` on any
-    network / HTTP error — so callers never need a try/except.
+ImageData = Union[bytes, BinaryIO]
 
-    Parameters
-    ----------
-    jpeg_bytes:
-        Raw JPEG bytes straight from the ESP32-CAM upload.
-    filename:
-        Filename hint in the multipart payload (cosmetic only).
-    """
+
+def _headers() -> dict[str, str]:
     headers: dict[str, str] = {}
     if _API_KEY:
         headers["X-Inference-Key"] = _API_KEY
+    return headers
 
-    ENDPOINT_URL = "analyze/targeted"
 
-    if plant_species is None or force_universal:
-        ENDPOINT_URL = "analyze"
+def _is_outage(exc: Exception) -> bool:
+    """Failures that say the service is down, not that the request was bad."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)  # timeouts, refused, reset …
 
-    try:
-        async with httpx.AsyncClient(timeout=_TIMEOUT_SECONDS) as client:
-            response = await client.post(
-                f"{_BASE_URL}/{ENDPOINT_URL}",
-                headers=headers,
-                files={"file": (filename, jpeg_bytes, "image/jpeg")},
-                data={"plant_species": plant_species, "force_universal": str(force_universal).lower()},
-            )
-            response.raise_for_status()
-            result: dict = response.json()
-            logger.info(
-                "Vision service OK — species=%s(%.2f) health=%s seg=%s",
-                result.get("species"),
-                result.get("species_confidence", 0.0),
-                result.get("health"),
-                result.get("segmentation_success"),
-            )
-            return result
 
-    except httpx.TimeoutException:
+def _degraded(exc: Exception) -> dict:
+    """Map a request failure to the degraded result callers expect."""
+    if _is_outage(exc):
+        vision_breaker.record_failure()
+    else:
+        vision_breaker.record_success()  # it answered; the request was bad
+
+    if isinstance(exc, httpx.TimeoutException):
         logger.error("Vision service timed out after %.0fs", _TIMEOUT_SECONDS)
         return {**_DEGRADED_RESULT, "vision_error": "Vision service timed out"}
 
-    except httpx.HTTPStatusError as exc:
+    if isinstance(exc, httpx.HTTPStatusError):
         logger.error(
             "Vision service returned HTTP %d: %s",
             exc.response.status_code,
@@ -117,9 +148,237 @@ async def call_vision_service(
             "vision_error": f"Vision service HTTP {exc.response.status_code}",
         }
 
+    logger.error("Vision service unreachable: %s", exc)
+    return {**_DEGRADED_RESULT, "vision_error": str(exc)}
+
+
+def _log_result(result: dict) -> None:
+    logger.info(
+        "Vision service OK — species=%s(%.2f) health=%s seg=%s",
+        result.get("species"),
+        result.get("species_confidence") or 0.0,
+        result.get("health"),
+        result.get("segmentation_success"),
+    )
+
+
+async def _analyze_one(
+    image: ImageData,
+    plant_species: Optional[str],
+    filename: str,
+    force_universal: bool,
+) -> dict:
+    """One image, one request — the service's original single-image API."""
+    ENDPOINT_URL = "analyze/targeted"
+
+    if plant_species is None or force_universal:
+        ENDPOINT_URL = "analyze"
+
+    try:
+        response = await get_client(VISION).post(
+            f"{_BASE_URL}/{ENDPOINT_URL}",
+            headers=_headers(),
+            files={"file": (filename, image, "image/jpeg")},
+            data={
+                "plant_species": plant_species,
+                "force_universal": str(force_universal).lower(),
+            },
+            timeout=_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        vision_breaker.record_success()
+        result: dict = response.json()
+        _log_result(result)
+        return result
+
     except Exception as exc:  # noqa: BLE001
-        logger.error("Vision service unreachable: %s", exc)
-        return {**_DEGRADED_RESULT, "vision_error": str(exc)}
+        return _degraded(exc)
+
+
+@dataclass
+class _Pending:
+    image: ImageData
+    plant_species: Optional[str]
+    filename: str
+    force_universal: bool
+    future: asyncio.Future = field(repr=False)
+
+
+class _BatchUnsupported(Exception):
+    """The service has no ``/analyze/batch`` endpoint."""
+
+
+class VisionBatcher:
+    """
+    Collects concurrent ``submit`` calls into batched analyze requests.
+
+    A batch is flushed when it reaches ``max_items`` or ``window`` seconds
+    after its first image arrived.  Results are fanned back to the awaiting
+    callers in order.  A batch that fails because the service is down gives
+    every caller the degraded result; one the service rejected (a 4xx, a
+    malformed response — often one bad image) is resent image by image, so
+    only the offending image fails.
+    """
+
+    def __init__(self, max_items: int, window: float) -> None:
+        self.max_items = max_items
+        self.window = window
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+        self._batch_supported = True
+        self.requests = 0
+        self.images = 0
+        self.largest_batch = 0
+
+    async def submit(
+        self,
+        image: ImageData,
+        plant_species: Optional[str],
+        filename: str,
+        force_universal: bool,
+    ) -> dict:
+        loop = asyncio.get_running_loop()
+        item = _Pending(
+            image, plant_species, filename, force_universal, loop.create_future()
+        )
+        self._pending.append(item)
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await item.future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        # Keep a reference so the task isn't garbage-collected mid-flight.
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[_Pending]) -> None:
+        self.images += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        results: Optional[List[dict]] = None
+        if len(batch) > 1 and self._batch_supported:
+            try:
+                self.requests += 1
+                results = await self._analyze_batch(batch)
+            except _BatchUnsupported:
+                logger.warning(
+                    "Vision service has no /analyze/batch — sending images singly"
+                )
+                self._batch_supported = False
+            except Exception as exc:  # noqa: BLE001
+                if _is_outage(exc):
+                    results = [_degraded(exc)] * len(batch)
+                else:
+                    vision_breaker.record_success()  # it answered
+                    logger.warning(
+                        "Vision batch of %d rejected (%s) — retrying singly",
+                        len(batch),
+                        exc,
+                    )
+
+        if results is None:
+            self.requests += len(batch)
+            results = await asyncio.gather(
+                *(
+                    _analyze_one(
+                        p.image, p.plant_species, p.filename, p.force_universal
+                    )
+                    for p in batch
+                )
+            )
+
+        for pending, result in zip(batch, results):
+            if not pending.future.done():  # the caller may have been cancelled
+                pending.future.set_result(result)
+
+    async def _analyze_batch(self, batch: List[_Pending]) -> List[dict]:
+        items = [
+            {
+                "plant_species": p.plant_species,
+                "force_universal": p.force_universal,
+            }
+            for p in batch
+        ]
+        response = await get_client(VISION).post(
+            f"{_BASE_URL}/analyze/batch",
+            headers=_headers(),
+            files=[("files", (p.filename, p.image, "image/jpeg")) for p in batch],
+            data={"items": json.dumps(items)},
+            timeout=_TIMEOUT_SECONDS,
+        )
+        if response.status_code in (404, 405):
+            raise _BatchUnsupported()
+        response.raise_for_status()
+        vision_breaker.record_success()
+
+        results = response.json()["results"]
+        if len(results) != len(batch):
+            raise ValueError(
+                f"Vision batch returned {len(results)} results for {len(batch)} images"
+            )
+        out: List[dict] = []
+        for result in results:
+            if result.get("error"):
+                out.append({**_DEGRADED_RESULT, "vision_error": result["error"]})
+            else:
+                _log_result(result)
+                out.append(result)
+        logger.info("Vision batch of %d analysed", len(batch))
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "max_items": self.max_items,
+            "window_ms": self.window * 1000,
+            "batch_endpoint": self._batch_supported,
+            "requests": self.requests,
+            "images": self.images,
+            "largest_batch": self.largest_batch,
+            "pending": len(self._pending),
+        }
+
+
+vision_batcher = VisionBatcher(VISION_BATCH_MAX, VISION_BATCH_WINDOW_MS / 1000)
+
+
+async def call_vision_service(
+    image: ImageData,
+    plant_species: Optional[str],
+    filename: str = "image.jpg",
+    force_universal: bool = False,
+) -> dict:
+    """
+    Analyse ``image`` with the Vision Microservice — batched with other
+    concurrent calls when ``VISION_BATCH_MAX`` > 1.
+
+    Returns the parsed JSON dict on success, or ``_DEGRADED_RESULT`` on any
+    network / HTTP error, or straight away while ``vision_breaker`` is open —
+    so callers never need a try/except.
+
+    Parameters
+    ----------
+    image:
+        The ESP32-CAM JPEG — raw bytes or a binary file opened on it.
+    filename:
+        Filename hint in the multipart payload (cosmetic only).
+    """
+    if not vision_breaker.allow():
+        return {**_DEGRADED_RESULT, "vision_error": "Vision service circuit open"}
+
+    if VISION_BATCH_MAX <= 1:
+        return await _analyze_one(image, plant_species, filename, force_universal)
+    return await vision_batcher.submit(
+        image, plant_species, filename, force_universal
+    )
 
 
 async def check_vision_health() -> Optional[dict]:
@@ -129,9 +388,39 @@ async def check_vision_health() -> Optional[dict]:
     Used by the backend's own ``/health`` endpoint.
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            r = await client.get(f"{_BASE_URL}/health")
-            r.raise_for_status()
-            return r.json()
+        r = await get_client(VISION).get(f"{_BASE_URL}/health", timeout=5.0)
+        r.raise_for_status()
+        return r.json()
     except Exception:
         return None
+
+
+# ── Health monitor ────────────────────────────────────────────────────────────
+
+_health: Dict[str, Any] = {"status": None, "checked_at": None, "latency_ms": None}
+
+
+async def refresh_vision_health() -> Optional[dict]:
+    """Probe the service now and update the cached status."""
+    started = time.monotonic()
+    status = await check_vision_health()
+    _health.update(
+        status=status,
+        checked_at=datetime.now(UTC).isoformat(),
+        latency_ms=round((time.monotonic() - started) * 1000, 1),
+    )
+    if status is not None:
+        vision_breaker.half_open()
+    return status
+
+
+async def health_monitor_loop() -> None:
+    """Background task: keep the cached vision status fresh."""
+    while True:
+        await refresh_vision_health()
+        await asyncio.sleep(VISION_HEALTH_INTERVAL)
+
+
+def vision_health() -> Dict[str, Any]:
+    """Last known vision-service status — no network call."""
+    return {**_health, "circuit": vision_breaker.state}
@@ -0,0 +1,122 @@
+"""
+vision_stub.py
+──────────────
+Stand-in for the Vision Microservice, for local development and for
+measuring backend throughput without SAM3 / ResNet18 installed.
+
+    uvicorn vision_stub:app --port 8001
+
+Serves the same endpoints the backend calls — ``/health``, ``/analyze``,
+``/analyze/targeted`` and ``/analyze/batch`` — and returns plausible,
+deterministic results (derived from the image hash).  Inference cost is
+simulated the way the real service behaves on CPU: one model at a time, a
+fixed overhead per forward pass (``VISION_STUB_OVERHEAD_MS``) plus a smaller
+cost per image in the pass (``VISION_STUB_PER_IMAGE_MS``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+
+_OVERHEAD_SECONDS: float = float(os.getenv("VISION_STUB_OVERHEAD_MS", "400")) / 1000
+_PER_IMAGE_SECONDS: float = float(os.getenv("VISION_STUB_PER_IMAGE_MS", "60")) / 1000
+_MAX_BATCH: int = int(os.getenv("VISION_STUB_MAX_BATCH", "32"))
+
+_SPECIES = ("Tomato", "Basil", "Pepper", "Mint", "Strawberry")
+_HEALTH = ("Healthy", "Early Blight", "Leaf Mold", "Powdery Mildew")
+
+app = FastAPI(title="Plant-Vita Vision Stub")
+
+# The real service has one model instance; passes run one after another.
+_model_lock = asyncio.Lock()
+_stats = {"passes": 0, "images": 0}
+
+
+async def _forward_pass(n_images: int) -> None:
+    async with _model_lock:
+        await asyncio.sleep(_OVERHEAD_SECONDS + _PER_IMAGE_SECONDS * n_images)
+        _stats["passes"] += 1
+        _stats["images"] += n_images
+
+
+def _result(
+    jpeg_bytes: bytes, plant_species: Optional[str], force_universal: bool
+) -> dict:
+    if not jpeg_bytes:
+        return {"error": "Empty image"}
+    digest = hashlib.sha256(jpeg_bytes).digest()
+    targeted = bool(plant_species) and not force_universal
+    species = plant_species if targeted else _SPECIES[digest[0] % len(_SPECIES)]
+    health = _HEALTH[digest[1] % len(_HEALTH)]
+    health_confidence = round(0.5 + digest[2] / 510, 3)
+    return {
+        "species": species,
+        "species_confidence": 1.0 if targeted else round(0.5 + digest[3] / 510, 3),
+        "in_model_scope": True,
+        "health": health,
+        "health_confidence": health_confidence,
+        "green_density": round(digest[4] / 255, 3),
+        "segmentation_success": True,
+        "trigger_llm": health != "Healthy" or health_confidence < 0.7,
+        "vision_error": None,
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "stub": True, **_stats}
+
+
+@app.post("/analyze")
+@app.post("/analyze/targeted")
+async def analyze(
+    file: UploadFile = File(...),
+    plant_species: Optional[str] = Form(None),
+    force_universal: bool = Form(False),
+):
+    jpeg_bytes = await file.read()
+    await _forward_pass(1)
+    result = _result(jpeg_bytes, plant_species, force_universal)
+    if result.get("error"):
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    items: str = Form(...),
+):
+    """
+    Batched analysis.  ``files`` are the images; ``items`` is a JSON list of
+    ``{"plant_species", "force_universal"}`` in the same order.  Returns
+    ``{"results": [...]}`` in that order; a bad image gets ``{"error": …}``
+    instead of failing the whole batch.
+    """
+    try:
+        specs = json.loads(items)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="items is not valid JSON")
+    if len(specs) != len(files):
+        raise HTTPException(status_code=400, detail="items / files length mismatch")
+    if len(files) > _MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {_MAX_BATCH} images")
+
+    images = [await f.read() for f in files]
+    await _forward_pass(len(images))
+    return {
+        "results": [
+            _result(
+                jpeg_bytes,
+                spec.get("plant_species"),
+                bool(spec.get("force_universal")),
+            )
+            for jpeg_bytes, spec in zip(images, specs)
+        ]
+    }